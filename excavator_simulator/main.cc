@@ -340,8 +340,9 @@ void PhysicsLoop(mj::Simulate& sim) {
       int size = mj_stateSize(m, spec);
       std::vector<mjtNum> soil_state(size);
       mj_getState(m, d, soil_state.data(), spec);
-      if (soil_state.size() != 1) {
-        mju_warning("Too many plugin state, disabling visual update");
+      if (soil_state.size() != 6) {
+        mju_warning(
+            "Unexpected number of plugin state, disabling visual update");
         soil_plugin = false;
       }
     } else {
@@ -0,0 +1,336 @@
+"""Benchmarks the pose calculation, the model generation and the simulation.
+
+The purpose of this file is to detect performance regressions by measuring the time
+taken by the main operations of this simulator:
+- pose_scalar: scalar pose calculation for a single pose, the printed output being
+  discarded,
+- pose_batch: pose calculation for a batch of poses,
+- bucket_penetration: penetration of the bucket into the terrain for a batch of poses,
+- process_model: processing of the excavator model properties,
+- render_template: rendering of the excavator template,
+- compile: compilation of the generated model into a MuJoCo model, each repetition
+  running in a new process so that the meshes are not in the cache of MuJoCo, as
+  when a worker starts,
+- step: simulation step, with the bucket moving through the terrain.
+The compile and step benchmarks are swept over the cell size, which sets the size of
+the grid, and the maximum number of iterations of the soil relaxation. They require
+the soil plugin library, whose folder is given with the --plugin option. The
+benchmarks that cannot be run are reported with their error instead of a time.
+
+Each benchmark is repeated several times and the minimum, median and mean time of a
+call are written into a JSON file, together with the commit and the machine used. Two
+JSON files can then be compared to find the benchmarks that became slower.
+
+Typical usage example:
+
+    python benchmark_suite.py --plugin PLUGIN_DIR --output before.json
+    python benchmark_suite.py --plugin PLUGIN_DIR --output after.json
+    python benchmark_suite.py --compare before.json after.json
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import mujoco
+import numpy as np
+import os
+import platform
+import statistics
+import subprocess
+import time
+from bucket_penetration import calc_bucket_penetration
+from model_generation import (
+    MODEL_PATH, _load_model_assets, _process_excavator_model, _render_template)
+from pose_calculation import _calc_excavator_pose, _calc_excavator_pose_batch
+
+
+# Relative slowdown above which a benchmark is reported as a regression
+REGRESSION_THRESHOLD = 0.1
+
+
+# ==================================================================================== #
+#                                                                                      #
+#                 Starting implementation of the benchmark suite                       #
+#                                                                                      #
+# ==================================================================================== #
+def run_benchmarks(
+        cell_sizes: tuple = (0.1, 0.05, 0.025), max_iterations: tuple = (3, 10),
+        n_repeat: int = 5, n_step: int = 200, n_pose: int = 100000,
+        plugin: str = None) -> dict:
+    """Runs all the benchmarks.
+
+    The soil plugin library has to be loaded beforehand, for instance with
+    mujoco.mj_loadAllPluginLibraries, for the compile and step benchmarks to run.
+
+    Args:
+        cell_sizes: Cell sizes used by the compile and step benchmarks. [m]
+        max_iterations: Maximum numbers of iterations of the soil relaxation used by
+                        the compile and step benchmarks.
+        n_repeat: Number of repetitions of each benchmark.
+        n_step: Number of simulation steps in each repetition of the step benchmark.
+        n_pose: Number of poses of the batch pose benchmark.
+        plugin: Folder containing the soil plugin library, loaded by the processes
+                of the compile benchmark.
+
+    Returns:
+        A dictionary containing the information on the machine and the results of each
+        benchmark.
+    """
+    rng = np.random.default_rng(0)
+    angle_boom = rng.uniform(0.0, np.pi / 4, n_pose)
+    angle_arm = rng.uniform(-np.pi / 2, 0.0, n_pose)
+    angle_bucket = rng.uniform(0.0, np.pi / 2, n_pose)
+    excavator_model = {"soil": {}, "pose": {}}
+    processed_excavator_model = _process_excavator_model(excavator_model)
+
+    benchmarks = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        benchmarks["pose_scalar"] = _time_call(
+            lambda: _calc_excavator_pose(0.5, -0.5, 0.7), n_repeat, 1000)
+    # Some random poses are invalid, which gives NaN values
+    with np.errstate(invalid="ignore"):
+        benchmarks["pose_batch[n_pose=%d]" % n_pose] = _time_call(
+            lambda: _calc_excavator_pose_batch(angle_boom, angle_arm, angle_bucket),
+            n_repeat, 1)
+        terrain = rng.uniform(0.0, 1.0, (320, 320))
+        benchmarks["bucket_penetration[n_pose=%d]" % n_pose] = _time_call(
+            lambda: calc_bucket_penetration(
+                terrain, (8.0, 8.0), 0.0, angle_boom[:, None], angle_arm[:, None],
+                angle_bucket[:, None]), n_repeat, 1)
+    benchmarks["process_model"] = _time_call(
+        lambda: _process_excavator_model(excavator_model), n_repeat, 10)
+    benchmarks["render_template"] = _time_call(
+        lambda: _render_template(processed_excavator_model), n_repeat, 10)
+
+    # Reading the assets of the models used by the step benchmark
+    assets = _load_model_assets()
+    for cell_size_xy in cell_sizes:
+        for max_iteration in max_iterations:
+            parameters = "[cell_size_xy=%g,max_iterations=%d]" % (
+                cell_size_xy, max_iteration)
+            generated_model = _render_template(_process_excavator_model({
+                "soil": {"cell_size_xy": cell_size_xy, "max_iterations": max_iteration},
+                "pose": {}}))
+
+            try:
+                benchmarks["compile" + parameters] = _time_compile(
+                    generated_model, n_repeat, plugin)
+                mj_model = mujoco.MjModel.from_xml_string(generated_model, assets)
+            except Exception as error:
+                benchmarks["compile" + parameters] = {"error": str(error)}
+                benchmarks["step" + parameters] = {"error": str(error)}
+                continue
+
+            benchmarks["step" + parameters] = _time_call(
+                _make_step(mj_model, n_step), n_repeat, 1, n_step)
+
+    return {"machine": _get_machine_info(), "benchmarks": benchmarks}
+
+
+def compare_benchmarks(reference: dict, results: dict) -> list:
+    """Compares the results of two runs of the benchmark suite.
+
+    The benchmarks are compared with their minimum time, which is the least sensitive
+    to the load of the machine.
+
+    Args:
+        reference: Results of the reference run.
+        results: Results of the run to compare.
+
+    Returns:
+        A list of tuples containing the name of each benchmark present in both runs,
+        its minimum time in both runs, and the relative change of the minimum time.
+    """
+    comparison = []
+    for name, result in results["benchmarks"].items():
+        reference_result = reference["benchmarks"].get(name, {})
+        if "min" not in result or "min" not in reference_result:
+            continue
+        comparison.append((
+            name, reference_result["min"], result["min"],
+            result["min"] / reference_result["min"] - 1.0))
+    return comparison
+
+
+def _time_call(func, n_repeat: int, n_call: int, n_op: int = 1) -> dict:
+    """Measures the time taken by a function.
+
+    Args:
+        func: Function without argument to measure.
+        n_repeat: Number of repetitions.
+        n_call: Number of calls to the function in each repetition.
+        n_op: Number of operations performed by each call, the time being given per
+              operation.
+
+    Returns:
+        A dictionary containing the minimum, median and mean time of an operation. [s]
+    """
+    # Warming up, so that the first repetition does not include any initialization
+    func()
+
+    times = []
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        for _ in range(n_call):
+            func()
+        times.append((time.perf_counter() - start) / (n_call * n_op))
+    return {
+        "min": min(times), "median": statistics.median(times),
+        "mean": statistics.mean(times), "n_repeat": n_repeat, "n_call": n_call,
+        "n_op": n_op}
+
+
+def _time_compile(generated_model: str, n_repeat: int, plugin: str = None) -> dict:
+    """Measures the time taken to compile a model in a new process.
+
+    MuJoCo keeps the meshes it has compiled in a cache, so that compiling the same
+    model again in a process is several times faster. Each repetition therefore
+    compiles the model in a new process, without warming up.
+
+    Args:
+        generated_model: Generated excavator model.
+        n_repeat: Number of repetitions.
+        plugin: Folder containing the soil plugin library, or None.
+
+    Returns:
+        A dictionary containing the minimum, median and mean time of a compilation.
+        [s]
+    """
+    times = []
+    context = multiprocessing.get_context("spawn")
+    for _ in range(n_repeat):
+        with concurrent.futures.ProcessPoolExecutor(1, context) as executor:
+            times.append(executor.submit(
+                _compile_model, generated_model, plugin).result())
+    return {
+        "min": min(times), "median": statistics.median(times),
+        "mean": statistics.mean(times), "n_repeat": n_repeat, "n_call": 1,
+        "n_op": 1}
+
+
+def _compile_model(generated_model: str, plugin: str) -> float:
+    """Compiles a model and returns the time taken by the compilation.
+
+    This function is executed by a new process.
+
+    Args:
+        generated_model: Generated excavator model.
+        plugin: Folder containing the soil plugin library, or None.
+
+    Returns:
+        The time taken by the compilation. [s]
+    """
+    if plugin is not None:
+        mujoco.mj_loadAllPluginLibraries(plugin)
+
+    # Reading the assets beforehand to measure the compile time only
+    assets = _load_model_assets()
+    start = time.perf_counter()
+    mujoco.MjModel.from_xml_string(generated_model, assets)
+    return time.perf_counter() - start
+
+
+def _make_step(mj_model, n_step: int):
+    """Creates a function stepping a simulation.
+
+    The boom, arm and bucket are moved back and forth so that the bucket goes through
+    the terrain and the soil is updated.
+
+    Args:
+        mj_model: Compiled excavator model.
+        n_step: Number of simulation steps performed by each call.
+
+    Returns:
+        A function without argument performing n_step simulation steps.
+    """
+    mj_data = mujoco.MjData(mj_model)
+    ctrl = np.zeros((n_step, mj_model.nu))
+    phase = np.linspace(0.0, 2.0 * np.pi, n_step)
+    ctrl[:, 1] = -0.2 * np.cos(phase)
+    ctrl[:, 2] = 0.2 * np.sin(phase)
+    ctrl[:, 3] = 0.2 * np.sin(phase)
+
+    def step():
+        for ii in range(n_step):
+            mj_data.ctrl[:] = ctrl[ii]
+            mujoco.mj_step(mj_model, mj_data)
+
+    return step
+
+
+def _get_machine_info() -> dict:
+    """Gathers the information identifying the run.
+
+    Returns:
+        A dictionary containing the commit, the MuJoCo and NumPy versions, and the
+        description of the machine.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=MODEL_PATH, capture_output=True,
+            text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "mujoco": mujoco.__version__,
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "n_cpu": os.cpu_count(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the pose calculation, model generation and simulation.")
+    parser.add_argument(
+        "-o", "--output", default="benchmark.json", help="Output JSON file.")
+    parser.add_argument(
+        "--plugin", default=None,
+        help="Folder containing the soil plugin library, required by the compile and "
+             "step benchmarks.")
+    parser.add_argument(
+        "--cell_size_xy", type=float, nargs="+", default=[0.1, 0.05, 0.025],
+        help="Cell sizes used by the compile and step benchmarks.")
+    parser.add_argument(
+        "--max_iterations", type=int, nargs="+", default=[3, 10],
+        help="Maximum numbers of iterations used by the compile and step benchmarks.")
+    parser.add_argument(
+        "--n_repeat", type=int, default=5, help="Number of repetitions.")
+    parser.add_argument(
+        "--n_step", type=int, default=200,
+        help="Number of simulation steps in each repetition of the step benchmark.")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("REFERENCE", "RESULTS"), default=None,
+        help="Compare two JSON files instead of running the benchmarks.")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        with open(args.compare[0], "r") as reference_file:
+            reference = json.load(reference_file)
+        with open(args.compare[1], "r") as results_file:
+            results = json.load(results_file)
+        for name, reference_time, new_time, change in compare_benchmarks(
+                reference, results):
+            print("%-50s %12.3e %12.3e %+7.1f%%%s" % (
+                name, reference_time, new_time, 100.0 * change,
+                "  REGRESSION" if change > REGRESSION_THRESHOLD else ""))
+    else:
+        if args.plugin is not None:
+            mujoco.mj_loadAllPluginLibraries(args.plugin)
+        results = run_benchmarks(
+            args.cell_size_xy, args.max_iterations, args.n_repeat, args.n_step,
+            plugin=args.plugin)
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+        for name, result in results["benchmarks"].items():
+            if "min" in result:
+                print("%-50s %12.3e s" % (name, result["min"]))
+            else:
+                print("%-50s %s" % (name, result["error"].splitlines()[0]))
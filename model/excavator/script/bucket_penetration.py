@@ -0,0 +1,241 @@
+"""Calculates the penetration of the bucket into the terrain for many candidate poses.
+
+The purpose of the functions in this file is to evaluate dig candidates at once, for
+instance for dig planning, without simulating them. A candidate is a sequence of
+excavator poses followed by the bucket, each pose being given by the chassis, boom,
+arm and bucket angles. For each pose, the cutting edge of the bucket is calculated in
+the world frame, including the chassis rotation, and sampled with a number of points
+over the bucket width. The terrain height below each point is then obtained by bilinear
+interpolation of a height map laid out like the terrain HField.
+
+The output of each candidate is:
+- the penetration depth, that is the maximum depth of the cutting edge below the
+  terrain over the whole candidate,
+- the swept volume, that is the volume of soil located above the cutting edge and
+  crossed by the cutting edge while moving from one pose to the next.
+The swept volume is approximated by integrating, for each point of the cutting edge,
+the mean penetration depth over each motion multiplied by the horizontal distance
+travelled, and the terrain is not modified along the candidate. A candidate with a
+single pose therefore has a zero swept volume.
+
+Some information about this file:
+- The angles follow the convention of the pose calculation. [rad]
+- The positions are given in m in the world frame.
+- The height map follows the convention of load_terrain, that is terrain[ii, jj] is
+  the height of the HField vertex located at the ii-th position in the X direction
+  and the jj-th position in the Y direction, the vertices spanning the whole length
+  of the terrain. Points outside of the terrain are given the height of the closest
+  vertex on its border.
+
+Typical usage example:
+
+    terrain, grid_length = read_terrain(mj_model)
+    penetration = calc_bucket_penetration(
+        terrain, grid_length, angle_chassis, angle_boom, angle_arm, angle_bucket)
+    depth = penetration["depth"]
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import argparse
+import numpy as np
+import time
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+from kinematic_preview import _calc_link_positions
+
+
+# Width of the bucket simulated by the soil plugin [m]
+BUCKET_WIDTH = 0.68
+
+
+# ==================================================================================== #
+#                                                                                      #
+#       Starting implementation of functions used to calculate the bucket edge         #
+#                                                                                      #
+# ==================================================================================== #
+def _calc_bucket_edge(
+        angle_chassis: np.ndarray, angle_boom: np.ndarray, angle_arm: np.ndarray,
+        angle_bucket: np.ndarray, n_edge_point: int = 5,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the points of the bucket cutting edge in the world frame.
+
+    The cutting edge is the segment going through the bucket teeth, perpendicular to
+    the vertical plane of the chassis, and whose length is the bucket width. It is
+    sampled at the center of n_edge_point segments of equal length. The inputs are
+    broadcasted against each other.
+
+    Args:
+        angle_chassis: Angle of the chassis around the vertical axis. [rad]
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        n_edge_point: Number of points sampling the cutting edge.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The position of the points, with the broadcasted shape of the inputs followed
+        by (n_edge_point, 3). [m]
+    """
+    pos_teeth = _calc_link_positions(
+        angle_chassis, angle_boom, angle_arm, angle_bucket, geometry)["pos_teeth"]
+    angle_chassis = np.broadcast_to(angle_chassis, pos_teeth.shape[:-1])
+
+    # Lateral direction of the chassis, along which the cutting edge lies
+    lateral = np.stack(
+        (-np.sin(angle_chassis), np.cos(angle_chassis), np.zeros(angle_chassis.shape)),
+        axis=-1)
+    offset = BUCKET_WIDTH * ((np.arange(n_edge_point) + 0.5) / n_edge_point - 0.5)
+    return pos_teeth[..., None, :] + offset[:, None] * lateral[..., None, :]
+
+
+# ==================================================================================== #
+#                                                                                      #
+#         Starting implementation of functions used to query the terrain height        #
+#                                                                                      #
+# ==================================================================================== #
+def _calc_terrain_height(
+        terrain: np.ndarray, grid_length: tuple, pos_x: np.ndarray,
+        pos_y: np.ndarray) -> np.ndarray:
+    """Interpolates the terrain height at a batch of positions.
+
+    The height is bilinearly interpolated between the four surrounding vertices of
+    the height map, which corresponds to the surface of the HField in MuJoCo up to
+    the diagonal of each cell. The positions are clamped to the terrain.
+
+    Args:
+        terrain: Height map of the terrain, following the convention of load_terrain.
+                 [m]
+        grid_length: Half-length of the terrain in the X and Y direction. [m]
+        pos_x: Position in the X direction. [m]
+        pos_y: Position in the Y direction, of the same shape as pos_x. [m]
+
+    Returns:
+        The terrain height at each position, of the same shape as pos_x. [m]
+    """
+    n_x, n_y = terrain.shape
+    terrain = np.ascontiguousarray(terrain, dtype=np.float64).ravel()
+
+    # Calculating the index of the lower vertex and the position inside the cell
+    index_x = np.clip(
+        (pos_x + grid_length[0]) * ((n_x - 1) / (2.0 * grid_length[0])), 0.0, n_x - 1)
+    index_y = np.clip(
+        (pos_y + grid_length[1]) * ((n_y - 1) / (2.0 * grid_length[1])), 0.0, n_y - 1)
+    ii = np.minimum(index_x.astype(np.intp), n_x - 2)
+    jj = np.minimum(index_y.astype(np.intp), n_y - 2)
+    tx = index_x - ii
+    ty = index_y - jj
+
+    index = ii * n_y + jj
+    h_00 = terrain[index]
+    h_01 = terrain[index + 1]
+    h_10 = terrain[index + n_y]
+    h_11 = terrain[index + n_y + 1]
+    return (1.0 - tx) * ((1.0 - ty) * h_00 + ty * h_01) + tx * (
+        (1.0 - ty) * h_10 + ty * h_11)
+
+
+def _calc_edge_penetration(
+        terrain: np.ndarray, grid_length: tuple, pos_edge: np.ndarray) -> dict:
+    """Calculates the penetration of the cutting edge along a batch of candidates.
+
+    Args:
+        terrain: Height map of the terrain, following the convention of load_terrain.
+                 [m]
+        grid_length: Half-length of the terrain in the X and Y direction. [m]
+        pos_edge: Position of the cutting edge points, of shape
+                  (..., n_pose, n_edge_point, 3), the poses of each candidate being
+                  ordered along the second-to-last axis. [m]
+
+    Returns:
+        A dictionary containing the penetration depth (depth) and the swept volume
+        (swept_volume) of each candidate, of shape (...). [m, m^3]
+    """
+    height = _calc_terrain_height(
+        terrain, grid_length, pos_edge[..., 0], pos_edge[..., 1])
+    depth = np.maximum(height - pos_edge[..., 2], 0.0)
+
+    # Integrating the mean depth of each point over the horizontal distance travelled
+    n_edge_point = pos_edge.shape[-2]
+    distance = np.hypot(
+        np.diff(pos_edge[..., 0], axis=-2), np.diff(pos_edge[..., 1], axis=-2))
+    area = 0.5 * (depth[..., 1:, :] + depth[..., :-1, :]) * distance
+    swept_volume = (BUCKET_WIDTH / n_edge_point) * area.sum(axis=(-2, -1))
+
+    return {"depth": depth.max(axis=(-2, -1)), "swept_volume": swept_volume}
+
+
+def calc_bucket_penetration(
+        terrain: np.ndarray, grid_length: tuple, angle_chassis: np.ndarray,
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        n_edge_point: int = 5,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> dict:
+    """Calculates the penetration of the bucket into the terrain for many candidates.
+
+    The input angles are broadcasted against each other, the last axis being the
+    sequence of poses of each candidate. For instance, angles of shape
+    (n_candidate, n_pose) give the result of n_candidate candidates, while angles of
+    shape (n_candidate, 1) only give the penetration depth of each pose.
+
+    Note that the candidate poses are not checked, so that invalid poses give NaN.
+
+    Args:
+        terrain: Height map of the terrain, following the convention of load_terrain.
+                 [m]
+        grid_length: Half-length of the terrain in the X and Y direction. [m]
+        angle_chassis: Angle of the chassis around the vertical axis. [rad]
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        n_edge_point: Number of points sampling the cutting edge.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A dictionary containing the penetration depth (depth) and the swept volume
+        (swept_volume) of each candidate, with the broadcasted shape of the input
+        angles without its last axis. [m, m^3]
+    """
+    angles = np.broadcast_arrays(
+        np.asarray(angle_chassis, dtype=np.float64),
+        np.asarray(angle_boom, dtype=np.float64),
+        np.asarray(angle_arm, dtype=np.float64),
+        np.asarray(angle_bucket, dtype=np.float64))
+    if angles[0].ndim == 0:
+        raise Exception("The candidate angles should have at least one dimension.")
+
+    pos_edge = _calc_bucket_edge(*angles, n_edge_point, geometry)
+    return _calc_edge_penetration(terrain, grid_length, pos_edge)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the time taken by the bucket penetration query.")
+    parser.add_argument(
+        "--n_candidate", type=int, default=100000, help="Number of candidates.")
+    parser.add_argument(
+        "--n_pose", type=int, default=10, help="Number of poses of each candidate.")
+    args = parser.parse_args()
+
+    # Generating a smooth terrain following the default HField
+    rng = np.random.default_rng(0)
+    grid_x = np.linspace(-8.0, 8.0, 320)
+    terrain = 0.3 * np.sin(grid_x[:, None]) * np.cos(0.5 * grid_x[None, :])
+
+    # Drawing candidates moving the bucket around the default pose
+    shape = (args.n_candidate, 1)
+    sweep = np.linspace(0.0, 1.0, args.n_pose)
+    angle_chassis = rng.uniform(-np.pi, np.pi, shape)
+    angle_boom = np.deg2rad(rng.uniform(0.0, 30.0, shape) - 30.0 * sweep)
+    angle_arm = np.deg2rad(rng.uniform(-90.0, -30.0, shape) + 20.0 * sweep)
+    angle_bucket = np.deg2rad(rng.uniform(0.0, 40.0, shape) + 40.0 * sweep)
+
+    start = time.perf_counter()
+    with np.errstate(invalid="ignore"):
+        penetration = calc_bucket_penetration(
+            terrain, (8.0, 8.0), angle_chassis, angle_boom, angle_arm, angle_bucket)
+    elapsed = time.perf_counter() - start
+    print("%d candidates of %d poses: %.3f s" % (
+        args.n_candidate, args.n_pose, elapsed))
+    print("Candidates in contact with the terrain: %d" % np.sum(
+        penetration["depth"] > 0.0))
+    print("Mean swept volume: %.3f m^3" % np.nanmean(penetration["swept_volume"]))
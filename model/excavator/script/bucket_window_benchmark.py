@@ -0,0 +1,146 @@
+"""Benchmarks the bucket soil HField window.
+
+The purpose of this file is to measure the saving obtained when the two bucket soil
+HFields only cover a window following the bucket, instead of the whole grid. For
+several cell sizes, the following quantities are reported with and without window:
+- the number of HField cells, which sets the memory used by the HFields,
+- the time to write all HField cells, as done by the soil plugin at every soil update,
+- the time to upload the HFields to the GPU, as done by the simulator at every soil
+  update. This requires an OpenGL context and is skipped otherwise.
+
+Only the HFields are compiled, so that the benchmark does not require the soil plugin.
+
+Typical usage example:
+
+    python bucket_window_benchmark.py --cell_size_xy 0.05 0.025 0.0125
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import argparse
+import mujoco
+import numpy as np
+import time
+from model_generation import _process_excavator_model
+
+
+# ==================================================================================== #
+#                                                                                      #
+#         Starting implementation of functions used to benchmark the HFields           #
+#                                                                                      #
+# ==================================================================================== #
+def benchmark_bucket_window(
+        cell_sizes: list, n_repeat: int = 20, upload: bool = True) -> list:
+    """Measures the cost of the HFields with and without bucket soil window.
+
+    Args:
+        cell_sizes: List of cell sizes in the horizontal direction. [m]
+        n_repeat: Number of repetitions used to measure the times.
+        upload: Whether the upload time to the GPU is measured.
+
+    Returns:
+        A list of dictionaries containing, for each cell size and window option, the
+        number of HField cells, the write time and the upload time (None when not
+        measured). [s]
+    """
+    gl_context = None
+    if upload:
+        try:
+            gl_context = mujoco.GLContext(64, 64)
+            gl_context.make_current()
+        except Exception:
+            gl_context = None
+
+    results = []
+    for cell_size_xy in cell_sizes:
+        for bucket_window in [False, True]:
+            soil = _process_excavator_model(
+                {"soil": {"cell_size_xy": cell_size_xy, "bucket_window": bucket_window},
+                 "pose": {}})["soil"]
+            mj_model = mujoco.MjModel.from_xml_string(_calc_hfield_model(soil))
+
+            # Writing all cells, as the soil plugin does at every soil update
+            hfield_data = mj_model.hfield_data
+            values = np.random.default_rng(0).random(mj_model.nhfielddata)
+            start = time.perf_counter()
+            for _ in range(n_repeat):
+                hfield_data[:] = values
+            write_time = (time.perf_counter() - start) / n_repeat
+
+            # Uploading all HFields, as the simulator does at every soil update
+            upload_time = None
+            if gl_context is not None:
+                try:
+                    mjr_context = mujoco.MjrContext(
+                        mj_model, mujoco.mjtFontScale.mjFONTSCALE_100)
+                except Exception:
+                    # No valid OpenGL context is available, e.g. on a headless machine
+                    gl_context.free()
+                    gl_context = None
+            if gl_context is not None:
+                start = time.perf_counter()
+                for _ in range(n_repeat):
+                    for hfield_id in range(mj_model.nhfield):
+                        mujoco.mjr_uploadHField(mj_model, mjr_context, hfield_id)
+                upload_time = (time.perf_counter() - start) / n_repeat
+                mjr_context.free()
+
+            results.append({
+                "cell_size_xy": cell_size_xy,
+                "bucket_window": bucket_window,
+                "n_cell": mj_model.nhfielddata,
+                "write_time": write_time,
+                "upload_time": upload_time,
+            })
+
+    if gl_context is not None:
+        gl_context.free()
+    return results
+
+
+def _calc_hfield_model(processed_soil: dict) -> str:
+    """Writes a model containing only the HFields of the excavator model.
+
+    Args:
+        processed_soil: Soil dictionary of the processed excavator model.
+
+    Returns:
+        The model containing the three HFields.
+    """
+    hfields = [
+        ("terrain", "grid_size_x", "grid_size_y", "grid_length_x", "grid_length_y"),
+        ("bucket soil 1", "bucket_grid_size_x", "bucket_grid_size_y",
+         "bucket_grid_length_x", "bucket_grid_length_y"),
+        ("bucket soil 2", "bucket_grid_size_x", "bucket_grid_size_y",
+         "bucket_grid_length_x", "bucket_grid_length_y"),
+    ]
+    assets = ""
+    geoms = ""
+    for name, size_x, size_y, length_x, length_y in hfields:
+        assets += '<hfield name="%s" nrow="%d" ncol="%d" size="%r %r %r 0.01"/>' % (
+            name, processed_soil[size_x], processed_soil[size_y],
+            processed_soil[length_x], processed_soil[length_y],
+            processed_soil["grid_length_z"])
+        geoms += '<geom type="hfield" hfield="%s"/>' % name
+    return "<mujoco><asset>%s</asset><worldbody>%s</worldbody></mujoco>" % (
+        assets, geoms)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the bucket soil window.")
+    parser.add_argument(
+        "--cell_size_xy", type=float, nargs="+", default=[0.1, 0.05, 0.025, 0.0125],
+        help="Cell sizes in the horizontal direction.")
+    parser.add_argument(
+        "--n_repeat", type=int, default=20, help="Number of repetitions.")
+    args = parser.parse_args()
+
+    results = benchmark_bucket_window(args.cell_size_xy, args.n_repeat)
+    print("%-12s %-7s %10s %14s %14s" % (
+        "cell size", "window", "cells", "write [ms]", "upload [ms]"))
+    for result in results:
+        upload_time = (
+            "%14.3f" % (1000.0 * result["upload_time"])
+            if result["upload_time"] is not None else "%14s" % "-")
+        print("%-12g %-7s %10d %14.3f %s" % (
+            result["cell_size_xy"], result["bucket_window"], result["n_cell"],
+            1000.0 * result["write_time"], upload_time))
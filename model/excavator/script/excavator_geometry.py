@@ -0,0 +1,154 @@
+"""Gathers the geometry of an excavator.
+
+The purpose of this file is to provide a single container for all the geometric
+parameters of the excavator linkage, as well as for the range of the hydraulic
+pistons. The derived constants used by the pose calculation are calculated once when
+the geometry is created, so that they are not recalculated at every pose evaluation.
+
+The default geometry corresponds to the excavator model included in this repository.
+The meaning of each parameter is described in the model readme.
+
+Typical usage example:
+
+    from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+    geometry = ExcavatorGeometry(CH=400.0, cb_piston_range=(0.06, 0.6))
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import numpy as np
+
+
+# ==================================================================================== #
+#                                                                                      #
+#                Starting implementation of the excavator geometry container           #
+#                                                                                      #
+# ==================================================================================== #
+class ExcavatorGeometry:
+    """Stores the geometry of an excavator.
+
+    This class is immutable, so that a geometry can safely be shared and used as a
+    default argument.
+
+    Some information about this class:
+    - All distances of the linkage are given in cm.
+    - All angles are given in radian.
+    - The piston ranges are given in m, following the convention of the MuJoCo model.
+
+    Attributes:
+        CH: Distance between the boom and arm attachments. [cm]
+        CE: Distance between the boom and chassis/boom piston rod attachments. [cm]
+        CF: Distance between the boom and boom/arm piston cylinder attachments. [cm]
+        x_D: Position of the chassis/boom piston cylinder attachment in the X direction
+             given in the boom frame. [cm]
+        z_D: Position of the chassis/boom piston cylinder attachment in the Z direction
+             given in the boom frame. [cm]
+        angle_HCE: Angle between the CH and CE segments. [rad]
+        angle_HCF: Angle between the CH and CF segments. [rad]
+        cb_piston_cylinder_length: Length of the chassis/boom piston rod EE'. [cm]
+        HG: Distance between the arm and boom/arm piston rod attachments. [cm]
+        HM: Distance between the arm and bucket attachments. [cm]
+        HI: Distance between the arm and arm/bucket piston cylinder attachments. [cm]
+        HK: Distance between the arm and H link attachments. [cm]
+        angle_GHM: Angle between the HG and HM segments. [rad]
+        angle_GHI: Angle between the HG and HI segments. [rad]
+        angle_GHK: Angle between the HG and HK segments. [rad]
+        ba_piston_cylinder_length: Length of the boom/arm piston rod GG'. [cm]
+        JK: Length of the H link. [cm]
+        JL: Length of the side link. [cm]
+        LM: Distance between the bucket and side link attachments. [cm]
+        ah_piston_cylinder_length: Length of the arm/bucket piston rod JJ'. [cm]
+        cb_piston_range: Lower and upper bound of the chassis/boom piston
+                         extension. [m]
+        ba_piston_range: Lower and upper bound of the boom/arm piston extension. [m]
+        ah_piston_range: Lower and upper bound of the arm/bucket piston extension. [m]
+        x_C: Position of the boom attachment in the X direction given in the chassis
+             frame. [cm]
+        z_C: Position of the boom attachment in the Z direction given in the chassis
+             frame. [cm]
+        z_chassis: Height of the chassis frame above the caterpillar frame. [cm]
+        CD: Distance between the boom and chassis/boom piston cylinder
+            attachments. [cm]
+        angle_CD: Angle of the CD segment relative to the horizontal plane. [rad]
+        angle_GHM_G: Offset between the arm angle and the angle of the HG segment
+                     relative to the vertical plane. [rad]
+        angle_GHM_I: Offset between the arm angle and the angle of the HI segment
+                     relative to the horizontal plane. [rad]
+        angle_GHM_K: Offset between the arm angle and the angle of the HK segment
+                     relative to the horizontal plane. [rad]
+        JK_2: Square of the H link length. [cm^2]
+        JL_2: Square of the side link length. [cm^2]
+    """
+    _parameters = (
+        "CH", "CE", "CF", "x_D", "z_D", "angle_HCE", "angle_HCF",
+        "cb_piston_cylinder_length", "HG", "HM", "HI", "HK", "angle_GHM", "angle_GHI",
+        "angle_GHK", "ba_piston_cylinder_length", "JK", "JL", "LM",
+        "ah_piston_cylinder_length", "cb_piston_range", "ba_piston_range",
+        "ah_piston_range", "x_C", "z_C", "z_chassis")
+    _derived = ("CD", "angle_CD", "angle_GHM_G", "angle_GHM_I", "angle_GHM_K", "JK_2",
+                "JL_2")
+    __slots__ = _parameters + _derived
+
+    def __init__(
+            self, CH: float = 384.5, CE: float = 167.8, CF: float = 236.2,
+            x_D: float = 47.4, z_D: float = -23.7, angle_HCE: float = 0.421,
+            angle_HCF: float = 0.411, cb_piston_cylinder_length: float = 133.6,
+            HG: float = 57.0, HM: float = 199.6, HI: float = 44.8, HK: float = 152.3,
+            angle_GHM: float = 2.881, angle_GHI: float = 1.876,
+            angle_GHK: float = 2.838, ba_piston_cylinder_length: float = 114.7,
+            JK: float = 45.4, JL: float = 44.9, LM: float = 37.9,
+            ah_piston_cylinder_length: float = 86.6,
+            cb_piston_range: tuple = (0.06, 0.56),
+            ba_piston_range: tuple = (0.28, 1.1),
+            ah_piston_range: tuple = (0.15, 0.75), x_C: float = 32.6,
+            z_C: float = 38.9, z_chassis: float = 76.7) -> None:
+        values = locals()
+        for name in self._parameters:
+            value = values[name]
+            if name.endswith("_range"):
+                value = (float(value[0]), float(value[1]))
+            else:
+                value = float(value)
+            object.__setattr__(self, name, value)
+
+        # Calculating derived constants
+        object.__setattr__(self, "CD", np.sqrt(x_D * x_D + z_D * z_D))
+        object.__setattr__(self, "angle_CD", np.arctan2(z_D, x_D))
+        object.__setattr__(self, "angle_GHM_G", angle_GHM - np.pi / 2)
+        object.__setattr__(self, "angle_GHM_I", angle_GHM - angle_GHI)
+        object.__setattr__(self, "angle_GHM_K", angle_GHM - angle_GHK)
+        object.__setattr__(self, "JK_2", JK * JK)
+        object.__setattr__(self, "JL_2", JL * JL)
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError("ExcavatorGeometry is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("ExcavatorGeometry is immutable")
+
+    def __reduce__(self) -> tuple:
+        return (self.__class__, self.astuple())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ExcavatorGeometry):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __hash__(self) -> int:
+        return hash(self.astuple())
+
+    def __repr__(self) -> str:
+        parameters = ", ".join(
+            "%s=%r" % (name, getattr(self, name)) for name in self._parameters)
+        return "ExcavatorGeometry(%s)" % parameters
+
+    def astuple(self) -> tuple:
+        """Returns the parameters in the order of the constructor arguments."""
+        return tuple(getattr(self, name) for name in self._parameters)
+
+    def asdict(self) -> dict:
+        """Returns the parameters as a dictionary."""
+        return {name: getattr(self, name) for name in self._parameters}
+
+
+# Geometry of the excavator model included in this repository
+DEFAULT_GEOMETRY = ExcavatorGeometry()
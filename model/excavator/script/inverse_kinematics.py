@@ -0,0 +1,357 @@
+"""Calculates the excavator angles from the piston extensions.
+
+The purpose of the functions in this file is to invert the pose calculation, that is
+to calculate the boom, arm and bucket angle provided the extension of the three
+hydraulic pistons. This is useful as the excavator model is actuated through the
+piston rods, so that piston extensions are the quantities observed at runtime.
+
+The linkage is solved sequentially. The chassis/boom piston extension only depends on
+the boom angle, the boom/arm piston extension only depends on the arm angle relative
+to the boom, and the arm/bucket piston extension only depends on the bucket angle
+relative to the arm. Each stage is a closed-loop triangle or four-bar linkage that is
+solved exactly with the law of cosines, so that the exact solver is fully vectorized.
+
+A lookup table mode is also provided. It stores, for each piston, the monotone
+relation between the piston extension and the corresponding relative angle, and
+evaluates it with a linear interpolation.
+
+Some information about this file:
+- All distances are given in cm, following the convention of the pose calculation.
+- All angles are given in radian.
+- When a piston extension has two possible solutions, the branch containing the
+  default excavator pose is selected. For the boom/arm piston, this is the branch
+  where the arm is folded below the boom, and for the arm/bucket piston, the branch
+  before the H link toggle point.
+- The pose calculation assumes that the KL segment points forward, which does not
+  hold anymore when the arm points backward (arm angle below about -100 degrees).
+  In that case, the exact solver gives the physical bucket angle, which differs from
+  the one used by the pose calculation.
+
+Typical usage example:
+
+    from inverse_kinematics import _calc_excavator_angles, InverseKinematicsTable
+    angle_boom, angle_arm, angle_bucket = _calc_excavator_angles(
+        ext_cb_piston, ext_ba_piston, ext_ah_piston)
+
+    table = InverseKinematicsTable.build()
+    angle_boom, angle_arm, angle_bucket = table.solve(
+        ext_cb_piston, ext_ba_piston, ext_ah_piston)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import numpy as np
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+from pose_calculation import _calc_arm_pose, _calc_boom_pose, _calc_H_link_pose
+
+
+# ==================================================================================== #
+#                                                                                      #
+#   Starting implementation of functions used to calculate the angles of the excavator #
+#                                                                                      #
+# ==================================================================================== #
+def _calc_excavator_angles(
+        ext_cb_piston: np.ndarray, ext_ba_piston: np.ndarray, ext_ah_piston: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
+    """Calculates the excavator angles provided the piston extensions.
+
+    This function is the exact inverse of _calc_excavator_pose_batch for the piston
+    extensions. The inputs are broadcasted against each other. Piston extensions that
+    cannot be reached by the linkage give NaN angles.
+
+    Args:
+        ext_cb_piston: Position of the piston rod in the chassis/boom piston
+                       cylinder. [cm]
+        ext_ba_piston: Position of the piston rod in the boom/arm piston cylinder. [cm]
+        ext_ah_piston: Position of the piston rod in the arm/bucket piston
+                       cylinder. [cm]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A list containing the angle of the boom, the angle of the arm, and the angle of
+        the bucket relative to the horizontal plane.
+    """
+    angle_boom = _calc_boom_angle(ext_cb_piston, geometry)
+    angle_arm = _calc_arm_angle(ext_ba_piston, angle_boom, geometry)
+    angle_bucket = _calc_bucket_angle(ext_ah_piston, angle_arm, geometry)
+    return np.broadcast_arrays(angle_boom, angle_arm, angle_bucket)
+
+
+def _calc_boom_angle(
+        ext_cb_piston: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the boom angle provided the chassis/boom piston extension.
+
+    The length ED is known from the piston extension, so that the angle at C of the
+    CDE triangle is given by the law of cosines.
+
+    Args:
+        ext_cb_piston: Position of the piston rod in the chassis/boom piston
+                       cylinder. [cm]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The angle of the boom relative to the horizontal plane. [rad]
+    """
+    # Input parameters from the excavator geometry
+    CE = geometry.CE
+    CD = geometry.CD
+    piston_cylinder_length = geometry.cb_piston_cylinder_length
+    angle_CD = geometry.angle_CD
+    angle_HCE = geometry.angle_HCE
+
+    # Calculating the angle at the boom attachment formed by the CDE triangle
+    ED = np.asarray(ext_cb_piston, dtype=np.float64) + piston_cylinder_length
+    angle_DCE = np.arccos((CE * CE + CD * CD - ED * ED) / (2 * CE * CD))
+
+    return _wrap_angle(angle_CD + angle_DCE - angle_HCE)
+
+
+def _calc_arm_angle(
+        ext_ba_piston: np.ndarray, angle_boom: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the arm angle provided the boom/arm piston extension.
+
+    The length FG is known from the piston extension, so that the angle at H of the
+    FGH triangle is given by the law of cosines.
+
+    Args:
+        ext_ba_piston: Position of the piston rod in the boom/arm piston cylinder. [cm]
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The angle of the arm relative to the horizontal plane. [rad]
+    """
+    # Input parameters from the excavator geometry
+    HG = geometry.HG
+    piston_cylinder_length = geometry.ba_piston_cylinder_length
+    angle_GHM = geometry.angle_GHM
+
+    # Calculating position of the boom/arm piston cylinder attachment in the arm frame
+    x_F, z_F, _, _ = _calc_boom_pose(angle_boom, geometry)
+    HF = np.sqrt(x_F**2 + z_F**2)
+    angle_HF = np.arctan2(z_F, x_F)
+
+    # Calculating the angle at the arm attachment formed by the FGH triangle
+    FG = np.asarray(ext_ba_piston, dtype=np.float64) + piston_cylinder_length
+    angle_FHG = np.arccos((HG * HG + HF * HF - FG * FG) / (2 * HG * HF))
+
+    return _wrap_angle(angle_HF - angle_FHG - angle_GHM)
+
+
+def _calc_bucket_angle(
+        ext_ah_piston: np.ndarray, angle_arm: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the bucket angle provided the arm/bucket piston extension.
+
+    The length IJ is known from the piston extension, so that the position of J is
+    given by the intersection of the circle of radius IJ centered on I and the circle
+    of radius JK centered on K. The position of L is then given by the intersection of
+    the circle of radius JL centered on J and the circle of radius LM centered on M.
+
+    Args:
+        ext_ah_piston: Position of the piston rod in the arm/bucket piston
+                       cylinder. [cm]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The angle of the bucket relative to the horizontal plane. [rad]
+    """
+    # Input parameters from the excavator geometry
+    LM = geometry.LM
+    JK_2 = geometry.JK_2
+    JL_2 = geometry.JL_2
+    piston_cylinder_length = geometry.ah_piston_cylinder_length
+
+    # Calculating position of I, K and M in the arm frame
+    # The boom/arm piston cylinder attachment does not matter here
+    x_I, z_I, x_K, z_K, x_M, z_M, _, _ = _calc_arm_pose(
+        angle_arm, 0.0, 0.0, geometry)
+
+    # Calculating the angle at the arm/bucket piston cylinder attachment formed by
+    # the IJK triangle
+    IJ = np.asarray(ext_ah_piston, dtype=np.float64) + piston_cylinder_length
+    IK = np.sqrt((x_K - x_I)**2 + (z_K - z_I)**2)
+    angle_IK = np.arctan2(z_K - z_I, x_K - x_I)
+    angle_KIJ = np.arccos((IJ * IJ + IK * IK - JK_2) / (2 * IJ * IK))
+
+    # Calculating position of the arm/bucket piston rod attachment in the arm frame
+    x_J = x_I + IJ * np.cos(angle_IK + angle_KIJ)
+    z_J = z_I + IJ * np.sin(angle_IK + angle_KIJ)
+
+    # Calculating the angle at the bucket attachment formed by the JLM triangle
+    MJ = np.sqrt((x_J - x_M)**2 + (z_J - z_M)**2)
+    angle_MJ = np.arctan2(z_J - z_M, x_J - x_M)
+    angle_JML = np.arccos((LM * LM + MJ * MJ - JL_2) / (2 * LM * MJ))
+
+    return _wrap_angle(angle_MJ - angle_JML)
+
+
+def _wrap_angle(angle: np.ndarray) -> np.ndarray:
+    """Wraps an angle into the [-pi, pi) interval."""
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+# ==================================================================================== #
+#                                                                                      #
+#              Starting implementation of the inverse kinematics lookup table          #
+#                                                                                      #
+# ==================================================================================== #
+class InverseKinematicsTable:
+    """Stores the relation between the piston extensions and the excavator angles.
+
+    Each piston is associated with a table giving its extension for a regular grid of
+    the relative angle it controls: the boom angle, the arm angle relative to the boom,
+    and the bucket angle relative to the arm. The grid spans the branch selected by
+    the exact solver within the piston range, where the relation is strictly
+    monotone, so that it can be inverted with a linear interpolation.
+
+    Using a grid regular in angle keeps the interpolation accurate close to the toggle
+    points, where the derivative of the angle with respect to the extension diverges.
+    The interpolation error is bounded by h^2 / 8 times the maximum curvature of the
+    relation, with h the grid spacing. Close to the H link toggle point, the curvature
+    diverges and the error becomes proportional to h instead. The maximum error is
+    measured at build time on the middle of every interval and stored in max_error.
+    With the default 2048 nodes, it is about 2e-8 rad for the boom, 2e-7 rad for the
+    arm, and 2e-4 rad for the bucket, the latter being reached next to the toggle
+    point. As the relative angles are summed, the error on the arm angle is bounded by
+    the sum of the first two errors, and the error on the bucket angle by the sum of
+    the three errors.
+
+    Extensions outside of the table range are clamped to the closest node, while the
+    exact solver returns NaN.
+
+    Attributes:
+        ext_nodes: List of the extension nodes of each piston, sorted in increasing
+                   order. [cm]
+        angle_nodes: List of the relative angle nodes of each piston. [rad]
+        max_error: Maximum interpolation error of each piston table. [rad]
+        geometry: Geometry of the excavator used to build the tables.
+    """
+
+    def __init__(
+            self, ext_nodes: list, angle_nodes: list,
+            geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> None:
+        self.ext_nodes = ext_nodes
+        self.angle_nodes = angle_nodes
+        self.geometry = geometry
+        self.max_error = np.full(3, np.nan)
+
+    @classmethod
+    def build(
+            cls, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY,
+            n_node: int = 2048) -> "InverseKinematicsTable":
+        """Builds the lookup tables.
+
+        The range of each relative angle is first determined by sampling densely the
+        piston extension over all relative angles, and by selecting the monotone
+        segment that contains the default excavator pose and stays within the piston
+        range of the geometry. The extensions are then calculated on a regular grid of
+        relative angle spanning this segment.
+
+        Args:
+            geometry: Geometry of the excavator. Default value to the geometry of the
+                      excavator model.
+            n_node: Number of nodes in each table. Default value to 2048.
+
+        Returns:
+            The lookup tables.
+        """
+        # Relative angles of the default excavator pose
+        angle_references = [np.deg2rad(30.0), np.deg2rad(-60.0), np.deg2rad(70.0)]
+
+        # Piston ranges are converted from m to cm
+        piston_ranges = [
+            100.0 * np.asarray(geometry.cb_piston_range),
+            100.0 * np.asarray(geometry.ba_piston_range),
+            100.0 * np.asarray(geometry.ah_piston_range)]
+
+        ext_nodes = []
+        angle_nodes = []
+        for ii in range(3):
+            # Sampling the piston extension over all relative angles
+            angle = np.linspace(-np.pi, np.pi, 2**20)
+            with np.errstate(invalid="ignore"):
+                ext = _calc_piston_extension(ii, angle, geometry)
+
+            # Selecting the monotone segment containing the default pose
+            in_range = (ext >= piston_ranges[ii][0]) & (ext <= piston_ranges[ii][1])
+            slope = np.sign(np.diff(ext))
+            ref = np.searchsorted(angle, angle_references[ii])
+            valid = in_range[:-1] & in_range[1:] & (slope == slope[ref])
+            breaks = np.flatnonzero(~valid)
+            start = breaks[breaks < ref].max(initial=-1) + 1
+            end = breaks[breaks >= ref].min(initial=valid.size)
+
+            angle = np.linspace(angle[start], angle[end], n_node)
+            ext = _calc_piston_extension(ii, angle, geometry)
+            order = np.argsort(ext)
+            ext_nodes.append(ext[order])
+            angle_nodes.append(angle[order])
+
+        table = cls(ext_nodes, angle_nodes, geometry)
+
+        # Measuring the interpolation error on the middle of every interval
+        for ii in range(3):
+            angle_mid = 0.5 * (angle_nodes[ii][1:] + angle_nodes[ii][:-1])
+            ext_mid = _calc_piston_extension(ii, angle_mid, geometry)
+            table.max_error[ii] = np.max(
+                np.abs(np.interp(ext_mid, ext_nodes[ii], angle_nodes[ii]) - angle_mid))
+        return table
+
+    def solve(
+            self, ext_cb_piston: np.ndarray, ext_ba_piston: np.ndarray,
+            ext_ah_piston: np.ndarray) -> list:
+        """Calculates the excavator angles provided the piston extensions.
+
+        Args:
+            ext_cb_piston: Position of the piston rod in the chassis/boom piston
+                           cylinder. [cm]
+            ext_ba_piston: Position of the piston rod in the boom/arm piston
+                           cylinder. [cm]
+            ext_ah_piston: Position of the piston rod in the arm/bucket piston
+                           cylinder. [cm]
+
+        Returns:
+            A list containing the angle of the boom, the angle of the arm, and the
+            angle of the bucket relative to the horizontal plane.
+        """
+        angle_boom = np.interp(ext_cb_piston, self.ext_nodes[0], self.angle_nodes[0])
+        angle_arm = angle_boom + np.interp(
+            ext_ba_piston, self.ext_nodes[1], self.angle_nodes[1])
+        angle_bucket = angle_arm + np.interp(
+            ext_ah_piston, self.ext_nodes[2], self.angle_nodes[2])
+        return np.broadcast_arrays(
+            _wrap_angle(angle_boom), _wrap_angle(angle_arm), _wrap_angle(angle_bucket))
+
+
+def _calc_piston_extension(
+        piston: int, angle: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the extension of one piston provided its relative angle.
+
+    Args:
+        piston: Index of the piston, 0 for the chassis/boom piston, 1 for the boom/arm
+                piston, and 2 for the arm/bucket piston.
+        angle: Boom angle, arm angle relative to the boom, or bucket angle relative to
+               the arm, depending on the piston. [rad]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The position of the piston rod in the piston cylinder. [cm]
+    """
+    if piston == 0:
+        return _calc_boom_pose(angle, geometry)[2]
+
+    x_F, z_F, _, _ = _calc_boom_pose(0.0, geometry)
+    x_I, z_I, x_K, z_K, x_M, z_M, ext_ba_piston, _ = _calc_arm_pose(
+        angle if piston == 1 else 0.0, x_F, z_F, geometry)
+    if piston == 1:
+        return ext_ba_piston
+    return _calc_H_link_pose(angle, x_I, z_I, x_K, z_K, x_M, z_M, geometry)[0]
@@ -0,0 +1,780 @@
+"""Previews the motion of the excavator without simulating its dynamics.
+
+The purpose of this file is to evaluate a large number of candidate actuator commands
+at once, for instance for trajectory search, at a fraction of the cost of the full
+simulation. The KinematicPreview class integrates the chassis rotation and the piston
+extensions under the velocity commands of the Rotation, Boom, Arm and Bucket
+actuators, clamps the extensions to the piston ranges, and calculates the resulting
+pose of the links with the pose calculation, for whole batches of trajectories at once.
+
+The velocity actuators of the excavator model have a finite gain, so that the
+actuators do not follow their command exactly. They lag behind it with the inertia
+they move, and the pistons settle below it under the weight of the links. In the
+default excavator model, the boom piston goes down at about 0.2 m/s when it is
+commanded to stay still. When the preview is created from a compiled model with
+from_mjmodel, a tracking model of the actuators, calculated from the gains, masses and
+inertias of the model, accounts for both effects. It neglects the weight of the
+chassis/boom piston, the Coriolis and centrifugal forces, and the contacts. Otherwise,
+the actuators are assumed to follow exactly their command. In both cases, the
+caterpillar is assumed to stay at its initial position.
+
+The error of the preview with the tracking model was measured from the default pose,
+for smooth random commands in m/s and rad/s, before any contact with the terrain. The
+bucket teeth stay within 6 cm of the simulation over 0.25 s and 12 cm over 0.5 s for
+commands up to 0.1, within 11 cm and 24 cm for commands up to 0.2, and within 19 cm
+and 65 cm for commands up to 0.5, while the chassis angle stays within 0.01 rad. About
+5 cm come from the linkage calculation, and beyond 0.5 s, the error grows to several
+decimeters, mostly because the contacts between the linkage parts in the simulation
+carry a part of the weight of the boom. The preview is therefore suited to screen
+candidates over horizons up to 0.5 s, the candidates kept being assessed with the
+simulation. The error for given commands can be measured with
+validate_kinematic_preview.
+
+Some information about this file:
+- The piston extensions are given in m, following the convention of the MuJoCo model.
+- The positions are given in m in the world frame.
+- The angles follow the convention of the pose calculation, that is the boom, arm and
+  bucket angles are given relative to the horizontal plane and positive upward.
+
+Typical usage example:
+
+    preview = KinematicPreview.from_mjmodel(mj_model)
+    ctrl = np.zeros((1000, 500, 4))
+    ctrl[:, :, 1] = 0.1
+    trajectories = preview.rollout(ctrl, output_interval=10)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import argparse
+import mujoco
+import numpy as np
+import time
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+from inverse_kinematics import InverseKinematicsTable, _calc_excavator_angles
+from model_generation import (
+    _BUCKET_TEETH, _CATERPILLAR_HEIGHT, _REFERENCE_ANGLE_ARM,
+    generate_excavator_mjmodel)
+from pose_calculation import _calc_excavator_pose_batch
+
+
+# Position of the bucket teeth relative to the bucket joint (X and Z direction), when
+# the bucket angle is zero. The bucket frame of the excavator model is rotated by the
+# arm angle of the reference pose relative to the bucket angle.
+BUCKET_TEETH = (
+    _BUCKET_TEETH[0] * np.cos(np.deg2rad(_REFERENCE_ANGLE_ARM)) -
+    _BUCKET_TEETH[2] * np.sin(np.deg2rad(_REFERENCE_ANGLE_ARM)),
+    _BUCKET_TEETH[0] * np.sin(np.deg2rad(_REFERENCE_ANGLE_ARM)) +
+    _BUCKET_TEETH[2] * np.cos(np.deg2rad(_REFERENCE_ANGLE_ARM)))
+
+# Name of the actuated joints of the model, following the order of the actuators
+ACTUATED_JOINTS = ["chassis", "chassis piston rod", "boom piston rod", "arm piston rod"]
+
+# Name of the links moved by the pistons, in the order of the pistons
+LINKS = ["boom", "arm", "bucket"]
+
+# Number of nodes of the grid of the tracking model along each piston extension
+TRACKING_GRID_SIZE = 65
+
+# Name of the body holding the terrain
+TERRAIN_BODY = "floor"
+
+
+# ==================================================================================== #
+#                                                                                      #
+#           Starting implementation of the kinematic preview of the excavator          #
+#                                                                                      #
+# ==================================================================================== #
+class KinematicPreview:
+    """Integrates the kinematics of a batch of excavators.
+
+    The angles are calculated from the piston extensions with the lookup table of the
+    inverse kinematics by default, or with the exact solver.
+
+    The tracking model depends on the pose only through the piston extensions, so that
+    it is calculated beforehand on a regular grid of piston extensions, and the value
+    of the closest grid node is used at each time step. With the default grid, the
+    velocity error of the closest node differs by less than 2 cm/s from the one at
+    the piston extensions.
+
+    Attributes:
+        geometry: Geometry of the excavator.
+        timestep: Integration time step. [s]
+        ctrl_range: Lower and upper bound of the actuator commands.
+        table: Lookup table of the inverse kinematics, or None when the exact solver
+               is used.
+        tracking: Parameters of the tracking model of the actuators given by
+                  _calc_actuator_tracking, or None when the actuators follow exactly
+                  their command.
+    """
+
+    def __init__(
+            self, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY,
+            timestep: float = 0.002, ctrl_range: tuple = (-0.5, 0.5),
+            exact: bool = False, tracking: dict = None) -> None:
+        """Initializes the kinematic preview.
+
+        Args:
+            geometry: Geometry of the excavator. Default value to the geometry of the
+                      excavator model.
+            timestep: Integration time step. Default value to the time step of the
+                      excavator model. [s]
+            ctrl_range: Lower and upper bound of the actuator commands. Default value
+                        to the control range of the excavator model.
+            exact: Whether the angles are calculated with the exact solver instead of
+                   the lookup table.
+            tracking: Parameters of the tracking model of the actuators given by
+                      _calc_actuator_tracking. Default value to actuators following
+                      exactly their command.
+        """
+        self.geometry = geometry
+        self.timestep = timestep
+        self.ctrl_range = ctrl_range
+        self.table = None if exact else InverseKinematicsTable.build(geometry)
+        self.tracking = tracking
+        self._ext_min = np.array([
+            geometry.cb_piston_range[0], geometry.ba_piston_range[0],
+            geometry.ah_piston_range[0]])
+        self._ext_max = np.array([
+            geometry.cb_piston_range[1], geometry.ba_piston_range[1],
+            geometry.ah_piston_range[1]])
+
+        # The state integrated by rollout gathers the chassis angle and the piston
+        # extensions. With the tracking model, the piston extensions are given in
+        # units of grid spacing from half a spacing below the first node, so that the
+        # closest node is found by truncation.
+        self._state_scale = np.ones(4)
+        self._state_offset = np.zeros(4)
+        self._state_min = np.append(-np.inf, self._ext_min)
+        self._state_max = np.append(np.inf, self._ext_max)
+        self._tracking_grid = None
+        if tracking is not None:
+            n_node = TRACKING_GRID_SIZE
+            self._state_scale[1:] = (n_node - 1) / (self._ext_max - self._ext_min)
+            self._state_offset[1:] = self._ext_min - 0.5 / self._state_scale[1:]
+            self._state_min[1:] = 0.5
+            self._state_max[1:] = n_node - 0.5
+            self._grid_strides = np.array([n_node * n_node, n_node, 1])
+
+            # Flattening the grid and converting it to the units of the state
+            grid = _calc_tracking_grid(
+                self.table or InverseKinematicsTable.build(geometry), tracking,
+                timestep, n_node, geometry).reshape(-1, 20)
+            grid[:, :4] *= self._state_scale
+            grid[:, 4:] *= np.outer(self._state_scale, 1.0 / self._state_scale).ravel()
+            self._tracking_grid = grid
+
+    @classmethod
+    def from_mjmodel(
+            cls, mj_model, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY,
+            exact: bool = False) -> "KinematicPreview":
+        """Creates a kinematic preview following a compiled excavator model.
+
+        The time step, the control range and the tracking model of the actuators are
+        taken from the model.
+
+        Args:
+            mj_model: Compiled excavator model.
+            geometry: Geometry of the excavator used to generate the model. Default
+                      value to the geometry of the excavator model.
+            exact: Whether the angles are calculated with the exact solver instead of
+                   the lookup table.
+
+        Returns:
+            The kinematic preview.
+        """
+        return cls(
+            geometry, float(mj_model.opt.timestep),
+            tuple(float(value) for value in mj_model.actuator_ctrlrange[0]), exact,
+            _calc_actuator_tracking(mj_model, geometry))
+
+    def rollout(
+            self, ctrl: np.ndarray, ext_init: np.ndarray = None,
+            angle_chassis_init: np.ndarray = 0.0, output_interval: int = 1) -> dict:
+        """Integrates a batch of trajectories.
+
+        The commands are held constant during each time step, as in the full
+        simulation, and the state is given after each time step. With the tracking
+        model, the velocity error of the pistons and the lag of the chassis rotation
+        are updated at each time step from the current piston extensions, the
+        actuators being at rest initially.
+
+        Args:
+            ctrl: Commands of the Rotation, Boom, Arm and Bucket actuators, of shape
+                  (n_trajectory, n_step, 4) or (n_step, 4). The commands are clipped
+                  to the control range.
+            ext_init: Initial extension of the chassis/boom, boom/arm and arm/bucket
+                      pistons, of shape (n_trajectory, 3) or (3,). Default value to the
+                      extensions of the default excavator pose. [m]
+            angle_chassis_init: Initial chassis angle, of shape (n_trajectory,).
+                                Default value to 0. [rad]
+            output_interval: Number of time steps between two outputs.
+
+        Returns:
+            A dictionary containing, for each trajectory and output step, the time,
+            the chassis angle, the piston extensions, the boom, arm and bucket angles,
+            and the position of the boom joint, arm joint, bucket joint and bucket
+            teeth. The arrays are of shape (n_trajectory, n_output) followed by the
+            dimension of the quantity.
+        """
+        ctrl = np.asarray(ctrl, dtype=np.float64)
+        if ctrl.ndim == 2:
+            ctrl = ctrl[None]
+        n_trajectory, n_step, _ = ctrl.shape
+        if ext_init is None:
+            pose = _calc_excavator_pose_batch(
+                np.deg2rad(30.0), np.deg2rad(-30.0), np.deg2rad(40.0), self.geometry)
+            ext_init = np.array([
+                pose.ext_cb_piston, pose.ext_ba_piston, pose.ext_ah_piston]) / 100.0
+
+        # Integrating the state, the displacements during a time step being used
+        # instead of the velocities
+        state = np.empty((n_trajectory, 4))
+        state[:, 0] = angle_chassis_init
+        state[:, 1:] = ext_init
+        state -= self._state_offset
+        state *= self._state_scale
+        np.clip(state, self._state_min, self._state_max, out=state)
+        speed = np.zeros((n_trajectory, 4))
+        difference = np.empty((n_trajectory, 4))
+        n_output = n_step // output_interval
+        state_output = np.empty((n_output, n_trajectory, 4))
+        velocity = np.clip(ctrl, self.ctrl_range[0], self.ctrl_range[1]).transpose(
+            1, 0, 2) * (self.timestep * self._state_scale)
+        for ii in range(n_output * output_interval):
+            if self._tracking_grid is None:
+                state += velocity[ii]
+            else:
+                # The displacement of the actuators during a time step lags behind
+                # their command reduced by the velocity error, the tracking model
+                # being taken at the closest grid node
+                tracking = self._tracking_grid.take(np.dot(
+                    state[:, 1:].astype(np.intp), self._grid_strides), axis=0)
+                np.subtract(velocity[ii], tracking[:, :4], out=difference)
+                difference -= speed
+                speed += (tracking[:, 4:].reshape(-1, 4, 4) @ difference[..., None])[
+                    ..., 0]
+                state += speed
+            np.maximum(state, self._state_min, out=state)
+            np.minimum(state, self._state_max, out=state)
+            if (ii + 1) % output_interval == 0:
+                state_output[ii // output_interval] = state
+        state_output = state_output.transpose(1, 0, 2) / self._state_scale + (
+            self._state_offset)
+        angle_chassis_output = state_output[..., 0]
+        ext_output = state_output[..., 1:]
+
+        # Calculating the pose of the links
+        if self.table is None:
+            angles = _calc_excavator_angles(
+                100.0 * ext_output[..., 0], 100.0 * ext_output[..., 1],
+                100.0 * ext_output[..., 2], self.geometry)
+        else:
+            angles = self.table.solve(
+                100.0 * ext_output[..., 0], 100.0 * ext_output[..., 1],
+                100.0 * ext_output[..., 2])
+        positions = _calc_link_positions(
+            angle_chassis_output, angles[0], angles[1], angles[2], self.geometry)
+
+        trajectories = {
+            "time": self.timestep * output_interval * np.broadcast_to(
+                np.arange(1, n_output + 1), (n_trajectory, n_output)),
+            "angle_chassis": angle_chassis_output,
+            "ext": ext_output,
+            "angles": np.stack(angles, axis=-1),
+        }
+        trajectories.update(positions)
+        return trajectories
+
+
+def _calc_tracking_grid(
+        table: InverseKinematicsTable, tracking: dict, timestep: float,
+        n_node: int = TRACKING_GRID_SIZE,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the tracking model on a regular grid of piston extensions.
+
+    The actuators follow their command with a lag, set by their gain and by the
+    inertia they move. The Rotation actuator moves the moment of inertia of the
+    excavator around the chassis axis, while the pistons move the links, whose mass
+    matrix is converted to the piston extensions with the derivative of the angle
+    set by each piston with respect to its extension. The gains are integrated
+    implicitly, as the time step of the simulation is not small compared to the lag
+    of the lightest links.
+
+    The pistons also hold the gravity torque of the links they carry, so that their
+    velocity settles below the command. This velocity error is the gravity force held
+    by the piston divided by the gain of its actuator, where the force is the torque
+    multiplied by the derivative of the angle with respect to the extension.
+
+    The derivatives are calculated by finite differences over the grid spacing, which
+    stay bounded close to the H link toggle point, where the exact derivative
+    diverges. Extensions outside of the range of the lookup table give the angles of
+    the closest table node, and therefore no velocity error and no lag.
+
+    Args:
+        table: Lookup table of the inverse kinematics.
+        tracking: Parameters of the tracking model given by _calc_actuator_tracking.
+        timestep: Integration time step. [s]
+        n_node: Number of grid nodes along each piston extension.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        An array of shape (n_node, n_node, n_node, 20) giving, for each node, the
+        velocity error of the Rotation, Boom, Arm and Bucket actuators multiplied by
+        the time step [rad, m], followed by the (4, 4) matrix, flattened row by row,
+        giving the change of their displacement during a time step from the
+        difference between their command, reduced by the velocity error, and their
+        displacement during the previous time step. The nodes span the piston ranges
+        of the geometry.
+    """
+    # Extension nodes, converted from m to cm
+    ext_nodes = [
+        100.0 * np.linspace(*piston_range, n_node) for piston_range in [
+            geometry.cb_piston_range, geometry.ba_piston_range,
+            geometry.ah_piston_range]]
+
+    # Derivative of the relative angle set by each piston [rad/m]
+    derivatives = []
+    for ii, ext in enumerate(ext_nodes):
+        angle = np.interp(ext, table.ext_nodes[ii], table.angle_nodes[ii])
+        derivatives.append(np.expand_dims(
+            np.gradient(angle, 0.01 * ext), [jj for jj in range(3) if jj != ii]))
+
+    # Gravity torques and mass matrices of all nodes
+    ext = np.meshgrid(*ext_nodes, indexing="ij")
+    angles = table.solve(*ext)
+    torque = _calc_gravity_torque(*angles, tracking, geometry)
+    mass_matrix = _calc_link_mass_matrix(*angles, tracking, geometry)
+
+    # Converting the mass matrix to the piston extensions, each angle being the sum of
+    # the relative angles set by the previous pistons
+    jacobian = np.zeros(ext[0].shape + (3, 3))
+    for ii in range(3):
+        jacobian[..., ii:, ii] = derivatives[ii][..., None]
+    mass_matrix = np.swapaxes(jacobian, -1, -2) @ mass_matrix @ jacobian
+
+    grid = np.zeros(ext[0].shape + (20,))
+    for ii in range(3):
+        grid[..., ii + 1] = (
+            timestep * derivatives[ii] * torque[..., ii] / tracking["kv"][ii + 1])
+    lag = grid[..., 4:].reshape(ext[0].shape + (4, 4))
+    gain = timestep * tracking["kv"]
+    lag[..., 0, 0] = gain[0] / (
+        _calc_rotation_inertia(*angles, tracking, geometry) + gain[0])
+    lag[..., 1:, 1:] = np.linalg.solve(
+        mass_matrix + np.diag(gain[1:]), np.diag(gain[1:]))
+    return grid
+
+
+def _calc_link_com(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        tracking: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
+    """Calculates the position of the joints and center of mass of the links.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        tracking: Parameters of the tracking model given by _calc_actuator_tracking.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A list containing the position of the boom, arm and bucket joints, and the
+        position of the center of mass of the boom, arm and bucket groups. Each
+        position is a list of its X and Z coordinates in the chassis frame relative
+        to the boom joint. [m]
+    """
+    com = tracking["com"]
+    joints = [[0.0, 0.0]]
+    joints.append([
+        0.01 * geometry.CH * np.cos(angle_boom), 0.01 * geometry.CH * np.sin(
+            angle_boom)])
+    joints.append([
+        joints[1][0] + 0.01 * geometry.HM * np.cos(angle_arm),
+        joints[1][1] + 0.01 * geometry.HM * np.sin(angle_arm)])
+    coms = []
+    for ii, angle in enumerate([angle_boom, angle_arm, angle_bucket]):
+        cos = np.cos(angle)
+        sin = np.sin(angle)
+        coms.append([
+            joints[ii][0] + com[ii, 0] * cos - com[ii, 1] * sin,
+            joints[ii][1] + com[ii, 0] * sin + com[ii, 1] * cos])
+    return joints + coms
+
+
+def _calc_gravity_torque(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        tracking: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the gravity torque held by each piston.
+
+    Each piston sets the angle of its link relative to the previous link, so that it
+    holds the gravity torque of the links it carries around the joint of its link.
+    The inputs are broadcasted against each other.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        tracking: Parameters of the tracking model given by _calc_actuator_tracking.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The gravity torque held by the chassis/boom, boom/arm and arm/bucket pistons,
+        with the broadcasted shape of the inputs followed by 3. [N m]
+    """
+    positions = _calc_link_com(angle_boom, angle_arm, angle_bucket, tracking, geometry)
+    mass = tracking["mass"]
+    torque = [
+        sum(mass[jj] * (positions[jj + 3][0] - positions[ii][0])
+            for jj in range(ii, 3))
+        for ii in range(3)]
+    return tracking["gravity"] * np.stack(np.broadcast_arrays(*torque), axis=-1)
+
+
+def _calc_link_mass_matrix(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        tracking: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the mass matrix of the links for the boom, arm and bucket angles.
+
+    The boom, arm and bucket groups are taken as rigid bodies rotating in the vertical
+    plane of the chassis. The inputs are broadcasted against each other.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        tracking: Parameters of the tracking model given by _calc_actuator_tracking.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The mass matrix, with the broadcasted shape of the inputs followed by
+        (3, 3). [kg m^2]
+    """
+    positions = _calc_link_com(angle_boom, angle_arm, angle_bucket, tracking, geometry)
+
+    # The center of mass of each group moves with the angle of its link, and with the
+    # angle of each previous link by the lever arm of this link
+    levers = []
+    for kk in range(3):
+        ends = positions[1:kk + 1] + [positions[kk + 3]]
+        levers.append([
+            [end[0] - joint[0], end[1] - joint[1]]
+            for joint, end in zip(positions[:kk + 1], ends)])
+
+    mass_matrix = np.zeros(np.broadcast(angle_boom, angle_arm, angle_bucket).shape + (
+        3, 3))
+    for kk in range(3):
+        mass_matrix[..., kk, kk] += tracking["inertia_com"][kk]
+        for ii in range(kk + 1):
+            for jj in range(kk + 1):
+                mass_matrix[..., ii, jj] += tracking["mass"][kk] * (
+                    levers[kk][ii][0] * levers[kk][jj][0] +
+                    levers[kk][ii][1] * levers[kk][jj][1])
+    return mass_matrix
+
+
+def _calc_rotation_inertia(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        tracking: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the moment of inertia of the excavator around the chassis axis.
+
+    The boom, arm and bucket groups are taken as point masses, while the moment of
+    inertia of the other bodies and of the groups around their center of mass is
+    assumed constant. The inputs are broadcasted against each other.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        tracking: Parameters of the tracking model given by _calc_actuator_tracking.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The moment of inertia, with the broadcasted shape of the inputs. [kg m^2]
+    """
+    positions = _calc_link_com(angle_boom, angle_arm, angle_bucket, tracking, geometry)
+    inertia = tracking["inertia"]
+    for mass, (x, _) in zip(tracking["mass"], positions[3:]):
+        inertia = inertia + mass * (0.01 * geometry.x_C + x)**2
+    return inertia
+
+
+def _calc_actuator_tracking(
+        mj_model, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> dict:
+    """Calculates the parameters of the tracking model of the piston actuators.
+
+    The bodies moved by the boom, boom/arm piston and arm/bucket piston are gathered
+    with the boom, arm and bucket, respectively, and are assumed to be rigidly attached
+    to them. The center of mass of each group is calculated in the initial pose of the
+    model, and given in a frame rotated by the angle of its link, so that it does not
+    depend on the pose. The moment of inertia around the chassis axis of all the other
+    contributions than these centers of mass is taken from the mass matrix of the
+    initial pose.
+
+    Args:
+        mj_model: Compiled excavator model.
+        geometry: Geometry of the excavator used to generate the model. Default value
+                  to the geometry of the excavator model.
+
+    Returns:
+        A dictionary containing the gain of the Rotation actuator [N m s] and of the
+        piston actuators [N s/m] (kv), the mass of the boom, arm and bucket groups
+        (mass) [kg], the position of their center of mass relative to the joint of
+        their link in the X and Z direction of the link frame (com) [m], their moment
+        of inertia around their center of mass in the vertical plane of the chassis
+        (inertia_com) [kg m^2], the moment of inertia around the chassis axis without
+        the contribution of their centers of mass (inertia) [kg m^2], and the
+        gravitational acceleration (gravity) [m/s^2].
+    """
+    mj_data = mujoco.MjData(mj_model)
+    mujoco.mj_forward(mj_model, mj_data)
+
+    # Angles of the initial pose, calculated from the piston extensions given in cm
+    ext = [
+        100.0 * mj_data.qpos[mj_model.joint(name).qposadr[0]]
+        for name in ACTUATED_JOINTS[1:]]
+    angles = _calc_excavator_angles(*ext, geometry)
+
+    # Gathering each body with the closest link among its ancestors
+    link_ids = [mj_model.body(name).id for name in LINKS]
+    groups = [[] for _ in LINKS]
+    for body_id in range(mj_model.nbody):
+        parent_id = body_id
+        while parent_id != 0 and parent_id not in link_ids:
+            parent_id = mj_model.body_parentid[parent_id]
+        if parent_id != 0:
+            groups[link_ids.index(parent_id)].append(body_id)
+
+    mass = np.empty(3)
+    com = np.empty((3, 2))
+    inertia_com = np.empty(3)
+    for ii, name in enumerate(LINKS):
+        body_mass = mj_model.body_mass[groups[ii]]
+        mass[ii] = body_mass.sum()
+        xipos = mj_data.xipos[groups[ii]]
+        pos = body_mass @ xipos / mass[ii]
+
+        # Moment of inertia of the bodies around the Y axis, moved to the center of
+        # mass of the group
+        ximat = mj_data.ximat[groups[ii]].reshape(-1, 3, 3)
+        inertia_com[ii] = np.sum(
+            ximat[:, 1] ** 2 * mj_model.body_inertia[groups[ii]]) + body_mass @ (
+            (xipos[:, 0] - pos[0])**2 + (xipos[:, 2] - pos[2])**2)
+
+        pos -= mj_data.xanchor[mj_model.joint(name).id]
+        com[ii, 0] = pos[0] * np.cos(angles[ii]) + pos[2] * np.sin(angles[ii])
+        com[ii, 1] = -pos[0] * np.sin(angles[ii]) + pos[2] * np.cos(angles[ii])
+
+    tracking = {
+        "kv": mj_model.actuator_gainprm[:4, 0].copy(), "mass": mass, "com": com,
+        "inertia_com": inertia_com, "inertia": 0.0,
+        "gravity": -float(mj_model.opt.gravity[2])}
+
+    # Removing the contribution of the centers of mass from the moment of inertia
+    mass_matrix = np.empty((mj_model.nv, mj_model.nv))
+    mujoco.mj_fullM(mj_model, mj_data, mass_matrix)
+    dof = mj_model.joint(ACTUATED_JOINTS[0]).dofadr[0]
+    tracking["inertia"] = mass_matrix[dof, dof] - _calc_rotation_inertia(
+        *angles, tracking, geometry)
+    return tracking
+
+
+def _calc_link_positions(
+        angle_chassis: np.ndarray, angle_boom: np.ndarray, angle_arm: np.ndarray,
+        angle_bucket: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> dict:
+    """Calculates the position of the excavator joints and bucket teeth.
+
+    The inputs are broadcasted against each other.
+
+    Args:
+        angle_chassis: Angle of the chassis around the vertical axis. [rad]
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A dictionary containing the position of the boom joint (pos_boom), arm joint
+        (pos_arm), bucket joint (pos_bucket) and bucket teeth (pos_teeth) in the world
+        frame. Each array has the broadcasted shape of the inputs followed by 3. [m]
+    """
+    pose = _calc_excavator_pose_batch(angle_boom, angle_arm, angle_bucket, geometry)
+    angle_boom, angle_bucket = np.broadcast_arrays(angle_boom, angle_bucket)
+
+    # Calculating the positions in the vertical plane of the chassis, distances of the
+    # geometry being converted from cm to m
+    x_C = np.full(angle_boom.shape, 0.01 * geometry.x_C)
+    z_C = np.full(
+        angle_boom.shape,
+        _CATERPILLAR_HEIGHT + 0.01 * (geometry.z_chassis + geometry.z_C))
+    x_H = x_C + 0.01 * geometry.CH * np.cos(angle_boom)
+    z_H = z_C + 0.01 * geometry.CH * np.sin(angle_boom)
+    x_M = x_H + 0.01 * pose.x_M
+    z_M = z_H + 0.01 * pose.z_M
+    x_T = x_M + BUCKET_TEETH[0] * np.cos(angle_bucket) - BUCKET_TEETH[1] * np.sin(
+        angle_bucket)
+    z_T = z_M + BUCKET_TEETH[0] * np.sin(angle_bucket) + BUCKET_TEETH[1] * np.cos(
+        angle_bucket)
+
+    # Rotating the vertical plane with the chassis
+    cos_chassis = np.cos(angle_chassis)
+    sin_chassis = np.sin(angle_chassis)
+    positions = {}
+    for name, x, z in [
+            ("pos_boom", x_C, z_C), ("pos_arm", x_H, z_H), ("pos_bucket", x_M, z_M),
+            ("pos_teeth", x_T, z_T)]:
+        x, z, cos, sin = np.broadcast_arrays(x, z, cos_chassis, sin_chassis)
+        positions[name] = np.stack((x * cos, x * sin, z), axis=-1)
+    return positions
+
+
+# ==================================================================================== #
+#                                                                                      #
+#       Starting implementation of functions used to validate the kinematic preview    #
+#                                                                                      #
+# ==================================================================================== #
+def validate_kinematic_preview(
+        mj_model, ctrl: np.ndarray, preview: KinematicPreview = None) -> dict:
+    """Compares the kinematic preview with the full simulation.
+
+    The full simulation is started from the initial state of the model and driven by
+    the given commands, while the preview is started from the same piston extensions
+    and chassis angle. The bucket teeth of the full simulation are the ones of the
+    bucket simulated by the soil plugin. The preview does not model the contacts with
+    the terrain, so that the errors are calculated over the time steps before the
+    first contact between the excavator and the terrain.
+
+    Args:
+        mj_model: Compiled excavator model.
+        ctrl: Commands of the Rotation, Boom, Arm and Bucket actuators, of shape
+              (n_step, 4).
+        preview: Kinematic preview. Default value to a preview following the model,
+                 including the tracking model of the actuators.
+
+    Returns:
+        A dictionary containing the RMS and maximum error of the piston extensions
+        and chassis angle, the RMS and maximum distance between the joint and bucket
+        teeth positions calculated by both methods, the RMS and maximum difference
+        between the velocity of the actuated joints in the full simulation and their
+        command, which is the main source of error of the preview without tracking
+        model, and the RMS and maximum distance between the joint positions when the
+        preview is driven by the joint velocities of the full simulation (suffix
+        _kinematic). It also contains the time taken by both methods, the simulated
+        time divided by the time taken by the preview (realtime_factor), and the time
+        of the first contact with the terrain (contact_time), None if there is no
+        contact. [m, rad, s]
+    """
+    if preview is None:
+        preview = KinematicPreview.from_mjmodel(mj_model)
+    n_step = ctrl.shape[0]
+
+    # Running the full simulation
+    mj_data = mujoco.MjData(mj_model)
+    mujoco.mj_forward(mj_model, mj_data)
+    qpos_adr = [mj_model.joint(name).qposadr[0] for name in ACTUATED_JOINTS]
+    ext_init = mj_data.qpos[qpos_adr[1:]].copy()
+    angle_chassis_init = mj_data.qpos[qpos_adr[0]]
+    body_ids = [mj_model.body(name).id for name in LINKS]
+    dof_adr = [mj_model.joint(name).dofadr[0] for name in ACTUATED_JOINTS]
+    terrain_id = mj_model.body(TERRAIN_BODY).id
+    n_contact_free = n_step
+    qpos = np.empty((n_step, 4))
+    qvel = np.empty((n_step, 4))
+    xpos = np.empty((n_step, 4, 3))
+    start = time.perf_counter()
+    for ii in range(n_step):
+        mj_data.ctrl[:] = ctrl[ii]
+        mujoco.mj_step(mj_model, mj_data)
+        qpos[ii] = mj_data.qpos[qpos_adr]
+        qvel[ii] = mj_data.qvel[dof_adr]
+        xpos[ii, :3] = mj_data.xpos[body_ids]
+        xpos[ii, 3] = mj_data.xpos[body_ids[2]] + mj_data.xmat[body_ids[2]].reshape(
+            3, 3) @ _BUCKET_TEETH
+        if n_contact_free == n_step and np.any(mj_model.geom_bodyid[
+                mj_data.contact.geom[:mj_data.ncon]] == terrain_id):
+            n_contact_free = ii
+    simulation_time = time.perf_counter() - start
+
+    # Running the kinematic preview
+    start = time.perf_counter()
+    trajectories = preview.rollout(ctrl, ext_init, angle_chassis_init)
+    preview_time = time.perf_counter() - start
+
+    report = {
+        "simulation_time": simulation_time, "preview_time": preview_time,
+        "realtime_factor": n_step * mj_model.opt.timestep / preview_time,
+        "contact_time": (
+            None if n_contact_free == n_step else
+            n_contact_free * mj_model.opt.timestep)}
+    errors = {
+        "angle_chassis": trajectories["angle_chassis"][0] - qpos[:, 0],
+        "ext": trajectories["ext"][0] - qpos[:, 1:],
+        "velocity": np.clip(ctrl, preview.ctrl_range[0], preview.ctrl_range[1]) - qvel,
+    }
+    for ii, name in enumerate(["pos_boom", "pos_arm", "pos_bucket", "pos_teeth"]):
+        errors[name] = np.linalg.norm(trajectories[name][0] - xpos[:, ii], axis=-1)
+
+    # Driving the preview with the joint velocities of the full simulation, so that
+    # only the error of the linkage calculation remains
+    kinematic_preview = KinematicPreview(
+        preview.geometry, preview.timestep, (-np.inf, np.inf), exact=True)
+    trajectories = kinematic_preview.rollout(qvel, ext_init, angle_chassis_init)
+    for ii, name in enumerate(["pos_boom", "pos_arm", "pos_bucket", "pos_teeth"]):
+        errors[name + "_kinematic"] = np.linalg.norm(
+            trajectories[name][0] - xpos[:, ii], axis=-1)
+    for name, error in errors.items():
+        error = error[:max(n_contact_free, 1)]
+        report[name] = {
+            "rms": float(np.sqrt(np.mean(error * error))),
+            "max": float(np.max(np.abs(error)))}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the kinematic preview with the full simulation.")
+    parser.add_argument(
+        "--n_step", type=int, default=2000, help="Number of simulation steps.")
+    parser.add_argument(
+        "--n_trajectory", type=int, default=1000,
+        help="Number of trajectories used to measure the speed of the preview.")
+    parser.add_argument(
+        "--plugin", default=None, help="Folder containing the soil plugin library.")
+    args = parser.parse_args()
+
+    if args.plugin is not None:
+        mujoco.mj_loadAllPluginLibraries(args.plugin)
+    mj_model = generate_excavator_mjmodel({"soil": {}, "pose": {}})
+
+    # Moving all actuators back and forth
+    phase = np.linspace(0.0, 2.0 * np.pi, args.n_step)
+    ctrl = 0.2 * np.stack(
+        (np.sin(phase), np.sin(phase), -np.sin(phase), np.cos(phase)), axis=-1)
+    report = validate_kinematic_preview(mj_model, ctrl)
+    print("Simulated time: %.2f s" % (args.n_step * mj_model.opt.timestep))
+    print("Full simulation: %.3f s" % report.pop("simulation_time"))
+    print("Kinematic preview: %.3f s, %.0f times faster than real time" % (
+        report.pop("preview_time"), report.pop("realtime_factor")))
+    contact_time = report.pop("contact_time")
+    if contact_time is not None:
+        print("Errors calculated before the terrain contact at %.2f s" % contact_time)
+    for name, error in report.items():
+        print("%-14s RMS error %.2e, max error %.2e" % (
+            name, error["rms"], error["max"]))
+
+    # Measuring the speed of the preview on a batch of trajectories
+    preview = KinematicPreview.from_mjmodel(mj_model)
+    batch_ctrl = np.random.default_rng(0).uniform(
+        -0.5, 0.5, (args.n_trajectory, args.n_step, 4))
+    start = time.perf_counter()
+    preview.rollout(batch_ctrl, output_interval=10)
+    elapsed = time.perf_counter() - start
+    print("Batch of %d trajectories: %.3f s, %.0f times faster than real time" % (
+        args.n_trajectory, elapsed,
+        args.n_trajectory * args.n_step * mj_model.opt.timestep / elapsed))
@@ -0,0 +1,384 @@
+"""Preprocesses the meshes of the excavator model.
+
+The purpose of the functions in this file is to prepare the meshes of the excavator
+model so that the model compiles and simulates faster. Two kinds of files are generated
+in the mesh folder:
+- a binary mesh (MSH) for each OBJ mesh, which MuJoCo reads much faster than the
+  text OBJ format,
+- collision proxies for each mesh, which are low-resolution convex meshes used for the
+  collision detection instead of the full meshes.
+
+The binary meshes contain the same vertices, texture coordinates, normals and faces as
+the OBJ meshes. The polygons of the OBJ meshes are triangulated and a vertex is
+created for each distinct combination of position, texture coordinate and normal, as
+required by the MSH format.
+
+As MuJoCo uses the convex hull of a mesh for the collision detection, a collision
+proxy is the convex hull of the mesh reduced to a maximum number of vertices. Concave
+parts can be approximated by several proxies, the mesh being split into slabs along
+its longest dimension, each slab being replaced by its own convex hull. The convex
+hulls are calculated by MuJoCo itself.
+
+The generated files are used by setting the "binary" and "collision_proxy" options of
+the mesh dictionary given to the model generation.
+
+Typical usage example:
+
+    python mesh_preprocessing.py --max_vertex 32 --n_part 2 --benchmark 1000
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import mujoco
+import numpy as np
+import os
+import time
+from model_generation import (
+    COLLISION_PROXY_INDEX, MODEL_PATH, _load_model_assets, generate_excavator_mjmodel)
+
+
+# ==================================================================================== #
+#                                                                                      #
+#        Starting implementation of functions used to preprocess the meshes            #
+#                                                                                      #
+# ==================================================================================== #
+def preprocess_excavator_meshes(
+        max_vertex: int = 32, n_part: int = 1, force: bool = False) -> dict:
+    """Generates the binary meshes and collision proxies of the excavator model.
+
+    The binary meshes are only generated when they are older than their OBJ mesh,
+    unless the generation is forced. The collision proxies are always generated, as
+    they depend on the input parameters.
+
+    Args:
+        max_vertex: Maximum number of vertices of each collision proxy.
+        n_part: Number of collision proxies used for each mesh.
+        force: Whether the binary meshes are generated even if they are up to date.
+
+    Returns:
+        A dictionary mapping the name of the meshes to their number of collision
+        proxies, which is also written into the mesh folder.
+    """
+    mesh_folder = os.path.join(MODEL_PATH, "mesh")
+
+    collision_proxies = {}
+    for mesh_file in sorted(os.listdir(mesh_folder)):
+        if not mesh_file.endswith(".obj"):
+            continue
+        mesh_name = mesh_file[:-4]
+        obj_filename = os.path.join(mesh_folder, mesh_file)
+        msh_filename = os.path.join(mesh_folder, mesh_name + ".msh")
+
+        vertex, texcoord, normal, face = _read_obj(obj_filename)
+
+        # Writing the binary mesh
+        if (force or not os.path.exists(msh_filename) or
+                os.path.getmtime(msh_filename) < os.path.getmtime(obj_filename)):
+            _write_msh(msh_filename, vertex, texcoord, normal, face)
+
+        # Writing the collision proxies, removing the ones of a previous run
+        for proxy_file in os.listdir(mesh_folder):
+            if proxy_file.startswith(mesh_name + "_collision_"):
+                os.remove(os.path.join(mesh_folder, proxy_file))
+        proxies = _calc_collision_proxies(
+            np.unique(vertex, axis=0), max_vertex, n_part)
+        for ii, proxy in enumerate(proxies):
+            _write_msh(os.path.join(
+                mesh_folder, mesh_name + "_collision_" + str(ii) + ".msh"), proxy)
+        collision_proxies[mesh_name] = len(proxies)
+
+    with open(os.path.join(mesh_folder, COLLISION_PROXY_INDEX), "w") as proxy_index:
+        json.dump(collision_proxies, proxy_index, indent=2)
+
+    # The assets read before the preprocessing are outdated
+    _load_model_assets.cache_clear()
+
+    return collision_proxies
+
+
+def _read_obj(filename: str) -> list:
+    """Reads an OBJ mesh.
+
+    The polygons are triangulated as fans and a vertex is created for each distinct
+    combination of position, texture coordinate and normal. The texture coordinates
+    and normals are discarded if they are not given for all faces.
+
+    Args:
+        filename: Path of the OBJ mesh.
+
+    Returns:
+        A list containing the vertices, the texture coordinates (or None), the normals
+        (or None), and the faces of the mesh.
+    """
+    positions = []
+    texcoords = []
+    normals = []
+    corners = []
+    with open(filename, "r") as obj:
+        for line in obj:
+            values = line.split()
+            if not values:
+                continue
+            elif values[0] == "v":
+                positions.append([float(value) for value in values[1:4]])
+            elif values[0] == "vt":
+                texcoords.append([float(value) for value in values[1:3]])
+            elif values[0] == "vn":
+                normals.append([float(value) for value in values[1:4]])
+            elif values[0] == "f":
+                polygon = []
+                for value in values[1:]:
+                    indices = (value.split("/") + ["", ""])[:3]
+                    polygon.append([int(index) if index else 0 for index in indices])
+                for jj in range(1, len(polygon) - 1):
+                    corners.extend([polygon[0], polygon[jj], polygon[jj + 1]])
+
+    # Converting OBJ indices, starting at 1 or negative, into array indices
+    # Missing indices are set to -1
+    corners = np.array(corners, dtype=np.int64)
+    sizes = np.array([len(positions), len(texcoords), len(normals)])
+    corners = np.where(
+        corners > 0, corners - 1, np.where(corners < 0, corners + sizes, -1))
+
+    use_texcoord = bool(texcoords) and np.all(corners[:, 1] >= 0)
+    use_normal = bool(normals) and np.all(corners[:, 2] >= 0)
+    if not use_texcoord:
+        corners[:, 1] = 0
+    if not use_normal:
+        corners[:, 2] = 0
+
+    # Creating a vertex for each distinct combination of indices
+    vertex_indices, face = np.unique(corners, axis=0, return_inverse=True)
+    face = face.reshape(-1, 3)
+
+    vertex = np.array(positions)[vertex_indices[:, 0]]
+    texcoord = None
+    normal = None
+    if use_texcoord:
+        # MuJoCo flips the vertical texture coordinate of OBJ meshes only
+        texcoord = np.array(texcoords)[vertex_indices[:, 1]]
+        texcoord[:, 1] = 1.0 - texcoord[:, 1]
+    if use_normal:
+        normal = np.array(normals)[vertex_indices[:, 2]]
+    return [vertex, texcoord, normal, face]
+
+
+def _write_msh(
+        filename: str, vertex: np.ndarray, texcoord: np.ndarray = None,
+        normal: np.ndarray = None, face: np.ndarray = None) -> None:
+    """Writes a binary mesh following the MSH format of MuJoCo.
+
+    The file starts with the number of vertices, normals, texture coordinates and
+    faces as 32-bit integers, followed by the vertices, normals and texture
+    coordinates as 32-bit floats, and the faces as 32-bit integers.
+
+    Args:
+        filename: Path of the binary mesh.
+        vertex: Position of the vertices.
+        texcoord: Texture coordinates of the vertices. Default value to None.
+        normal: Normal of the vertices. Default value to None.
+        face: Indices of the vertices of each triangular face. When no face is given,
+              MuJoCo uses the convex hull of the vertices. Default value to None.
+    """
+    arrays = [
+        np.asarray(vertex, dtype=np.float32).reshape(-1, 3),
+        np.zeros((0, 3), dtype=np.float32) if normal is None else
+        np.asarray(normal, dtype=np.float32).reshape(-1, 3),
+        np.zeros((0, 2), dtype=np.float32) if texcoord is None else
+        np.asarray(texcoord, dtype=np.float32).reshape(-1, 2),
+        np.zeros((0, 3), dtype=np.int32) if face is None else
+        np.asarray(face, dtype=np.int32).reshape(-1, 3),
+    ]
+    with open(filename, "wb") as msh:
+        np.array([len(array) for array in arrays], dtype=np.int32).tofile(msh)
+        for array in arrays:
+            array.tofile(msh)
+
+
+def _calc_collision_proxies(vertex: np.ndarray, max_vertex: int, n_part: int) -> list:
+    """Calculates the collision proxies of a mesh.
+
+    The mesh is split into slabs of equal width along its longest dimension. Each slab
+    is extended by a quarter of its width on both sides, so that the convex hulls of
+    neighbouring slabs overlap. When none of the slabs has a volume, the convex hull
+    of the whole mesh is used as a single collision proxy.
+
+    Args:
+        vertex: Position of the vertices of the mesh.
+        max_vertex: Maximum number of vertices of each collision proxy.
+        n_part: Number of collision proxies.
+
+    Returns:
+        A list containing the vertices of the convex hull of each collision proxy.
+    """
+    axis = np.argmax(np.ptp(vertex, axis=0))
+    bounds = np.linspace(vertex[:, axis].min(), vertex[:, axis].max(), n_part + 1)
+    margin = 0.25 * (bounds[1] - bounds[0])
+
+    proxies = []
+    for ii in range(n_part):
+        in_part = (
+            (vertex[:, axis] >= bounds[ii] - margin) &
+            (vertex[:, axis] <= bounds[ii + 1] + margin))
+        # Slabs without volume, such as a flat end of the mesh, are skipped as they
+        # are covered by the neighbouring slabs
+        try:
+            proxies.append(_calc_hull_vertices(vertex[in_part], max_vertex))
+        except ValueError:
+            continue
+
+    # Falling back to the convex hull of the whole mesh
+    if not proxies:
+        try:
+            proxies.append(_calc_hull_vertices(vertex, max_vertex))
+        except ValueError:
+            raise Exception(
+                "Collision proxy could not be calculated.\n The mesh has no volume.")
+    return proxies
+
+
+def _calc_hull_vertices(vertex: np.ndarray, max_vertex: int) -> np.ndarray:
+    """Calculates the vertices of the convex hull of a point cloud.
+
+    The convex hull is calculated by MuJoCo when compiling a model containing only the
+    point cloud, its number of vertices being limited by the maxhullvert attribute.
+
+    Args:
+        vertex: Position of the points.
+        max_vertex: Maximum number of vertices of the convex hull.
+
+    Returns:
+        The position of the vertices of the convex hull.
+    """
+    buffer = (
+        np.array([len(vertex), 0, 0, 0], dtype=np.int32).tobytes() +
+        np.asarray(vertex, dtype=np.float32).tobytes())
+    mj_model = mujoco.MjModel.from_xml_string(
+        '<mujoco><asset><mesh name="hull" file="hull.msh" maxhullvert="%d"/></asset>'
+        '<worldbody><geom type="mesh" mesh="hull"/></worldbody></mujoco>' % max_vertex,
+        {"hull.msh": buffer})
+
+    # Reading the vertices of the convex hull from the mesh graph
+    graph = mj_model.mesh_graph[mj_model.mesh_graphadr[0]:]
+    n_hull_vertex = graph[0]
+    hull_indices = graph[2 + n_hull_vertex:2 + 2 * n_hull_vertex]
+    hull_vertex = mj_model.mesh_vert[mj_model.mesh_vertadr[0] + hull_indices]
+
+    # Converting back to the frame of the input points, as MuJoCo centers the meshes
+    rotation = np.zeros(9)
+    mujoco.mju_quat2Mat(rotation, mj_model.mesh_quat[0])
+    return hull_vertex @ rotation.reshape(3, 3).T + mj_model.mesh_pos[0]
+
+
+# ==================================================================================== #
+#                                                                                      #
+#             Starting implementation of functions used to benchmark the meshes        #
+#                                                                                      #
+# ==================================================================================== #
+def benchmark_excavator_meshes(
+        excavator_model: dict, n_step: int = 1000, plugin: str = None) -> dict:
+    """Measures the compile time and step time of the mesh options.
+
+    The options compared are the OBJ meshes, the binary meshes, and the binary meshes
+    with collision proxies. Each option is measured in a new process, as MuJoCo keeps
+    the meshes it has already compiled in a cache, which would otherwise make the
+    later options look faster.
+
+    Args:
+        excavator_model: Dictionary gathering all information about the excavator model.
+                         See _process_excavator_model for its content. Its mesh
+                         dictionary is replaced by each option.
+        n_step: Number of steps used to measure the step time.
+        plugin: Folder containing the soil plugin library, loaded by each process.
+                Default value to no library, which requires a model without the soil
+                plugin.
+
+    Returns:
+        A dictionary mapping the name of each option to its compile time and mean step
+        time. [s]
+    """
+    options = {
+        "obj": {"binary": False, "collision_proxy": False},
+        "msh": {"binary": True, "collision_proxy": False},
+        "msh + proxy": {"binary": True, "collision_proxy": True},
+    }
+
+    timings = {}
+    context = multiprocessing.get_context("spawn")
+    for name, mesh in options.items():
+        with concurrent.futures.ProcessPoolExecutor(1, context) as executor:
+            timings[name] = executor.submit(
+                _benchmark_mesh_option, dict(excavator_model, mesh=mesh), n_step,
+                plugin).result()
+
+    return timings
+
+
+def _benchmark_mesh_option(excavator_model: dict, n_step: int, plugin: str) -> tuple:
+    """Measures the compile time and step time of a mesh option.
+
+    This function is executed by a new process, so that the meshes are not in the
+    cache of MuJoCo yet.
+
+    Args:
+        excavator_model: Dictionary gathering all information about the excavator model.
+        n_step: Number of steps used to measure the step time.
+        plugin: Folder containing the soil plugin library, or None.
+
+    Returns:
+        A tuple containing the compile time and the mean step time. [s]
+    """
+    if plugin is not None:
+        mujoco.mj_loadAllPluginLibraries(plugin)
+
+    # Reading the assets beforehand to measure the compile time only
+    _load_model_assets()
+    start = time.perf_counter()
+    mj_model = generate_excavator_mjmodel(excavator_model)
+    compile_time = time.perf_counter() - start
+
+    mj_data = mujoco.MjData(mj_model)
+    mj_data.ctrl[:] = 0.1
+    start = time.perf_counter()
+    for _ in range(n_step):
+        mujoco.mj_step(mj_model, mj_data)
+    step_time = (time.perf_counter() - start) / n_step
+    return compile_time, step_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generates binary meshes and collision proxies.")
+    parser.add_argument(
+        "--max_vertex", type=int, default=32,
+        help="Maximum number of vertices of each collision proxy.")
+    parser.add_argument(
+        "--n_part", type=int, default=1,
+        help="Number of collision proxies used for each mesh.")
+    parser.add_argument(
+        "--force", action="store_true", help="Generate again all binary meshes.")
+    parser.add_argument(
+        "--benchmark", type=int, default=0, metavar="N_STEP",
+        help="Report the compile and step times using N_STEP steps.")
+    parser.add_argument(
+        "--plugin", default=None,
+        help="Folder containing the soil plugin library, required by the benchmark.")
+    args = parser.parse_args()
+
+    collision_proxies = preprocess_excavator_meshes(
+        args.max_vertex, args.n_part, args.force)
+    print("Preprocessed %d meshes" % len(collision_proxies))
+
+    if args.benchmark:
+        timings = benchmark_excavator_meshes(
+            {"soil": {}, "pose": {}}, args.benchmark, args.plugin)
+        reference_compile_time, reference_step_time = timings["obj"]
+        print("%-12s %14s %14s" % ("meshes", "compile [s]", "step [ms]"))
+        for name, (compile_time, step_time) in timings.items():
+            print("%-12s %7.3f (%+4.0f%%) %7.3f (%+4.0f%%)" % (
+                name, compile_time,
+                100.0 * (compile_time / reference_compile_time - 1.0),
+                1000.0 * step_time, 100.0 * (step_time / reference_step_time - 1.0)))
@@ -0,0 +1,202 @@
+"""Caches compiled excavator models.
+
+The purpose of the functions in this file is to avoid compiling the excavator model
+again when the same model is requested several times, for instance at every worker
+start. Compiling the model requires parsing all the meshes and decoding all the
+textures, which is slow, while loading a compiled binary model (MJB) is faster.
+
+Note that the decoded textures make up most of the compiled model. With the default
+excavator model, an MJB takes 173 MB, of which 166 MB are textures, and loading a
+cached model takes about 0.35 s. The textures are only needed for rendering, so that
+they can be excluded, for instance for headless simulation workers. The MJB then
+takes 6.7 MB and loading a cached model takes about 10 ms.
+
+The compiled models are stored on the local disk and identified by a hash of:
+- the processed excavator model dictionary used to render the template,
+- the content of the template,
+- the content of the meshes and textures,
+- the version of MuJoCo, as the MJB format depends on it,
+- whether the textures are included.
+
+The cache directory can be set with the EXCAVATOR_MODEL_CACHE_DIR environment
+variable. When the total size of the cached models exceeds the maximum size, the least
+recently used models are removed.
+
+Typical usage example:
+
+    from model_cache import load_excavator_mjmodel
+    mj_model = load_excavator_mjmodel(excavator_model)
+    mj_model = load_excavator_mjmodel(excavator_model, textures=False)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import functools
+import hashlib
+import json
+import mujoco
+import os
+import tempfile
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+from model_generation import (
+    MODEL_PATH, _load_model_assets, _process_excavator_model, _render_template)
+
+
+# Environment variable used to set the cache directory
+CACHE_DIR_VARIABLE = "EXCAVATOR_MODEL_CACHE_DIR"
+
+# Default cache directory
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "excavator_simulator", "model")
+
+
+# ==================================================================================== #
+#                                                                                      #
+#        Starting implementation of functions used to cache the excavator model        #
+#                                                                                      #
+# ==================================================================================== #
+def load_excavator_mjmodel(
+        excavator_model: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY,
+        cache_dir: str = None, max_size: int = 2**32,
+        textures: bool = True) -> mujoco.MjModel:
+    """Loads a compiled excavator model, compiling it only if it is not cached.
+
+    Note that the soil plugin library has to be loaded beforehand, for instance with
+    mujoco.mj_loadAllPluginLibraries.
+
+    Args:
+        excavator_model: Dictionary gathering all information about the excavator model.
+                         See _process_excavator_model for its content.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+        cache_dir: Directory where the compiled models are stored. Default value to the
+                   EXCAVATOR_MODEL_CACHE_DIR environment variable if set, or to
+                   ~/.cache/excavator_simulator/model otherwise.
+        max_size: Maximum total size of the cached models. [bytes]
+                  Default value to 4 GiB, that is about 20 models with textures or
+                  600 models without textures.
+        textures: Whether the textures are included in the model. Without textures,
+                  the materials keep their color only.
+
+    Returns:
+        The compiled mujoco.MjModel.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_VARIABLE, DEFAULT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    processed_excavator_model = _process_excavator_model(excavator_model, geometry)
+    filename = os.path.join(
+        cache_dir, _calc_model_key(processed_excavator_model, textures) + ".mjb")
+
+    # Loading the compiled model if it is cached
+    # A corrupted file is simply replaced by a newly compiled model
+    if os.path.exists(filename):
+        try:
+            mj_model = mujoco.MjModel.from_binary_path(filename)
+            os.utime(filename)
+            return mj_model
+        except (FileNotFoundError, ValueError):
+            pass
+
+    # Compiling the model
+    if textures:
+        mj_model = mujoco.MjModel.from_xml_string(
+            _render_template(processed_excavator_model), _load_model_assets())
+    else:
+        spec = mujoco.MjSpec.from_string(
+            _render_template(processed_excavator_model), _load_model_assets())
+        _remove_textures(spec)
+        spec.assets = _load_model_assets()
+        mj_model = spec.compile()
+
+    # Writing the compiled model atomically so that concurrent workers never read a
+    # partially written file
+    file_descriptor, temporary_filename = tempfile.mkstemp(
+        suffix=".mjb.tmp", dir=cache_dir)
+    os.close(file_descriptor)
+    try:
+        mujoco.mj_saveModel(mj_model, temporary_filename, None)
+        os.replace(temporary_filename, filename)
+    finally:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+
+    _evict_models(cache_dir, max_size)
+    return mj_model
+
+
+def _remove_textures(spec: mujoco.MjSpec) -> None:
+    """Removes the textures of an excavator model before it is compiled.
+
+    Args:
+        spec: Specification of the excavator model.
+    """
+    for material in spec.materials:
+        material.textures = [""] * len(material.textures)
+    for texture in list(spec.textures):
+        spec.delete(texture)
+
+
+def _calc_model_key(processed_excavator_model: dict, textures: bool = True) -> str:
+    """Calculates the key identifying a compiled excavator model.
+
+    Args:
+        processed_excavator_model: Dictionary given by _process_excavator_model.
+        textures: Whether the textures are included in the model.
+
+    Returns:
+        The hexadecimal SHA-256 hash identifying the compiled model.
+    """
+    key = hashlib.sha256()
+    key.update(mujoco.__version__.encode())
+    key.update(_calc_source_hash().encode())
+    if not textures:
+        key.update(b"no textures")
+    key.update(json.dumps(
+        processed_excavator_model, sort_keys=True, default=float).encode())
+    return key.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _calc_source_hash() -> str:
+    """Calculates the hash of the template, meshes and textures.
+
+    The hash is calculated at the first call only.
+
+    Returns:
+        The hexadecimal SHA-256 hash of the files used to compile the model.
+    """
+    source_hash = hashlib.sha256()
+    with open(os.path.join(MODEL_PATH, "template", "excavator.xml"), "rb") as template:
+        source_hash.update(template.read())
+    for asset_name, asset in sorted(_load_model_assets().items()):
+        source_hash.update(asset_name.encode())
+        source_hash.update(hashlib.sha256(asset).digest())
+    return source_hash.hexdigest()
+
+
+def _evict_models(cache_dir: str, max_size: int) -> None:
+    """Removes the least recently used models until the cache fits its maximum size.
+
+    Args:
+        cache_dir: Directory where the compiled models are stored.
+        max_size: Maximum total size of the cached models. [bytes]
+    """
+    cached_models = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".mjb"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            cached_models.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in cached_models)
+    for _, size, path in sorted(cached_models):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
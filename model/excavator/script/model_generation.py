@@ -8,17 +8,61 @@ The model generation relies on Jinja.
 The generated model is written in the excavator folder and is named
 "generated_model.xml".
 
+The model can also be generated in memory, without writing any file. In that case,
+the model is returned as a string together with a dictionary of the meshes and
+textures, or directly as a compiled MuJoCo model. The template and the assets are
+read only once and cached at the module level.
+
+Additional poses can be written into the model as keyframes, so that a single compiled
+model can be reset to any of these poses with mujoco.mj_resetDataKeyframe.
+
 Typical usage example:
 
     from model_generation import generate_excavator_model
     generate_excavator_model(excavator_model)
 
+    from model_generation import generate_excavator_mjmodel
+    mj_model = generate_excavator_mjmodel(excavator_model)
+
 Copyright, 2023,  Vilella Kenny.
 """
+import functools
+import json
 import numpy as np
 import os
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
 from jinja2 import Environment, FileSystemLoader
-from pose_calculation import _calc_excavator_pose
+from pose_calculation import _calc_excavator_pose_batch
+from reachability_map import REASON_MESSAGES, _calc_pose_validity_from_angles
+
+
+# Path to the excavator model folder
+MODEL_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+
+# Initial height of the caterpillar frame above the ground [m]
+_CATERPILLAR_HEIGHT = 0.040
+
+# Position of the bucket teeth in the bucket frame used by the soil plugin, see
+# plugin/soil/soil.cc [m]
+_BUCKET_TEETH = (-0.14, 0.0, -0.97)
+
+# Largest distance between the bucket origin and the bucket corners used by the soil
+# plugin, see plugin/soil/soil.cc [m]
+_BUCKET_REACH = np.sqrt(
+    _BUCKET_TEETH[0] * _BUCKET_TEETH[0] + _BUCKET_TEETH[2] * _BUCKET_TEETH[2] +
+    0.34 * 0.34)
+
+# Arm angle of the reference pose, in which the bucket body frame of the excavator
+# model is defined, see excavator.xml [deg]
+_REFERENCE_ANGLE_ARM = -30.0
+
+# Name of the file listing the collision proxies of the meshes
+COLLISION_PROXY_INDEX = "collision_proxy.json"
+
+# Jinja environment used to render the excavator template
+# The template is not expected to change while the module is loaded
+_TEMPLATE_ENVIRONMENT = Environment(
+    loader=FileSystemLoader(os.path.join(MODEL_PATH, "template")), auto_reload=False)
 
 
 # ==================================================================================== #
@@ -26,11 +70,92 @@ from pose_calculation import _calc_excavator_pose
 #          Starting implementation of functions to generate an excavator model         #
 #                                                                                      #
 # ==================================================================================== #
-def generate_excavator_model(excavator_model: dict) -> list:
+def generate_excavator_model(
+        excavator_model: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY,
+        filename: str = None) -> None:
     """Generates an excavator model.
 
     This function generates an excavator model following the properties inside the
-    input dictionary.
+    input dictionary and writes it to disk.
+
+    The generated model is written into the model/excavator folder under the
+    "generated_excavator.xml" name, unless another filename is provided. As the meshes
+    and textures are referenced relative to the model, the file should be written in
+    the model/excavator folder.
+
+    Args:
+        excavator_model: Dictionary gathering all information about the excavator model.
+                         See _process_excavator_model for its content.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+        filename: Path of the generated model.
+                  Default value to model/excavator/generated_excavator.xml.
+    """
+    generated_model = _render_template(
+        _process_excavator_model(excavator_model, geometry))
+
+    # Writing generated model to file
+    if filename is None:
+        filename = os.path.join(MODEL_PATH, "generated_excavator.xml")
+    with open(filename, "w") as model:
+        model.write(generated_model)
+
+
+def render_excavator_model(
+        excavator_model: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
+    """Renders an excavator model in memory.
+
+    This function generates an excavator model following the properties inside the
+    input dictionary without writing any file.
+
+    Args:
+        excavator_model: Dictionary gathering all information about the excavator model.
+                         See _process_excavator_model for its content.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A list containing the generated model as a string, and a dictionary mapping
+        the path of the meshes and textures relative to the model folder to their
+        content. The dictionary is shared between calls and should not be modified.
+    """
+    generated_model = _render_template(
+        _process_excavator_model(excavator_model, geometry))
+    return [generated_model, _load_model_assets()]
+
+
+def generate_excavator_mjmodel(
+        excavator_model: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY):
+    """Generates a compiled MuJoCo model of an excavator.
+
+    This function generates an excavator model following the properties inside the
+    input dictionary and compiles it without writing or reading any file, except for
+    the first call that reads the assets.
+
+    Note that the soil plugin library has to be loaded beforehand, for instance with
+    mujoco.mj_loadAllPluginLibraries.
+
+    Args:
+        excavator_model: Dictionary gathering all information about the excavator model.
+                         See _process_excavator_model for its content.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The compiled mujoco.MjModel.
+    """
+    import mujoco
+
+    generated_model, assets = render_excavator_model(excavator_model, geometry)
+    return mujoco.MjModel.from_xml_string(generated_model, assets)
+
+
+def _process_excavator_model(
+        excavator_model: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> dict:
+    """Processes the properties of an excavator model.
+
+    This function calculates all the properties required to render the excavator
+    template following the properties inside the input dictionary.
 
     As the convention between MuJoCo and the pose calculation script is slightly
     different, some conversion has to be made. In particular, all distances are
@@ -41,9 +166,6 @@ def generate_excavator_model(excavator_model: dict) -> list:
     Note that a second dictionary is used in order to not modify the properties inside
     the input dictionary.
 
-    The generated model is written into the model/excavator folder under the
-    "generated_moedl.xml" name.
-
     Args:
         model_excavator: Dictionary gathering all information about the excavator model.
                          It contains:
@@ -65,6 +187,11 @@ def generate_excavator_model(excavator_model: dict) -> list:
                              Default value to 4.
                 amp_noise: Amplitude of the noise used for the terrain initialization.
                            Default value to 50.0.
+                bucket_window: Whether the two bucket soil HFields only cover a
+                               square window following the bucket, instead of the
+                               whole grid. The window is sized to contain the bucket
+                               in any orientation plus cell_buffer cells.
+                               Default value to False.
             pose: Dictionary gathering all information about the excavator pose.
                   It contains:
                 angle_boom: Angle of the boom relative to the horizontal plane. [deg]
@@ -73,11 +200,31 @@ def generate_excavator_model(excavator_model: dict) -> list:
                            Default value to -30.0.
                 angle_bucket: Angle of the bucket relative to the horizontal [deg]
                               plane. Default value to 40.0.
+            mesh: Dictionary gathering the options of the excavator meshes.
+                  It contains:
+                binary: Whether the binary meshes (MSH) generated by
+                        mesh_preprocessing.py are used instead of the OBJ meshes.
+                        Default value to False.
+                collision_proxy: Whether the collision proxies generated by
+                                 mesh_preprocessing.py are used for the collision
+                                 detection, the full meshes being only used for
+                                 rendering. Default value to False.
+            keyframes: List of dictionaries gathering additional excavator poses,
+                       following the convention of the pose dictionary. Each pose
+                       is written as a keyframe of the model, which can be named
+                       with an optional "name" key. Default value to an empty list.
+        geometry: Geometry of the excavator. It is used for the pose calculation and
+                  provides the range of the pistons written into the model.
+                  Default value to the geometry of the excavator model.
+
+    Returns:
+        The dictionary used to render the excavator template.
     """
     # Creating a new empty dictionary to avoid changing the input
     processed_excavator_model = {}
     processed_excavator_model["soil"] = {}
-    processed_excavator_model["pose"] = {}
+    processed_excavator_model["mesh"] = {}
+    processed_excavator_model["piston"] = {}
 
     # Populating the soil dictionary
     processed_excavator_model["soil"]["grid_length_x"] = excavator_model["soil"].get(
@@ -103,24 +250,149 @@ def generate_excavator_model(excavator_model: dict) -> list:
     processed_excavator_model["soil"]["amp_noise"] = excavator_model["soil"].get(
         "amp_noise", 50.0)
 
+    # Calculating the size of the bucket soil HFields
+    processed_excavator_model["soil"].update(
+        _calc_bucket_soil_grid(
+            processed_excavator_model["soil"],
+            excavator_model["soil"].get("bucket_window", False)))
+
+    # Populating the mesh dictionary
+    mesh = excavator_model.get("mesh", {})
+    collision_proxy = mesh.get("collision_proxy", False)
+    processed_excavator_model["mesh"]["extension"] = (
+        "msh" if mesh.get("binary", False) else "obj")
+    processed_excavator_model["mesh"]["collision_proxy"] = collision_proxy
+    processed_excavator_model["mesh"]["proxy"] = (
+        _load_collision_proxies() if collision_proxy else {})
+
+    # Populating the pose dictionary
+    processed_excavator_model["pose"] = _process_excavator_pose(
+        excavator_model["pose"], geometry)
+
+    # Populating the keyframe list
+    processed_excavator_model["keyframes"] = []
+    for ii, keyframe in enumerate(excavator_model.get("keyframes", [])):
+        try:
+            processed_pose = _process_excavator_pose(keyframe, geometry)
+        except Exception as error:
+            raise Exception(str(error) + "\n Keyframe: " + str(ii)) from None
+        processed_excavator_model["keyframes"].append({
+            "name": keyframe.get("name", "pose " + str(ii)),
+            "qpos": _calc_keyframe_qpos(
+                processed_excavator_model["pose"], processed_pose),
+        })
+
+    # Populating the piston dictionary
+    processed_excavator_model["piston"]["min_chassis_boom_piston"] = (
+        geometry.cb_piston_range[0])
+    processed_excavator_model["piston"]["max_chassis_boom_piston"] = (
+        geometry.cb_piston_range[1])
+    processed_excavator_model["piston"]["min_boom_arm_piston"] = (
+        geometry.ba_piston_range[0])
+    processed_excavator_model["piston"]["max_boom_arm_piston"] = (
+        geometry.ba_piston_range[1])
+    processed_excavator_model["piston"]["min_arm_bucket_piston"] = (
+        geometry.ah_piston_range[0])
+    processed_excavator_model["piston"]["max_arm_bucket_piston"] = (
+        geometry.ah_piston_range[1])
+
+    return processed_excavator_model
+
+
+def _calc_bucket_soil_grid(processed_soil: dict, bucket_window: bool) -> dict:
+    """Calculates the size of the bucket soil HFields.
+
+    When a window is requested, the bucket soil HFields are reduced to a square
+    window centered on the bucket, whose half-size is the reach of the bucket plus
+    cell_buffer cells. The soil plugin moves the window with the bucket and aligns it
+    with the cells of the terrain. The whole grid is used if the window would not be
+    smaller than the grid.
+
+    Note that the cell size follows the convention of the soil plugin, that is twice
+    the grid length divided by the number of cells.
+
+    Args:
+        processed_soil: Soil dictionary of the processed excavator model, containing
+                        the grid geometry and the cell buffer.
+        bucket_window: Whether the bucket soil HFields only cover a window.
+
+    Returns:
+        A dictionary containing the number of cells and the half-length of the bucket
+        soil HFields in both directions, as well as whether a window is used.
+    """
+    grid_size_x = processed_soil["grid_size_x"]
+    grid_size_y = processed_soil["grid_size_y"]
+    cell_size_xy = 2.0 * processed_soil["grid_length_x"] / grid_size_x
+    half_window = int(np.ceil(_BUCKET_REACH / cell_size_xy)) + int(
+        processed_soil["cell_buffer"])
+    window_size = 2 * half_window + 1
+
+    if not bucket_window or window_size >= min(grid_size_x, grid_size_y):
+        return {
+            "bucket_window": False,
+            "bucket_grid_size_x": grid_size_x,
+            "bucket_grid_size_y": grid_size_y,
+            "bucket_grid_length_x": processed_soil["grid_length_x"],
+            "bucket_grid_length_y": processed_soil["grid_length_y"],
+        }
+
+    # The window is aligned with the vertices of the terrain HField
+    return {
+        "bucket_window": True,
+        "bucket_grid_size_x": window_size,
+        "bucket_grid_size_y": window_size,
+        "bucket_grid_length_x": (
+            processed_soil["grid_length_x"] * (window_size - 1) / (grid_size_x - 1)),
+        "bucket_grid_length_y": (
+            processed_soil["grid_length_y"] * (window_size - 1) / (grid_size_y - 1)),
+    }
+
+
+def _process_excavator_pose(
+        pose: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> dict:
+    """Processes the pose of an excavator model.
+
+    This function calculates the properties of the excavator bodies required to
+    render the excavator template in the requested pose.
+
+    Args:
+        pose: Dictionary gathering all information about the excavator pose.
+              See _process_excavator_model for its content.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The pose dictionary used to render the excavator template.
+    """
+    # Testing validity of requested pose
+    code = _calc_excavator_pose_validity(pose, geometry)
+    for reason, message in REASON_MESSAGES.items():
+        if (code & reason):
+            raise Exception("Excavator pose invalid.\n " + message)
+
     # Calculating the excavator pose
-    angle_boom = excavator_model["pose"].get("angle_boom", 30.0)
-    angle_arm = excavator_model["pose"].get("angle_arm", -30.0)
-    angle_bucket = excavator_model["pose"].get("angle_bucket", 40.0)
+    angle_boom = pose.get("angle_boom", 30.0)
+    angle_arm = pose.get("angle_arm", -30.0)
+    angle_bucket = pose.get("angle_bucket", 40.0)
     [
         angle_cb_piston, ext_cb_piston, x_I, z_I, angle_ba_piston, ext_ba_piston,
         angle_ah_piston, ext_ah_piston, angle_h_link, x_M, z_M, x_L, z_L,
         angle_side_link
-    ] = _calc_excavator_pose(
-        np.deg2rad(angle_boom), np.deg2rad(angle_arm), np.deg2rad(angle_bucket))
+    ] = [value[()] for value in _calc_excavator_pose_batch(
+        np.deg2rad(angle_boom), np.deg2rad(angle_arm), np.deg2rad(angle_bucket),
+        geometry).to_list()]
 
     # Calculating total angles in degrees
+    # The bucket body frame is the one of the reference pose, so that the bucket mesh,
+    # the bucket inertia and the side link attachment point keep the same relative
+    # position in any pose
     angle_arm_rad = -np.deg2rad(angle_arm)
-    angle_bucket_rad = -np.deg2rad(angle_bucket) + angle_arm_rad
+    angle_bucket_rad = -np.deg2rad(angle_bucket + _REFERENCE_ANGLE_ARM)
+    d_angle_bucket_frame = angle_arm - _REFERENCE_ANGLE_ARM
 
-    # Calculating bucket reference orientation
-    bucket_quat_w = np.cos(angle_arm_rad / 2)
-    bucket_quat_y = np.sin(angle_arm_rad / 2)
+    # Calculating bucket reference orientation, fixed by the reference pose
+    bucket_quat_w = np.cos(np.deg2rad(_REFERENCE_ANGLE_ARM) / 2)
+    bucket_quat_y = -np.sin(np.deg2rad(_REFERENCE_ANGLE_ARM) / 2)
 
     # Calculating coordinate of arm/bucket attachment point in arm reference frame
     x_I_arm = x_I * np.cos(angle_arm_rad) - z_I * np.sin(angle_arm_rad)
@@ -139,7 +411,7 @@ def generate_excavator_model(excavator_model: dict) -> list:
     angle_ba_piston = np.rad2deg(angle_ba_piston)
     angle_ah_piston = np.rad2deg(angle_ah_piston)
     angle_h_link = np.rad2deg(angle_h_link)
-    angle_side_link = np.rad2deg(angle_side_link)
+    angle_side_link = np.rad2deg(angle_side_link) - d_angle_bucket_frame
 
     # Converting distances from cm to m
     ext_cb_piston = ext_cb_piston / 100.0
@@ -152,60 +424,148 @@ def generate_excavator_model(excavator_model: dict) -> list:
     x_L_bucket = x_L_bucket / 100.0
     z_L_bucket = z_L_bucket / 100.0
 
-    # Testing validity of requested pose
-    if (ext_cb_piston > 0.56):
-        raise Exception(
-            "Excavator pose invalid.\n Chassis/boom piston extension is too large.")
-    if (ext_cb_piston < 0.06):
-        raise Exception(
-            "Excavator pose invalid.\n Chassis/boom piston extension is too short.")
-    if (ext_ba_piston > 1.1):
-        raise Exception(
-            "Excavator pose invalid.\n Boom/arm piston extension is too large.")
-    if (ext_ba_piston < 0.28):
-        raise Exception(
-            "Excavator pose invalid.\n Boom/arm piston extension is too short.")
-    if (ext_ah_piston > 0.75):
-        raise Exception(
-            "Excavator pose invalid.\n Arm/bucket piston extension is too large.")
-    if (ext_ah_piston < 0.15):
+    # Populating the pose dictionary, distances of the geometry being converted from cm
+    # to m
+    processed_pose = {}
+    processed_pose["z_caterpillar"] = _CATERPILLAR_HEIGHT
+    processed_pose["z_chassis"] = geometry.z_chassis / 100.0
+    processed_pose["x_boom"] = geometry.x_C / 100.0
+    processed_pose["z_boom"] = geometry.z_C / 100.0
+    processed_pose["x_chassis_boom_piston"] = (geometry.x_C + geometry.x_D) / 100.0
+    processed_pose["z_chassis_boom_piston"] = (geometry.z_C + geometry.z_D) / 100.0
+    processed_pose["angle_boom"] = -angle_boom
+    processed_pose["angle_arm"] = -angle_arm + angle_boom
+    processed_pose["angle_bucket"] = -angle_bucket + d_angle_bucket_frame
+    processed_pose["bucket_quat_w"] = bucket_quat_w
+    processed_pose["bucket_quat_y"] = bucket_quat_y
+    processed_pose["angle_chassis_boom_piston"] = angle_cb_piston
+    processed_pose["ext_chassis_boom_piston"] = ext_cb_piston
+    processed_pose["angle_boom_arm_piston"] = angle_ba_piston
+    processed_pose["ext_boom_arm_piston"] = ext_ba_piston
+    processed_pose["x_arm_bucket_piston"] = x_I_arm
+    processed_pose["z_arm_bucket_piston"] = z_I_arm
+    processed_pose["angle_arm_bucket_piston"] = angle_ah_piston
+    processed_pose["ext_arm_bucket_piston"] = ext_ah_piston
+    processed_pose["angle_h_link"] = angle_h_link
+    processed_pose["x_bucket"] = x_M_arm
+    processed_pose["z_bucket"] = z_M_arm
+    processed_pose["x_side_link"] = x_L_bucket
+    processed_pose["z_side_link"] = z_L_bucket
+    processed_pose["angle_side_link"] = angle_side_link
+
+    return processed_pose
+
+
+def _calc_excavator_pose_validity(
+        pose: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> int:
+    """Calculates the reason code associated with the pose of an excavator model.
+
+    The pose is checked with _calc_pose_validity_from_angles, so that the poses off
+    the linkage branch are invalid as in the reachability map.
+
+    Args:
+        pose: Dictionary gathering all information about the excavator pose.
+              See _process_excavator_model for its content.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        The reason code defined in reachability_map.py, equal to VALID when the pose
+        is valid.
+    """
+    return int(_calc_pose_validity_from_angles(
+        pose.get("angle_boom", 30.0), pose.get("angle_arm", -30.0),
+        pose.get("angle_bucket", 40.0), geometry))
+
+
+def _calc_keyframe_qpos(processed_pose: dict, processed_keyframe: dict) -> str:
+    """Calculates the joint positions of the excavator model in a keyframe pose.
+
+    The bodies of the model are placed in the pose of the model, so that the joint
+    positions of a keyframe correspond to the rotation of each body relative to this
+    pose, and to the piston extension for the slide joints. As the bodies are rigid,
+    including the bucket whose frame is defined in the reference pose of the model,
+    the keyframe places each body as a model generated in the keyframe pose.
+
+    Args:
+        processed_pose: Pose dictionary of the reference pose, given by
+                        _process_excavator_pose.
+        processed_keyframe: Pose dictionary of the keyframe pose, given by
+                            _process_excavator_pose.
+
+    Returns:
+        The joint positions of the keyframe, excluding the free joint of the
+        caterpillar, given in the order of the joints in the excavator model.
+    """
+    def _calc_rotation(name: str) -> float:
+        return np.deg2rad(processed_keyframe[name] - processed_pose[name])
+
+    qpos = [
+        0.0,
+        _calc_rotation("angle_chassis_boom_piston"),
+        processed_keyframe["ext_chassis_boom_piston"],
+        _calc_rotation("angle_boom"),
+        _calc_rotation("angle_boom_arm_piston"),
+        processed_keyframe["ext_boom_arm_piston"],
+        _calc_rotation("angle_arm"),
+        _calc_rotation("angle_arm_bucket_piston"),
+        processed_keyframe["ext_arm_bucket_piston"],
+        _calc_rotation("angle_h_link"),
+        _calc_rotation("angle_bucket"),
+        _calc_rotation("angle_side_link"),
+    ]
+    return " ".join(repr(float(value)) for value in qpos)
+
+
+def _render_template(processed_excavator_model: dict) -> str:
+    """Renders the excavator template.
+
+    Args:
+        processed_excavator_model: Dictionary given by _process_excavator_model.
+
+    Returns:
+        The generated model.
+    """
+    return _get_model_template().render(processed_excavator_model)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_model_template():
+    """Returns the compiled excavator template, loaded at the first call."""
+    return _TEMPLATE_ENVIRONMENT.get_template("excavator.xml")
+
+
+def _load_collision_proxies() -> dict:
+    """Reads the list of collision proxies generated by mesh_preprocessing.py.
+
+    Returns:
+        A dictionary mapping the name of the meshes to their number of collision
+        proxies.
+    """
+    filename = os.path.join(MODEL_PATH, "mesh", COLLISION_PROXY_INDEX)
+    if not os.path.exists(filename):
         raise Exception(
-            "Excavator pose invalid.\n Arm/bucket piston extension is too short.")
+            "Collision proxies not found.\n Run mesh_preprocessing.py first.")
+    with open(filename, "r") as collision_proxy_index:
+        return json.load(collision_proxy_index)
 
-    # Populating the pose dictionary
-    processed_excavator_model["pose"]["angle_boom"] = -angle_boom
-    processed_excavator_model["pose"]["angle_arm"] = -angle_arm + angle_boom
-    processed_excavator_model["pose"]["angle_bucket"] = -angle_bucket
-    processed_excavator_model["pose"]["bucket_quat_w"] = bucket_quat_w
-    processed_excavator_model["pose"]["bucket_quat_y"] = bucket_quat_y
-    processed_excavator_model["pose"]["angle_chassis_boom_piston"] = angle_cb_piston
-    processed_excavator_model["pose"]["ext_chassis_boom_piston"] = ext_cb_piston
-    processed_excavator_model["pose"]["angle_boom_arm_piston"] = angle_ba_piston
-    processed_excavator_model["pose"]["ext_boom_arm_piston"] = ext_ba_piston
-    processed_excavator_model["pose"]["x_arm_bucket_piston"] = x_I_arm
-    processed_excavator_model["pose"]["z_arm_bucket_piston"] = z_I_arm
-    processed_excavator_model["pose"]["angle_arm_bucket_piston"] = angle_ah_piston
-    processed_excavator_model["pose"]["ext_arm_bucket_piston"] = ext_ah_piston
-    processed_excavator_model["pose"]["angle_h_link"] = angle_h_link
-    processed_excavator_model["pose"]["x_bucket"] = x_M_arm
-    processed_excavator_model["pose"]["z_bucket"] = z_M_arm
-    processed_excavator_model["pose"]["x_side_link"] = x_L_bucket
-    processed_excavator_model["pose"]["z_side_link"] = z_L_bucket
-    processed_excavator_model["pose"]["angle_side_link"] = angle_side_link
 
-    # Generating excavator model
-    filepath = os.path.abspath(os.path.dirname(__file__))
-    template_path = os.path.join(filepath, "..", "template")
-    file_loader = FileSystemLoader(template_path)
-    env = Environment(loader=file_loader)
-    model_template = env.get_template("excavator.xml")
-    generated_model = model_template.render(processed_excavator_model)
+@functools.lru_cache(maxsize=None)
+def _load_model_assets() -> dict:
+    """Reads the meshes and textures of the excavator model.
 
-    # Writing generated model to file
-    model_path = os.path.join(filepath, "..")
-    filename = model_path + "/generated_excavator.xml"
-    with open(filename, "w") as model:
-        model.write(generated_model)
+    The assets are read at the first call only.
+
+    Returns:
+        A dictionary mapping the path of the meshes and textures relative to the model
+        folder to their content.
+    """
+    assets = {}
+    for folder in ["mesh", "texture"]:
+        for asset_name in sorted(os.listdir(os.path.join(MODEL_PATH, folder))):
+            with open(os.path.join(MODEL_PATH, folder, asset_name), "rb") as asset:
+                assets[folder + "/" + asset_name] = asset.read()
+    return assets
 
 
 if __name__ == "__main__":
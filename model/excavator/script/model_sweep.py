@@ -0,0 +1,335 @@
+"""Generates a batch of excavator models from a parameter sweep.
+
+The purpose of the functions in this file is to generate a large number of excavator
+models, for instance for domain randomization, from a sweep specification given as a
+JSON or YAML file. The models are rendered in parallel in a process pool and written
+to unique paths in an output folder, together with a manifest listing all variants.
+
+The sweep specification is a dictionary containing a "soil" and a "pose" dictionary
+whose keys follow the convention of _process_excavator_model. Each parameter can be:
+- a single value, used for all variants,
+- a list of values, the variants being generated from the Cartesian product of all
+  lists,
+- a dictionary describing a random draw, either {"uniform": [low, high]},
+  {"integers": [low, high]} (both bounds included), or {"choice": [values]}.
+The number of random draws for each combination of the Cartesian product is given by
+the "n_draw" key, while the "seed" key sets the seed of the random number generator.
+The geometry of the excavator can be changed with the optional "geometry" dictionary
+containing arguments of ExcavatorGeometry.
+
+Each variant is identified by a hash of its parameters, of the geometry and of the
+template, which is also used to name the generated model. Identical variants, for
+instance random draws over a small domain, are generated and listed once. Variants
+already present in the manifest of a previous run are skipped, while the models of
+the variants that are not part of the sweep anymore are removed. Variants whose pose
+is invalid are reported in the manifest without stopping the generation of the other
+variants.
+
+Typical usage example:
+
+    python model_sweep.py sweep.json --output generated --n_worker 8
+
+with sweep.json containing for instance:
+
+    {
+        "seed": 0,
+        "n_draw": 10,
+        "soil": {"cell_size_xy": [0.025, 0.05], "amp_noise": {"uniform": [0, 50]}},
+        "pose": {"angle_boom": [10.0, 30.0], "angle_arm": {"uniform": [-60.0, -20.0]}}
+    }
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import numpy as np
+import os
+import tempfile
+from excavator_geometry import ExcavatorGeometry
+from model_generation import (
+    MODEL_PATH, _calc_excavator_pose_validity, _process_excavator_model,
+    _render_template)
+from reachability_map import REASON_MESSAGES, VALID
+
+
+# Name of the manifest written in the output folder
+MANIFEST_NAME = "manifest.json"
+
+# Status of the variants reported in the manifest
+GENERATED = "generated"
+INVALID = "invalid"
+FAILED = "failed"
+
+
+# ==================================================================================== #
+#                                                                                      #
+#       Starting implementation of functions used to generate a batch of models        #
+#                                                                                      #
+# ==================================================================================== #
+def generate_excavator_sweep(
+        sweep: dict, output_folder: str = None, n_worker: int = None,
+        force: bool = False) -> dict:
+    """Generates all the excavator models of a parameter sweep.
+
+    The models are written into the output folder under the "excavator_<key>.xml"
+    name, where key is the beginning of the hash identifying the variant. Variants
+    whose key is already present in the manifest of the output folder are skipped,
+    unless their model file is missing, their generation failed, or the generation
+    is forced. The model files of the variants present in the manifest but not in
+    the sweep are removed.
+
+    Args:
+        sweep: Dictionary describing the parameter sweep. See the module docstring for
+               its content.
+        output_folder: Folder where the models and the manifest are written.
+                       Default value to model/excavator/generated.
+        n_worker: Number of processes used to render the models.
+                  Default value to the number of processors.
+        force: Whether the variants already generated are generated again.
+
+    Returns:
+        The manifest, which is also written into the output folder.
+    """
+    if output_folder is None:
+        output_folder = os.path.join(MODEL_PATH, "generated")
+    output_folder = os.path.abspath(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Meshes and textures are referenced relative to the generated models
+    asset_folder = os.path.relpath(MODEL_PATH, output_folder).replace(os.sep, "/")
+    asset_folder = asset_folder + "/"
+
+    geometry = ExcavatorGeometry(**sweep.get("geometry", {}))
+    with open(os.path.join(MODEL_PATH, "template", "excavator.xml"), "rb") as template:
+        template_hash = hashlib.sha256(template.read()).hexdigest()
+
+    # Reading the manifest of the previous run
+    previous_variants = {}
+    manifest_filename = os.path.join(output_folder, MANIFEST_NAME)
+    if os.path.exists(manifest_filename):
+        with open(manifest_filename, "r") as manifest_file:
+            for variant in json.load(manifest_file)["variants"]:
+                previous_variants[variant["key"]] = variant
+
+    # Determining the variants that have to be generated, each key being kept once
+    # as identical variants would be written to the same file
+    variants = []
+    pending_variants = []
+    keys = set()
+    for excavator_model in _expand_sweep(sweep):
+        key = _calc_variant_key(excavator_model, geometry, template_hash)
+        if key in keys:
+            continue
+        keys.add(key)
+        variant = previous_variants.pop(key, None)
+        if force or variant is None or variant["status"] == FAILED or (
+                variant["status"] == GENERATED and
+                not os.path.exists(os.path.join(output_folder, variant["filename"]))):
+            variant = {
+                "key": key, "filename": "excavator_" + key[:16] + ".xml",
+                "soil": excavator_model["soil"], "pose": excavator_model["pose"]}
+            pending_variants.append(variant)
+        variants.append(variant)
+
+    # Removing the models of the variants that are not part of the sweep anymore
+    for variant in previous_variants.values():
+        if variant["status"] == GENERATED:
+            try:
+                os.remove(os.path.join(output_folder, variant["filename"]))
+            except FileNotFoundError:
+                pass
+
+    # Rendering the models in a process pool
+    if pending_variants:
+        with concurrent.futures.ProcessPoolExecutor(n_worker) as executor:
+            results = executor.map(
+                _generate_variant, pending_variants,
+                itertools.repeat(output_folder), itertools.repeat(asset_folder),
+                itertools.repeat(geometry),
+                chunksize=max(
+                    1, len(pending_variants) // (4 * (n_worker or os.cpu_count()))))
+            for variant, (status, message) in zip(pending_variants, results):
+                variant["status"] = status
+                variant["message"] = message
+
+    # Writing the manifest
+    manifest = {
+        "sweep": sweep,
+        "n_variant": len(variants),
+        "n_processed": len(pending_variants),
+        "n_skipped": len(variants) - len(pending_variants),
+        "n_invalid": sum(variant["status"] == INVALID for variant in variants),
+        "n_failed": sum(variant["status"] == FAILED for variant in variants),
+        "variants": variants,
+    }
+    temporary_filename = manifest_filename + ".tmp"
+    with open(temporary_filename, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temporary_filename, manifest_filename)
+
+    return manifest
+
+
+def _expand_sweep(sweep: dict) -> list:
+    """Expands a sweep specification into the list of its variants.
+
+    The variants are drawn in a deterministic order, so that the same specification
+    always gives the same variants.
+
+    Args:
+        sweep: Dictionary describing the parameter sweep. See the module docstring for
+               its content.
+
+    Returns:
+        A list of dictionaries gathering the "soil" and "pose" dictionaries of each
+        variant.
+    """
+    rng = np.random.default_rng(sweep.get("seed", 0))
+    n_draw = sweep.get("n_draw", 1)
+
+    # Gathering all parameters
+    parameters = []
+    for group in ["soil", "pose"]:
+        for name, value in sorted(sweep.get(group, {}).items()):
+            parameters.append((group, name, value))
+
+    # Expanding the Cartesian product
+    product_values = [
+        value if isinstance(value, list) else [value] for _, _, value in parameters]
+
+    variants = []
+    for values in itertools.product(*product_values):
+        for _ in range(n_draw):
+            excavator_model = {"soil": {}, "pose": {}}
+            for (group, name, _), value in zip(parameters, values):
+                excavator_model[group][name] = _draw_value(value, rng)
+            variants.append(excavator_model)
+    return variants
+
+
+def _draw_value(value, rng: np.random.Generator):
+    """Draws the value of a parameter.
+
+    Args:
+        value: Value of the parameter, or dictionary describing a random draw.
+        rng: Random number generator.
+
+    Returns:
+        The value of the parameter.
+    """
+    if not isinstance(value, dict):
+        return value
+    elif "uniform" in value:
+        return float(rng.uniform(value["uniform"][0], value["uniform"][1]))
+    elif "integers" in value:
+        return int(rng.integers(value["integers"][0], value["integers"][1] + 1))
+    elif "choice" in value:
+        return value["choice"][int(rng.integers(len(value["choice"])))]
+    else:
+        raise ValueError("Unknown random draw: " + json.dumps(value))
+
+
+def _calc_variant_key(
+        excavator_model: dict, geometry: ExcavatorGeometry, template_hash: str) -> str:
+    """Calculates the key identifying a variant.
+
+    Args:
+        excavator_model: Dictionary gathering all information about the excavator model.
+        geometry: Geometry of the excavator.
+        template_hash: Hash of the excavator template.
+
+    Returns:
+        The hexadecimal SHA-256 hash identifying the variant.
+    """
+    key = hashlib.sha256()
+    key.update(template_hash.encode())
+    key.update(json.dumps(geometry.asdict(), sort_keys=True).encode())
+    key.update(json.dumps(excavator_model, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+def _generate_variant(
+        variant: dict, output_folder: str, asset_folder: str,
+        geometry: ExcavatorGeometry) -> tuple:
+    """Generates the excavator model of a variant.
+
+    This function is executed by the worker processes. The exceptions are reported
+    instead of being raised, so that a single variant cannot stop the whole batch.
+
+    Args:
+        variant: Dictionary describing the variant.
+        output_folder: Folder where the model is written.
+        asset_folder: Path of the excavator model folder relative to the output folder.
+        geometry: Geometry of the excavator.
+
+    Returns:
+        A tuple containing the status of the variant and an error message.
+    """
+    try:
+        code = _calc_excavator_pose_validity(variant["pose"], geometry)
+        if code != VALID:
+            return INVALID, " ".join(
+                message for reason, message in REASON_MESSAGES.items()
+                if code & reason)
+
+        processed_excavator_model = _process_excavator_model(variant, geometry)
+        processed_excavator_model["asset_folder"] = asset_folder
+        generated_model = _render_template(processed_excavator_model)
+
+        # Writing the model atomically so that an interrupted run leaves no partial
+        # file, the temporary file being unique to each process
+        descriptor, temporary_filename = tempfile.mkstemp(
+            ".tmp", "excavator_", output_folder)
+        try:
+            with os.fdopen(descriptor, "w") as model:
+                model.write(generated_model)
+            os.replace(
+                temporary_filename, os.path.join(output_folder, variant["filename"]))
+        except BaseException:
+            os.remove(temporary_filename)
+            raise
+    except Exception as error:
+        return FAILED, str(error)
+    return GENERATED, ""
+
+
+def _load_sweep(filename: str) -> dict:
+    """Reads a sweep specification from a JSON or YAML file.
+
+    Args:
+        filename: Path of the sweep specification. Files ending with ".yaml" or ".yml"
+                  are read as YAML, which requires PyYAML.
+
+    Returns:
+        The dictionary describing the parameter sweep.
+    """
+    with open(filename, "r") as sweep_file:
+        if filename.endswith((".yaml", ".yml")):
+            import yaml
+            return yaml.safe_load(sweep_file)
+        return json.load(sweep_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generates a batch of excavator models from a parameter sweep.")
+    parser.add_argument("sweep", help="JSON or YAML file describing the sweep.")
+    parser.add_argument(
+        "-o", "--output", default=None,
+        help="Output folder. Default value to model/excavator/generated.")
+    parser.add_argument(
+        "-j", "--n_worker", type=int, default=None,
+        help="Number of processes. Default value to the number of processors.")
+    parser.add_argument(
+        "--force", action="store_true", help="Generate again all the variants.")
+    args = parser.parse_args()
+
+    manifest = generate_excavator_sweep(
+        _load_sweep(args.sweep), args.output, args.n_worker, args.force)
+    print(
+        "%d variants: %d processed, %d skipped, %d invalid, %d failed" % (
+            manifest["n_variant"], manifest["n_processed"], manifest["n_skipped"],
+            manifest["n_invalid"], manifest["n_failed"]))
@@ -4,6 +4,10 @@ The purpose of the functions in this file is to calculate the pose of the differ
 parts of an excavator provided the boom, arm and bucket angle.
 The reasoning behind the calculation is provided in the model readme.
 
+A batched version of the calculation is also provided in order to evaluate a large
+number of poses at once. It accepts NumPy arrays of angles, does not print anything,
+and returns an ExcavatorPose gathering one array per property.
+
 Typical usage example:
 
     from pose_calculation import _calc_excavator_pose
@@ -13,9 +17,79 @@ Typical usage example:
         angle_side_link
     ] = _calc_excavator_pose(0.5, 0.0, 0.2)
 
+    from pose_calculation import _calc_excavator_pose_batch
+    pose = _calc_excavator_pose_batch(
+        np.linspace(0.3, 0.6, 100), np.zeros(100), np.full(100, 0.2))
+    ext_cb_piston = pose.ext_cb_piston
+
 Copyright, 2023,  Vilella Kenny.
 """
 import numpy as np
+from dataclasses import dataclass, fields
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+
+
+# ==================================================================================== #
+#                                                                                      #
+#                 Starting implementation of the batched pose container                #
+#                                                                                      #
+# ==================================================================================== #
+@dataclass(frozen=True)
+class ExcavatorPose:
+    """Stores the properties of a batch of excavator poses.
+
+    Each attribute is a NumPy array with the broadcasted shape of the input angles.
+    The attributes follow the order of the list returned by _calc_excavator_pose, so
+    that the scalar and batched outputs can be compared element by element.
+    Distances are given in cm and angles in radian.
+
+    Attributes:
+        angle_cb_piston: Angle of the chassis/boom piston relative to the horizontal
+                         plane. [rad]
+        ext_cb_piston: Position of the piston rod in the chassis/boom piston
+                       cylinder. [cm]
+        x_I: Position of the arm/bucket piston cylinder attachment in the X direction
+             given in the arm frame. [cm]
+        z_I: Position of the arm/bucket piston cylinder attachment in the Z direction
+             given in the arm frame. [cm]
+        angle_ba_piston: Angle of the boom/arm piston relative to the CH segment. [rad]
+        ext_ba_piston: Position of the piston rod in the boom/arm piston cylinder. [cm]
+        angle_ah_piston: Angle of the arm/bucket piston relative to the HM
+                         segment. [rad]
+        ext_ah_piston: Position of the piston rod in the arm/bucket piston
+                       cylinder. [cm]
+        angle_h_link: Angle of the H link relative to the IJ segment. [rad]
+        x_M: Position of the bucket attachment in the X direction given in the arm
+             frame. [cm]
+        z_M: Position of the bucket attachment in the Z direction given in the arm
+             frame. [cm]
+        x_L: Position of the side link attachment in the X direction given in the
+             bucket frame. [cm]
+        z_L: Position of the side link attachment in the Z direction given in the
+             bucket frame. [cm]
+        angle_side_link: Angle of the side link relative to the LM segment. [rad]
+    """
+    angle_cb_piston: np.ndarray
+    ext_cb_piston: np.ndarray
+    x_I: np.ndarray
+    z_I: np.ndarray
+    angle_ba_piston: np.ndarray
+    ext_ba_piston: np.ndarray
+    angle_ah_piston: np.ndarray
+    ext_ah_piston: np.ndarray
+    angle_h_link: np.ndarray
+    x_M: np.ndarray
+    z_M: np.ndarray
+    x_L: np.ndarray
+    z_L: np.ndarray
+    angle_side_link: np.ndarray
+
+    def to_list(self) -> list:
+        """Returns the properties in the order used by _calc_excavator_pose.
+
+        The arrays are not copied.
+        """
+        return [getattr(self, field.name) for field in fields(self)]
 
 
 # ==================================================================================== #
@@ -24,7 +98,8 @@ import numpy as np
 #                                                                                      #
 # ==================================================================================== #
 def _calc_excavator_pose(
-        angle_boom: float, angle_arm: float, angle_bucket: float) -> list:
+        angle_boom: float, angle_arm: float, angle_bucket: float,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
     """Calculates the excavator pose.
 
     This function calculates all the properties required to set the excavator pose in
@@ -37,6 +112,8 @@ def _calc_excavator_pose(
         angle_boom: Angle of the boom relative to the horizontal plane. [rad]
         angle_arm: Angle of the arm relative to the horizontal plane. [rad]
         angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
 
     Returns:
         A list containing the angle of the chassis/boom piston relative to the
@@ -51,25 +128,22 @@ def _calc_excavator_pose(
         the bucket frame (X and Z direction), and the angle of the side link relative to
         the LM segment.
     """
-    # Calculating the pose of the boom
-    x_F, z_F, ext_cb_piston, angle_cb_piston = _calc_boom_pose(angle_boom)
+    # Calculating the pose of the excavator
+    pose = _calc_excavator_pose_batch(angle_boom, angle_arm, angle_bucket, geometry)
+    [
+        angle_cb_piston, ext_cb_piston, x_I, z_I, angle_ba_piston, ext_ba_piston,
+        angle_ah_piston, ext_ah_piston, angle_h_link, x_M, z_M, x_L, z_L,
+        angle_side_link
+    ] = [value[()] for value in pose.to_list()]
+
     print("\n================= Boom pose =================")
     print("Piston extension: %.2f" % (ext_cb_piston))
     print("angle_chassis_boom_piston: %.2f deg" % (np.rad2deg(angle_cb_piston)))
 
-    # Calculating the pose of the arm
-    x_I, z_I, x_K, z_K, x_M, z_M, ext_ba_piston, angle_ba_piston = _calc_arm_pose(
-        angle_arm, x_F, z_F)
-    angle_ba_piston = angle_boom - angle_ba_piston
     print("\n================= Arm pose =================")
     print("Piston extension: %.2f" % (ext_ba_piston))
     print("angle_boom_arm_piston: %.2f deg" % (np.rad2deg(angle_ba_piston)))
 
-    # Calculating the pose of the H link and bucket
-    ext_ah_piston, angle_h_link, angle_ah_piston, x_L, z_L, angle_side_link = (
-        _calc_H_link_pose(angle_bucket, x_I, z_I, x_K, z_K, x_M, z_M))
-    angle_ah_piston = angle_arm - angle_ah_piston
-    angle_side_link = angle_arm + angle_bucket + angle_side_link
     print("\n================= H link pose =================")
     print("Piston extension: %.2f" % (ext_ah_piston))
     print("angle_arm_h_link_piston: %.2f deg" % (np.rad2deg(angle_ah_piston)))
@@ -83,7 +157,58 @@ def _calc_excavator_pose(
     ]
 
 
-def _calc_boom_pose(angle_boom: float) -> list:
+def _calc_excavator_pose_batch(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> ExcavatorPose:
+    """Calculates the excavator pose for a batch of angles.
+
+    This function calculates the same properties as _calc_excavator_pose for arrays
+    of angles without printing anything. The input angles are broadcasted against
+    each other, so that equal-length arrays give one pose per triple, while arrays
+    with orthogonal axes (e.g. angle_boom[:, None, None], angle_arm[None, :, None]
+    and angle_bucket[None, None, :]) give the poses over the full grid.
+
+    The scalar function relies on this function, so that both paths give exactly the
+    same results.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        An ExcavatorPose gathering one array per property with the broadcasted shape
+        of the input angles.
+    """
+    angle_boom, angle_arm, angle_bucket = np.broadcast_arrays(
+        np.asarray(angle_boom, dtype=np.float64),
+        np.asarray(angle_arm, dtype=np.float64),
+        np.asarray(angle_bucket, dtype=np.float64))
+
+    # Calculating the pose of the boom
+    x_F, z_F, ext_cb_piston, angle_cb_piston = _calc_boom_pose(angle_boom, geometry)
+
+    # Calculating the pose of the arm
+    x_I, z_I, x_K, z_K, x_M, z_M, ext_ba_piston, angle_ba_piston = _calc_arm_pose(
+        angle_arm, x_F, z_F, geometry)
+    angle_ba_piston = angle_boom - angle_ba_piston
+
+    # Calculating the pose of the H link and bucket
+    ext_ah_piston, angle_h_link, angle_ah_piston, x_L, z_L, angle_side_link = (
+        _calc_H_link_pose(angle_bucket, x_I, z_I, x_K, z_K, x_M, z_M, geometry))
+    angle_ah_piston = angle_arm - angle_ah_piston
+    angle_side_link = angle_arm + angle_bucket + angle_side_link
+
+    return ExcavatorPose(
+        angle_cb_piston, ext_cb_piston, x_I, z_I, angle_ba_piston, ext_ba_piston,
+        angle_ah_piston, ext_ah_piston, angle_h_link, x_M, z_M, x_L, z_L,
+        angle_side_link)
+
+
+def _calc_boom_pose(
+        angle_boom: float, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
     """Calculates the boom pose.
 
     This function calculates all the properties required to set the boom in the
@@ -99,6 +224,8 @@ def _calc_boom_pose(angle_boom: float) -> list:
 
     Args:
         angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
 
     Returns:
         A list containing the position of the boom/arm piston cylinder attachment in the
@@ -106,15 +233,15 @@ def _calc_boom_pose(angle_boom: float) -> list:
         chassis/boom piston cylinder, and the angle of the chassis/boom piston relative
         to the horizontal plane.
     """
-    # Input parameters measured from meshes
-    CH = 384.5
-    CE = 167.8
-    CF = 236.2
-    piston_cylinder_length = 133.6
-    x_D = 47.4
-    z_D = -23.7
-    angle_HCE = 0.421
-    angle_HCF = 0.411
+    # Input parameters from the excavator geometry
+    CH = geometry.CH
+    CE = geometry.CE
+    CF = geometry.CF
+    piston_cylinder_length = geometry.cb_piston_cylinder_length
+    x_D = geometry.x_D
+    z_D = geometry.z_D
+    angle_HCE = geometry.angle_HCE
+    angle_HCF = geometry.angle_HCF
 
     # Calculating position of the chassis/boom piston rod attachment in the boom frame
     x_E = CE * np.cos(angle_boom + angle_HCE)
@@ -137,7 +264,9 @@ def _calc_boom_pose(angle_boom: float) -> list:
     return [x_F - x_H, z_F - z_H, ED - piston_cylinder_length, angle_cb_piston]
 
 
-def _calc_arm_pose(angle_arm: float, x_F: float, z_F: float) -> list:
+def _calc_arm_pose(
+        angle_arm: float, x_F: float, z_F: float,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
     """Calculates the arm pose.
 
     This function calculates all the properties required to set the arm in the
@@ -157,6 +286,8 @@ def _calc_arm_pose(angle_arm: float, x_F: float, z_F: float) -> list:
              given in the arm frame. [cm]
         z_F: Position of the boom/arm piston cylinder attachment in the Z direction
              given in the arm frame. [cm]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
 
     Returns:
         A list containing the position of the arm/bucket piston cylinder attachment in
@@ -166,24 +297,21 @@ def _calc_arm_pose(angle_arm: float, x_F: float, z_F: float) -> list:
         piston cylinder, and the angle of the boom/arm piston relative to the
         horizontal plane.
     """
-    # Input parameters measured from meshes
-    HG = 57.0
-    HM = 199.6
-    HI = 44.8
-    HK = 152.3
-    piston_cylinder_length = 114.7
-    angle_GHM = 2.881
-    angle_GHI = 1.876
-    angle_GHK = 2.838
+    # Input parameters from the excavator geometry
+    HG = geometry.HG
+    HM = geometry.HM
+    HI = geometry.HI
+    HK = geometry.HK
+    piston_cylinder_length = geometry.ba_piston_cylinder_length
 
     # Calculating angle of the segment HG relative to the vertical plane
-    alpha = angle_GHM + angle_arm - np.pi / 2
+    alpha = angle_arm + geometry.angle_GHM_G
 
     # Calculating angle of the segment HI relative to the horizontal plane
-    beta = angle_GHM + angle_arm - angle_GHI
+    beta = angle_arm + geometry.angle_GHM_I
 
     # Calculating angle of the segment HK relative to the horizontal plane
-    theta = angle_GHM + angle_arm - angle_GHK
+    theta = angle_arm + geometry.angle_GHM_K
 
     # Calculating position of the boom/arm piston rod attachment in the arm frame
     x_G = -HG * np.sin(alpha)
@@ -212,7 +340,7 @@ def _calc_arm_pose(angle_arm: float, x_F: float, z_F: float) -> list:
 
 def _calc_H_link_pose(
         angle_bucket: float, x_I: float, z_I: float, x_K: float, z_K: float, x_M: float,
-        z_M: float) -> list:
+        z_M: float, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
     """Calculates the H link and bucket pose.
 
     This function calculates all the properties required to set the H link in the
@@ -241,6 +369,8 @@ def _calc_H_link_pose(
              frame. [cm]
         z_M: Position of the bucket attachment in the Z direction given in the arm
              frame. [cm]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
 
     Returns:
         A list containing the position of the piston rod in the arm/bucket piston
@@ -249,11 +379,13 @@ def _calc_H_link_pose(
         attachment in the bucket frame (X and Z direction), and the angle of the side
         link relative to the LM segment.
     """
-    # Input parameters measured from meshes
-    JK = 45.4
-    JL = 44.9
-    LM = 37.9
-    piston_cylinder_length = 86.6
+    # Input parameters from the excavator geometry
+    JK = geometry.JK
+    JL = geometry.JL
+    LM = geometry.LM
+    JK_2 = geometry.JK_2
+    JL_2 = geometry.JL_2
+    piston_cylinder_length = geometry.ah_piston_cylinder_length
 
     # Calculating position of the side link attachment in the bucket frame
     x_L = LM * np.cos(angle_bucket)
@@ -264,11 +396,11 @@ def _calc_H_link_pose(
 
     # Calculating the angle at the H link attachment formed by
     # the side link/H link triangle
-    angle_JKL = np.arccos((JK * JK + KL * KL - JL * JL) / (2 * JK * KL))
+    angle_JKL = np.arccos((JK_2 + KL * KL - JL_2) / (2 * JK * KL))
 
     # Calculating the angle at the arm/bucket piston rod attachment formed by
     # the side link/H link triangle
-    angle_LJK = np.arccos((JK * JK + JL * JL - KL * KL) / (2 * JK * JL))
+    angle_LJK = np.arccos((JK_2 + JL_2 - KL * KL) / (2 * JK * JL))
 
     # Calculating angle of the segment KL relative to the horizontal plane
     alpha = np.arcsin((z_L + z_M - z_K) / KL)
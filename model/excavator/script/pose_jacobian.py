@@ -0,0 +1,367 @@
+"""Calculates the derivatives of the excavator pose.
+
+The purpose of the functions in this file is to calculate the derivatives of all the
+properties given by the pose calculation with respect to the boom, arm and bucket
+angle. The derivatives are obtained in closed form by differentiating each step of the
+pose calculation. The pose of each part is evaluated once, and passed to the functions
+calculating the derivatives of this part and of the following parts.
+
+The main application is the conversion of angular rates into piston velocities, which
+are the quantities controlled by the Boom, Arm and Bucket velocity actuators.
+
+Some information about this file:
+- The derivatives are propagated in forward mode. Each function takes the tangents of
+  its inputs, that is their derivatives with respect to the boom, arm and bucket
+  angle, stored along a last axis of size 3.
+- All distances are given in cm and all angles in radian, following the convention of
+  the pose calculation.
+
+Typical usage example:
+
+    from pose_jacobian import _calc_actuator_ctrl, _calc_excavator_pose_jacobian
+    jacobian = _calc_excavator_pose_jacobian(0.5, 0.0, 0.2)
+    d_ext_cb_piston = jacobian.ext_cb_piston
+    ctrl = _calc_actuator_ctrl(0.5, 0.0, 0.2, 0.1, -0.1, 0.2)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import numpy as np
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+from pose_calculation import (
+    ExcavatorPose, _calc_arm_pose, _calc_boom_pose, _calc_H_link_pose)
+
+
+# ==================================================================================== #
+#                                                                                      #
+#   Starting implementation of functions used to calculate the pose derivatives        #
+#                                                                                      #
+# ==================================================================================== #
+def _calc_excavator_pose_jacobian(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> ExcavatorPose:
+    """Calculates the derivatives of the excavator pose.
+
+    This function calculates the derivatives of all the properties given by
+    _calc_excavator_pose_batch with respect to the boom, arm and bucket angle.
+    The input angles are broadcasted against each other.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        An ExcavatorPose gathering the derivatives of each property. The last axis of
+        each array corresponds to the derivative with respect to the boom, arm and
+        bucket angle, respectively.
+    """
+    angle_boom, angle_arm, angle_bucket = np.broadcast_arrays(
+        np.asarray(angle_boom, dtype=np.float64),
+        np.asarray(angle_arm, dtype=np.float64),
+        np.asarray(angle_bucket, dtype=np.float64))
+    d_angle_boom, d_angle_arm, d_angle_bucket = np.eye(3)
+
+    # Calculating the derivatives of the boom pose
+    x_F, z_F, _, _ = _calc_boom_pose(angle_boom, geometry)
+    d_x_F, d_z_F, d_ext_cb_piston, d_angle_cb_piston = _calc_boom_pose_jacobian(
+        angle_boom, d_angle_boom, geometry)
+
+    # Calculating the derivatives of the arm pose
+    arm_pose = _calc_arm_pose(angle_arm, x_F, z_F, geometry)
+    x_I, z_I, x_K, z_K, x_M, z_M, _, _ = arm_pose
+    [
+        d_x_I, d_z_I, d_x_K, d_z_K, d_x_M, d_z_M, d_ext_ba_piston, d_angle_ba_piston
+    ] = _calc_arm_pose_jacobian(
+        angle_arm, x_F, z_F, arm_pose, d_angle_arm, d_x_F, d_z_F, geometry)
+    d_angle_ba_piston = d_angle_boom - d_angle_ba_piston
+
+    # Calculating the derivatives of the H link and bucket pose
+    h_link_pose = _calc_H_link_pose(
+        angle_bucket, x_I, z_I, x_K, z_K, x_M, z_M, geometry)
+    [
+        d_ext_ah_piston, d_angle_h_link, d_angle_ah_piston, d_x_L, d_z_L,
+        d_angle_side_link
+    ] = _calc_H_link_pose_jacobian(
+        x_I, z_I, x_K, z_K, x_M, z_M, h_link_pose, d_angle_bucket, d_x_I, d_z_I,
+        d_x_K, d_z_K, d_x_M, d_z_M, geometry)
+    d_angle_ah_piston = d_angle_arm - d_angle_ah_piston
+    d_angle_side_link = d_angle_arm + d_angle_bucket + d_angle_side_link
+
+    shape = angle_boom.shape + (3,)
+    return ExcavatorPose(*[np.broadcast_to(value, shape) for value in [
+        d_angle_cb_piston, d_ext_cb_piston, d_x_I, d_z_I, d_angle_ba_piston,
+        d_ext_ba_piston, d_angle_ah_piston, d_ext_ah_piston, d_angle_h_link, d_x_M,
+        d_z_M, d_x_L, d_z_L, d_angle_side_link]])
+
+
+def _calc_boom_pose_jacobian(
+        angle_boom: np.ndarray, d_angle_boom: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
+    """Calculates the derivatives of the boom pose.
+
+    This function calculates the derivatives of the outputs of _calc_boom_pose.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        d_angle_boom: Tangent of the boom angle.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A list containing the derivatives of the position of the boom/arm piston
+        cylinder attachment in the arm frame (X and Z direction), of the position of
+        the piston rod in the chassis/boom piston cylinder, and of the angle of the
+        chassis/boom piston relative to the horizontal plane.
+    """
+    # Input parameters from the excavator geometry
+    CH = geometry.CH
+    CE = geometry.CE
+    CF = geometry.CF
+    x_D = geometry.x_D
+    z_D = geometry.z_D
+    angle_HCE = geometry.angle_HCE
+    angle_HCF = geometry.angle_HCF
+
+    angle_boom = np.asarray(angle_boom, dtype=np.float64)[..., None]
+
+    # Calculating position of E, H and F in the boom frame
+    x_E = CE * np.cos(angle_boom + angle_HCE)
+    z_E = CE * np.sin(angle_boom + angle_HCE)
+    x_H = CH * np.cos(angle_boom)
+    z_H = CH * np.sin(angle_boom)
+    x_F = CF * np.cos(angle_boom + angle_HCF)
+    z_F = CF * np.sin(angle_boom + angle_HCF)
+
+    # The three points rotate rigidly with the boom
+    d_x_E = -z_E * d_angle_boom
+    d_z_E = x_E * d_angle_boom
+    d_x_FH = -(z_F - z_H) * d_angle_boom
+    d_z_FH = (x_F - x_H) * d_angle_boom
+
+    # Calculating derivative of the total length of the chassis/boom piston
+    ED = np.sqrt((x_E - x_D)**2 + (z_E - z_D)**2)
+    d_ED = ((x_E - x_D) * d_x_E + (z_E - z_D) * d_z_E) / ED
+
+    # Calculating derivative of the angle of the chassis/boom piston
+    angle_cb_piston = -np.arccos((x_E - x_D) / ED)
+    d_cos = (d_x_E * ED - (x_E - x_D) * d_ED) / (ED * ED)
+    d_angle_cb_piston = d_cos / np.sin(-angle_cb_piston)
+
+    return [d_x_FH, d_z_FH, d_ED, d_angle_cb_piston]
+
+
+def _calc_arm_pose_jacobian(
+        angle_arm: np.ndarray, x_F: np.ndarray, z_F: np.ndarray, arm_pose: list,
+        d_angle_arm: np.ndarray, d_x_F: np.ndarray, d_z_F: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
+    """Calculates the derivatives of the arm pose.
+
+    This function calculates the derivatives of the outputs of _calc_arm_pose.
+
+    Args:
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        x_F: Position of the boom/arm piston cylinder attachment in the X direction
+             given in the arm frame. [cm]
+        z_F: Position of the boom/arm piston cylinder attachment in the Z direction
+             given in the arm frame. [cm]
+        arm_pose: Outputs of _calc_arm_pose for the same inputs.
+        d_angle_arm: Tangent of the arm angle.
+        d_x_F: Tangent of x_F.
+        d_z_F: Tangent of z_F.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A list containing the derivatives of the position of the arm/bucket piston
+        cylinder attachment, of the position of the H link attachment, of the position
+        of the bucket attachment in the arm frame (X and Z direction), of the position
+        of the piston rod in the boom/arm piston cylinder, and of the angle of the
+        boom/arm piston relative to the horizontal plane.
+    """
+    x_I, z_I, x_K, z_K, x_M, z_M, _, angle_ba_piston = [
+        np.asarray(value)[..., None] for value in arm_pose]
+    x_F = np.asarray(x_F)[..., None]
+    z_F = np.asarray(z_F)[..., None]
+
+    # Input parameters from the excavator geometry
+    HG = geometry.HG
+
+    # Calculating position of the boom/arm piston rod attachment in the arm frame
+    alpha = np.asarray(angle_arm)[..., None] + geometry.angle_GHM_G
+    x_G = -HG * np.sin(alpha)
+    z_G = HG * np.cos(alpha)
+
+    # The points G, I, K and M rotate rigidly with the arm
+    d_x_G = -z_G * d_angle_arm
+    d_z_G = x_G * d_angle_arm
+    d_x_I = -z_I * d_angle_arm
+    d_z_I = x_I * d_angle_arm
+    d_x_K = -z_K * d_angle_arm
+    d_z_K = x_K * d_angle_arm
+    d_x_M = -z_M * d_angle_arm
+    d_z_M = x_M * d_angle_arm
+
+    # Calculating derivative of the total length of the boom/arm piston
+    FG = np.sqrt((x_G - x_F)**2 + (z_G - z_F)**2)
+    d_FG = ((x_G - x_F) * (d_x_G - d_x_F) + (z_G - z_F) * (d_z_G - d_z_F)) / FG
+
+    # Calculating derivative of the angle of the boom/arm piston
+    d_sin = ((d_z_G - d_z_F) * FG - (z_G - z_F) * d_FG) / (FG * FG)
+    d_angle_ba_piston = d_sin / np.cos(angle_ba_piston)
+
+    return [d_x_I, d_z_I, d_x_K, d_z_K, d_x_M, d_z_M, d_FG, d_angle_ba_piston]
+
+
+def _calc_H_link_pose_jacobian(
+        x_I: np.ndarray, z_I: np.ndarray, x_K: np.ndarray, z_K: np.ndarray,
+        x_M: np.ndarray, z_M: np.ndarray, h_link_pose: list,
+        d_angle_bucket: np.ndarray, d_x_I: np.ndarray, d_z_I: np.ndarray,
+        d_x_K: np.ndarray, d_z_K: np.ndarray, d_x_M: np.ndarray,
+        d_z_M: np.ndarray, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> list:
+    """Calculates the derivatives of the H link and bucket pose.
+
+    This function calculates the derivatives of the outputs of _calc_H_link_pose.
+
+    Args:
+        x_I: Position of the arm/bucket piston cylinder attachment in the X direction
+             given in the arm frame. [cm]
+        z_I: Position of the arm/bucket piston cylinder attachment in the Z direction
+             given in the arm frame. [cm]
+        x_K: Position of the H link attachment in the X direction given in the arm
+             frame. [cm]
+        z_K: Position of the H link attachment in the Z direction given in the arm
+             frame. [cm]
+        x_M: Position of the bucket attachment in the X direction given in the arm
+             frame. [cm]
+        z_M: Position of the bucket attachment in the Z direction given in the arm
+             frame. [cm]
+        h_link_pose: Outputs of _calc_H_link_pose for the same inputs.
+        d_angle_bucket: Tangent of the bucket angle.
+        d_x_I: Tangent of x_I.
+        d_z_I: Tangent of z_I.
+        d_x_K: Tangent of x_K.
+        d_z_K: Tangent of z_K.
+        d_x_M: Tangent of x_M.
+        d_z_M: Tangent of z_M.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A list containing the derivatives of the position of the piston rod in the
+        arm/bucket piston cylinder, of the angle of the H link relative to the IJ
+        segment, of the angle of the arm/bucket piston relative to the HM segment, of
+        the position of the side link attachment in the bucket frame (X and Z
+        direction), and of the angle of the side link relative to the LM segment.
+    """
+    # Input parameters from the excavator geometry
+    JK = geometry.JK
+    JL = geometry.JL
+    JK_2 = geometry.JK_2
+    JL_2 = geometry.JL_2
+
+    [
+        _, angle_h_link, angle_ah_piston, x_L, z_L, angle_side_link
+    ] = [
+        np.asarray(value)[..., None] for value in h_link_pose]
+    angle_side_link = -angle_side_link
+    x_I, z_I, x_K, z_K, x_M, z_M = [
+        np.asarray(value)[..., None] for value in [x_I, z_I, x_K, z_K, x_M, z_M]]
+
+    # The side link attachment rotates rigidly with the bucket
+    d_x_L = -z_L * d_angle_bucket
+    d_z_L = x_L * d_angle_bucket
+
+    # Calculating derivative of the KL distance
+    x_KL = x_L + x_M - x_K
+    z_KL = z_L + z_M - z_K
+    d_x_KL = d_x_L + d_x_M - d_x_K
+    d_z_KL = d_z_L + d_z_M - d_z_K
+    KL = np.sqrt(x_KL**2 + z_KL**2)
+    d_KL = (x_KL * d_x_KL + z_KL * d_z_KL) / KL
+
+    # Calculating derivative of the angles of the side link/H link triangle
+    angle_JKL = np.arccos((JK_2 + KL * KL - JL_2) / (2 * JK * KL))
+    angle_LJK = np.arccos((JK_2 + JL_2 - KL * KL) / (2 * JK * JL))
+    d_angle_JKL = -(
+        (KL * KL - JK_2 + JL_2) / (2 * JK * KL * KL) * d_KL / np.sin(angle_JKL))
+    d_angle_LJK = KL / (JK * JL) * d_KL / np.sin(angle_LJK)
+
+    # Calculating derivative of the angle of the segment KL
+    alpha = np.arcsin(z_KL / KL)
+    d_alpha = (d_z_KL * KL - z_KL * d_KL) / (KL * KL) / np.cos(alpha)
+
+    # Calculating derivative of the position of the arm/bucket piston rod attachment
+    x_J = x_K + JK * np.cos(angle_JKL + alpha)
+    z_J = z_K + JK * np.sin(angle_JKL + alpha)
+    d_x_J = d_x_K - (z_J - z_K) * (d_angle_JKL + d_alpha)
+    d_z_J = d_z_K + (x_J - x_K) * (d_angle_JKL + d_alpha)
+
+    # Calculating derivative of the total length of the arm/bucket piston
+    IJ = np.sqrt((x_I - x_J)**2 + (z_I - z_J)**2)
+    d_IJ = ((x_I - x_J) * (d_x_I - d_x_J) + (z_I - z_J) * (d_z_I - d_z_J)) / IJ
+
+    # Calculating derivative of the angle of the arm/H link relative to HM
+    d_sin = ((d_z_J - d_z_I) * IJ - (z_J - z_I) * d_IJ) / (IJ * IJ)
+    d_angle_ah_piston = d_sin / np.cos(angle_ah_piston)
+
+    # Calculating derivative of the angle of the side link
+    d_angle_side_link = -(d_x_J - d_x_M - d_x_L) / JL / np.sin(angle_side_link)
+
+    # Calculating derivative of the angle of the H link relative to IJ
+    d_angle_h_link = d_angle_LJK - d_angle_side_link + d_angle_ah_piston
+
+    return [
+        d_IJ, d_angle_h_link, d_angle_ah_piston, d_x_L, d_z_L, -d_angle_side_link]
+
+
+# ==================================================================================== #
+#                                                                                      #
+#        Starting implementation of functions used to calculate the actuation          #
+#                                                                                      #
+# ==================================================================================== #
+def _calc_actuator_ctrl(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        rate_boom: np.ndarray, rate_arm: np.ndarray, rate_bucket: np.ndarray,
+        rate_rotation: np.ndarray = 0.0, ctrl_limit: float = 0.5,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the actuator controls corresponding to the requested angular rates.
+
+    The Boom, Arm and Bucket actuators of the excavator model are velocity actuators
+    acting on the piston rods, so that their control is the piston velocity. This
+    velocity is obtained from the angular rates using the derivatives of the piston
+    extensions. The Rotation actuator acts directly on the chassis hinge, so that its
+    control is the rotation rate itself.
+
+    The controls are clipped to the control range of the actuators.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        rate_boom: Requested rate of the boom angle. [rad/s]
+        rate_arm: Requested rate of the arm angle. [rad/s]
+        rate_bucket: Requested rate of the bucket angle. [rad/s]
+        rate_rotation: Requested rotation rate of the chassis following the MuJoCo
+                       convention. Default value to 0.0. [rad/s]
+        ctrl_limit: Absolute value of the control range of the actuators.
+                    Default value to 0.5.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        An array with a last axis of size 4 containing the controls of the Rotation,
+        Boom, Arm and Bucket actuators, in this order. [rad/s or m/s]
+    """
+    jacobian = _calc_excavator_pose_jacobian(
+        angle_boom, angle_arm, angle_bucket, geometry)
+    rate = np.stack(np.broadcast_arrays(rate_boom, rate_arm, rate_bucket), axis=-1)
+
+    # Piston velocities are converted from cm/s to m/s
+    ctrl = np.stack(np.broadcast_arrays(
+        rate_rotation,
+        np.sum(jacobian.ext_cb_piston * rate, axis=-1) / 100.0,
+        np.sum(jacobian.ext_ba_piston * rate, axis=-1) / 100.0,
+        np.sum(jacobian.ext_ah_piston * rate, axis=-1) / 100.0), axis=-1)
+    return np.clip(ctrl, -ctrl_limit, ctrl_limit)
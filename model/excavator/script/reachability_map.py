@@ -0,0 +1,392 @@
+"""Builds and queries a reachability map of an excavator.
+
+The purpose of the functions in this file is to precompute the validity of the
+excavator poses over a dense grid of boom, arm and bucket angles, so that checking
+whether a pose is valid becomes a table lookup.
+A pose is valid if the extension of the three hydraulic pistons is within the range
+allowed by the excavator model, and if the linkage can be assembled on the branch of
+the excavator model, that is the branch selected by the inverse kinematics. When a
+pose is invalid, a reason code indicates which piston limit is violated.
+
+The validity grid is stored as a NumPy array that can be memory-mapped, while the
+geometry of the grid (angle bounds and resolution) is stored in a JSON header written
+next to it.
+
+Typical usage example:
+
+    from reachability_map import ReachabilityMap
+    reachability_map = ReachabilityMap.build()
+    reachability_map.save("reachability_map.npy")
+    reachability_map = ReachabilityMap.load("reachability_map.npy")
+    valid, code = reachability_map.query(angle_boom, angle_arm, angle_bucket)
+    angle_boom, angle_arm, angle_bucket = reachability_map.sample(1000)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import json
+import numpy as np
+import os
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+from inverse_kinematics import _calc_excavator_angles, _wrap_angle
+from pose_calculation import ExcavatorPose, _calc_excavator_pose_batch
+
+
+# Reason codes, combined as bit flags
+VALID = 0
+CB_PISTON_TOO_SHORT = 1
+CB_PISTON_TOO_LARGE = 2
+BA_PISTON_TOO_SHORT = 4
+BA_PISTON_TOO_LARGE = 8
+AH_PISTON_TOO_SHORT = 16
+AH_PISTON_TOO_LARGE = 32
+LINKAGE_NOT_CLOSED = 64
+OUT_OF_GRID = 128
+
+# Description of the reason codes used in error messages
+REASON_MESSAGES = {
+    CB_PISTON_TOO_LARGE: "Chassis/boom piston extension is too large.",
+    CB_PISTON_TOO_SHORT: "Chassis/boom piston extension is too short.",
+    BA_PISTON_TOO_LARGE: "Boom/arm piston extension is too large.",
+    BA_PISTON_TOO_SHORT: "Boom/arm piston extension is too short.",
+    AH_PISTON_TOO_LARGE: "Arm/bucket piston extension is too large.",
+    AH_PISTON_TOO_SHORT: "Arm/bucket piston extension is too short.",
+    LINKAGE_NOT_CLOSED: (
+        "The H link and side link cannot be assembled on the linkage branch of the "
+        "excavator model."),
+    OUT_OF_GRID: "The pose is outside of the reachability map.",
+}
+
+
+# ==================================================================================== #
+#                                                                                      #
+#        Starting implementation of functions used to check the pose validity          #
+#                                                                                      #
+# ==================================================================================== #
+def _calc_pose_validity(
+        ext_cb_piston: np.ndarray, ext_ba_piston: np.ndarray, ext_ah_piston: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY,
+        angle_h_link: np.ndarray = None,
+        angle_side_link: np.ndarray = None) -> np.ndarray:
+    """Calculates the reason code associated with piston extensions.
+
+    This function compares the extension of the three hydraulic pistons with their
+    allowed range and combines the violated limits into a reason code.
+    A NaN extension or link angle indicates that the H link and side link cannot be
+    assembled for the requested bucket angle. Note that the piston extensions may be
+    within their range while the link angles are NaN, so that the link angles should
+    be provided whenever they are available.
+
+    Args:
+        ext_cb_piston: Position of the piston rod in the chassis/boom piston
+                       cylinder. [m]
+        ext_ba_piston: Position of the piston rod in the boom/arm piston cylinder. [m]
+        ext_ah_piston: Position of the piston rod in the arm/bucket piston
+                       cylinder. [m]
+        geometry: Geometry of the excavator providing the piston ranges. Default value
+                  to the geometry of the excavator model.
+        angle_h_link: Angle of the H link relative to the IJ segment. It is not
+                      checked when None.
+        angle_side_link: Angle of the side link relative to the LM segment. It is not
+                         checked when None.
+
+    Returns:
+        An array of uint8 reason codes, equal to VALID when the pose is valid.
+    """
+    not_closed = (
+        np.isnan(ext_cb_piston) | np.isnan(ext_ba_piston) | np.isnan(ext_ah_piston))
+    if angle_h_link is not None:
+        not_closed = not_closed | np.isnan(angle_h_link)
+    if angle_side_link is not None:
+        not_closed = not_closed | np.isnan(angle_side_link)
+    limits = [
+        (ext_cb_piston < geometry.cb_piston_range[0], CB_PISTON_TOO_SHORT),
+        (ext_cb_piston > geometry.cb_piston_range[1], CB_PISTON_TOO_LARGE),
+        (ext_ba_piston < geometry.ba_piston_range[0], BA_PISTON_TOO_SHORT),
+        (ext_ba_piston > geometry.ba_piston_range[1], BA_PISTON_TOO_LARGE),
+        (ext_ah_piston < geometry.ah_piston_range[0], AH_PISTON_TOO_SHORT),
+        (ext_ah_piston > geometry.ah_piston_range[1], AH_PISTON_TOO_LARGE),
+        (not_closed, LINKAGE_NOT_CLOSED),
+    ]
+
+    code = np.zeros(not_closed.shape, dtype=np.uint8)
+    for violated, reason in limits:
+        code |= np.where(violated, np.uint8(reason), np.uint8(0))
+    return code
+
+
+def _calc_pose_on_branch(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        pose: ExcavatorPose,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Checks whether poses are on the linkage branch of the excavator model.
+
+    A pose is on the linkage branch when the inverse kinematics of its piston
+    extensions gives back its angles. Otherwise, the pose can only be assembled on
+    another branch, for instance past the H link toggle point, and cannot be reached
+    by moving the pistons from the default pose. This also excludes the poses for
+    which the pose calculation and the inverse kinematics disagree, as described in
+    inverse_kinematics.py.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        pose: Pose calculated from the angles by _calc_excavator_pose_batch.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A boolean array indicating the poses on the linkage branch.
+    """
+    with np.errstate(invalid="ignore"):
+        branch_angles = _calc_excavator_angles(
+            pose.ext_cb_piston, pose.ext_ba_piston, pose.ext_ah_piston, geometry)
+        on_branch = np.ones(branch_angles[0].shape, dtype=bool)
+        for branch_angle, angle in zip(
+                branch_angles, [angle_boom, angle_arm, angle_bucket]):
+            on_branch &= np.abs(_wrap_angle(branch_angle - angle)) < 1e-6
+    return on_branch
+
+
+def _calc_pose_validity_from_pose(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        pose: ExcavatorPose,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the reason code associated with poses calculated beforehand.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [rad]
+        angle_arm: Angle of the arm relative to the horizontal plane. [rad]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [rad]
+        pose: Pose calculated from the angles by _calc_excavator_pose_batch.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        An array of uint8 reason codes, equal to VALID when the pose is valid.
+    """
+    # Distances are converted from cm to m
+    code = _calc_pose_validity(
+        pose.ext_cb_piston / 100.0, pose.ext_ba_piston / 100.0,
+        pose.ext_ah_piston / 100.0, geometry, pose.angle_h_link, pose.angle_side_link)
+    on_branch = _calc_pose_on_branch(
+        angle_boom, angle_arm, angle_bucket, pose, geometry)
+    return code | np.where(on_branch, np.uint8(0), np.uint8(LINKAGE_NOT_CLOSED))
+
+
+def _calc_pose_validity_from_angles(
+        angle_boom: np.ndarray, angle_arm: np.ndarray, angle_bucket: np.ndarray,
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> np.ndarray:
+    """Calculates the reason code associated with excavator angles.
+
+    Args:
+        angle_boom: Angle of the boom relative to the horizontal plane. [deg]
+        angle_arm: Angle of the arm relative to the horizontal plane. [deg]
+        angle_bucket: Angle of the bucket relative to the horizontal plane. [deg]
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        An array of uint8 reason codes, equal to VALID when the pose is valid.
+    """
+    angle_boom = np.deg2rad(angle_boom)
+    angle_arm = np.deg2rad(angle_arm)
+    angle_bucket = np.deg2rad(angle_bucket)
+    with np.errstate(invalid="ignore"):
+        pose = _calc_excavator_pose_batch(angle_boom, angle_arm, angle_bucket, geometry)
+
+    return _calc_pose_validity_from_pose(
+        angle_boom, angle_arm, angle_bucket, pose, geometry)
+
+
+# ==================================================================================== #
+#                                                                                      #
+#              Starting implementation of the reachability map container               #
+#                                                                                      #
+# ==================================================================================== #
+class ReachabilityMap:
+    """Stores the validity of the excavator poses over a grid of angles.
+
+    The grid is regular in (angle_boom, angle_arm, angle_bucket) and each cell stores
+    the reason code of the pose located at its center. Queries are answered with the
+    nearest grid node, so that the accuracy of the map is half the resolution.
+
+    Attributes:
+        angle_min: Lower bound of the grid for the boom, arm and bucket angle. [deg]
+        resolution: Grid spacing for the boom, arm and bucket angle. [deg]
+        codes: Array of uint8 reason codes with one axis per angle. It may be a
+               memory-mapped array.
+        geometry: Geometry of the excavator used to build the map.
+    """
+
+    def __init__(
+            self, angle_min: tuple, resolution: tuple, codes: np.ndarray,
+            geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> None:
+        self.angle_min = np.asarray(angle_min, dtype=np.float64)
+        self.resolution = np.asarray(resolution, dtype=np.float64)
+        self.codes = codes
+        self.geometry = geometry
+        self._valid_index = None
+
+    @property
+    def angle_max(self) -> np.ndarray:
+        """Upper bound of the grid for the boom, arm and bucket angle. [deg]"""
+        return self.angle_min + self.resolution * (np.asarray(self.codes.shape) - 1)
+
+    @classmethod
+    def build(
+            cls, angle_boom_range: tuple = (-10.0, 60.0),
+            angle_arm_range: tuple = (-150.0, 90.0),
+            angle_bucket_range: tuple = (-180.0, 180.0),
+            resolution: float = 1.0,
+            geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> "ReachabilityMap":
+        """Builds the reachability map.
+
+        The poses are evaluated one boom angle at a time in order to limit the memory
+        used by the intermediate arrays.
+
+        Args:
+            angle_boom_range: Lower and upper bound of the boom angle. [deg]
+                              Default value to (-10.0, 60.0).
+            angle_arm_range: Lower and upper bound of the arm angle. [deg]
+                             Default value to (-150.0, 90.0).
+            angle_bucket_range: Lower and upper bound of the bucket angle. [deg]
+                                Default value to (-180.0, 180.0).
+            resolution: Grid spacing used for all angles. [deg]
+                        Default value to 1.0.
+            geometry: Geometry of the excavator. Default value to the geometry of the
+                      excavator model.
+
+        Returns:
+            The reachability map.
+        """
+        angle_min = []
+        axes = []
+        for angle_range in [angle_boom_range, angle_arm_range, angle_bucket_range]:
+            n_node = int(round((angle_range[1] - angle_range[0]) / resolution)) + 1
+            angle_min.append(angle_range[0])
+            axes.append(angle_range[0] + resolution * np.arange(n_node))
+
+        codes = np.empty([len(axis) for axis in axes], dtype=np.uint8)
+        for ii, angle_boom in enumerate(axes[0]):
+            codes[ii] = _calc_pose_validity_from_angles(
+                angle_boom, axes[1][:, None], axes[2][None, :], geometry)
+
+        return cls(angle_min, [resolution] * 3, codes, geometry)
+
+    def save(self, filename: str) -> None:
+        """Writes the reachability map to disk.
+
+        The reason codes are written in the NumPy format, so that they can be
+        memory-mapped, and the grid geometry as well as the excavator geometry are
+        written in a JSON header located at filename + ".json".
+
+        Args:
+            filename: Path to the ".npy" file.
+        """
+        codes = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=np.uint8, shape=self.codes.shape)
+        codes[...] = self.codes
+        codes.flush()
+        del codes
+
+        header = {
+            "angle_min": self.angle_min.tolist(),
+            "resolution": self.resolution.tolist(),
+            "shape": list(self.codes.shape),
+            "geometry": self.geometry.asdict(),
+        }
+        with open(filename + ".json", "w") as header_file:
+            json.dump(header, header_file, indent=4)
+
+    @classmethod
+    def load(cls, filename: str, mmap_mode: str = "r") -> "ReachabilityMap":
+        """Reads a reachability map from disk.
+
+        Args:
+            filename: Path to the ".npy" file.
+            mmap_mode: Memory-map mode passed to numpy.load. A value of None reads the
+                       full map in memory. Default value to "r".
+
+        Returns:
+            The reachability map.
+        """
+        with open(filename + ".json", "r") as header_file:
+            header = json.load(header_file)
+        codes = np.load(filename, mmap_mode=mmap_mode)
+        if list(codes.shape) != header["shape"]:
+            raise Exception(
+                "Reachability map invalid.\n Grid shape does not match its header.")
+        geometry = ExcavatorGeometry(**header["geometry"])
+        return cls(header["angle_min"], header["resolution"], codes, geometry)
+
+    def query(
+            self, angle_boom: np.ndarray, angle_arm: np.ndarray,
+            angle_bucket: np.ndarray) -> tuple:
+        """Checks the validity of a batch of poses.
+
+        The input angles are broadcasted against each other and each pose is
+        associated with the nearest grid node. Poses outside of the grid are given the
+        OUT_OF_GRID reason code.
+
+        Args:
+            angle_boom: Angle of the boom relative to the horizontal plane. [deg]
+            angle_arm: Angle of the arm relative to the horizontal plane. [deg]
+            angle_bucket: Angle of the bucket relative to the horizontal plane. [deg]
+
+        Returns:
+            A tuple containing a boolean mask indicating the valid poses, and the
+            uint8 reason code of each pose.
+        """
+        angles = np.broadcast_arrays(
+            np.asarray(angle_boom, dtype=np.float64),
+            np.asarray(angle_arm, dtype=np.float64),
+            np.asarray(angle_bucket, dtype=np.float64))
+
+        # Calculating the index of the nearest grid node
+        inside = np.ones(angles[0].shape, dtype=bool)
+        index = []
+        for ii, angle in enumerate(angles):
+            with np.errstate(invalid="ignore"):
+                node = np.rint((angle - self.angle_min[ii]) / self.resolution[ii])
+            inside &= (node >= 0) & (node < self.codes.shape[ii])
+            index.append(node)
+
+        code = np.full(inside.shape, OUT_OF_GRID, dtype=np.uint8)
+        code[inside] = self.codes[tuple(node[inside].astype(np.intp) for node in index)]
+        return code == VALID, code
+
+    def sample(self, n_sample: int, rng=None) -> tuple:
+        """Draws poses uniformly from the valid region of the map.
+
+        A valid cell is first selected uniformly, then the pose is drawn uniformly
+        inside that cell. The list of valid cells is calculated at the first call.
+
+        Args:
+            n_sample: Number of poses to draw.
+            rng: Seed or numpy.random.Generator used to draw the poses.
+
+        Returns:
+            A tuple containing the arrays of boom, arm and bucket angles. [deg]
+        """
+        rng = np.random.default_rng(rng)
+        if self._valid_index is None:
+            self._valid_index = np.flatnonzero(np.asarray(self.codes) == VALID)
+        if self._valid_index.size == 0:
+            raise Exception("Reachability map invalid.\n No valid pose in the map.")
+
+        cells = self._valid_index[rng.integers(self._valid_index.size, size=n_sample)]
+        index = np.unravel_index(cells, self.codes.shape)
+        angles = []
+        for ii in range(3):
+            angle = self.angle_min[ii] + self.resolution[ii] * (
+                index[ii] + rng.uniform(-0.5, 0.5, n_sample))
+            angles.append(np.clip(angle, self.angle_min[ii], self.angle_max[ii]))
+        return tuple(angles)
+
+
+if __name__ == "__main__":
+    # Building the reachability map and writing it next to the excavator model
+    filepath = os.path.abspath(os.path.dirname(__file__))
+    reachability_map = ReachabilityMap.build()
+    reachability_map.save(os.path.join(filepath, "..", "reachability_map.npy"))
@@ -0,0 +1,617 @@
+"""Serves an excavator simulation to other processes through a local socket.
+
+The purpose of this file is to drive the simulation from a separate process, such as
+a fleet controller, instead of the sliders of the simulator. The SimServer class
+steps a simulation in an asyncio event loop and listens on a Unix socket or a local
+TCP port. Each client can send commands for the four actuators and receives the
+state of the simulation, as well as the changes of the HFields if it subscribed to
+them.
+
+All messages are binary frames made of a header, containing the message type, the
+number of records and the size of the payload, followed by the payload. Several
+records are sent in a single frame when possible, so that a client reading slowly
+receives fewer and larger frames. The messages are:
+- MSG_CTRL (client): records of a command sequence number followed by the commands
+  of the Rotation, Boom, Arm and Bucket actuators. Only the last record is applied.
+- MSG_SUBSCRIBE (client): a single byte indicating whether the changes of the
+  HFields should be sent.
+- MSG_RESET (client): no payload, resets the simulation.
+- MSG_INFO (server): sent on connection, gives the size of the state records.
+- MSG_STATE (server): the sequence number of the last command applied and the number
+  of records dropped, followed by records containing the step, time, qpos, qvel and
+  ctrl of the simulation, as float64.
+- MSG_TERRAIN (server): records containing the index and the new value of the
+  HField cells changed since the previous MSG_TERRAIN, the first message containing
+  all cells.
+A client sending a message of unknown type, or whose payload size does not match its
+type and number of records, is disconnected.
+
+The simulation never waits for the clients. The states published for a client are
+stored in a bounded queue emptied by a task writing to that client, so that the
+oldest states are dropped when a client cannot keep up, and the changes of the
+HFields are calculated when the frame is written, so that they are merged for a
+slow client.
+
+Typical usage example:
+
+    python sim_server.py --plugin PLUGIN_DIR --address /tmp/excavator.sock
+
+    client = await SimClient.connect("/tmp/excavator.sock")
+    seq = await client.send_ctrl([0.0, 0.1, 0.0, 0.0])
+    msg_type, message = await client.receive()
+
+A load test measuring the command round-trip latency and the message rate can be run
+with:
+
+    python sim_server.py --plugin PLUGIN_DIR --load_test --n_client 4
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import argparse
+import asyncio
+import collections
+import multiprocessing
+import mujoco
+import numpy as np
+import os
+import struct
+import tempfile
+import time
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+from model_generation import generate_excavator_mjmodel
+
+
+# Message types sent by the clients
+MSG_CTRL = 1
+MSG_SUBSCRIBE = 2
+MSG_RESET = 3
+
+# Message types sent by the server
+MSG_INFO = 16
+MSG_STATE = 17
+MSG_TERRAIN = 18
+
+# Format of the frame header: message type, number of records and payload size
+_HEADER_FORMAT = "<BII"
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+# Format of a command record: sequence number and commands of the four actuators
+_CTRL_FORMAT = "<I4d"
+_CTRL_SIZE = struct.calcsize(_CTRL_FORMAT)
+
+# Payload size of the client messages, given their number of records
+_CLIENT_PAYLOAD_SIZES = {
+    MSG_CTRL: lambda n_record: n_record * _CTRL_SIZE,
+    MSG_SUBSCRIBE: lambda n_record: 1,
+    MSG_RESET: lambda n_record: 0,
+}
+
+# Format of the information message: nq, nv, nu, nhfielddata and time step
+_INFO_FORMAT = "<IIIId"
+
+# Format of the beginning of the state message: last command applied and records
+# dropped
+_STATE_FORMAT = "<II"
+_STATE_SIZE = struct.calcsize(_STATE_FORMAT)
+
+# Record of the terrain message: index and value of an HField cell
+_TERRAIN_DTYPE = np.dtype([("index", "<i4"), ("value", "<f4")])
+
+
+# ==================================================================================== #
+#                                                                                      #
+#                  Starting implementation of the simulation server                    #
+#                                                                                      #
+# ==================================================================================== #
+class _Client:
+    """Stores the state of a client connected to the server.
+
+    Attributes:
+        writer: Stream used to write to the client.
+        records: Queue of the state records to send.
+        event: Event set when records are available.
+        ctrl_seq: Sequence number of the last command received.
+        ack: Sequence number of the last command applied in a published step.
+        n_dropped: Number of records dropped since the last frame sent.
+        hfield_sent: HField data known by the client, or None when the client did not
+                     subscribe to the HField changes.
+    """
+
+    def __init__(self, writer, max_queue: int) -> None:
+        self.writer = writer
+        self.records = collections.deque(maxlen=max_queue)
+        self.event = asyncio.Event()
+        self.ctrl_seq = 0
+        self.ack = 0
+        self.n_dropped = 0
+        self.hfield_sent = None
+
+
+class SimServer:
+    """Steps an excavator simulation and serves it to local clients.
+
+    The simulation is stepped publish_interval steps at a time, after which its state
+    is published to all clients. The commands received in the meantime are applied
+    to the next steps. The event loop is blocked while stepping, so that the
+    publish_interval steps should not take longer than the acceptable latency.
+
+    Attributes:
+        mj_model: Compiled excavator model.
+        mj_data: MuJoCo data of the simulation.
+        publish_interval: Number of simulation steps between two published states.
+        max_queue: Maximum number of states waiting to be sent to a client.
+        realtime: Whether the simulation is slowed down to real time.
+        n_step: Number of simulation steps performed.
+        record_size: Number of float64 in a state record.
+    """
+
+    def __init__(
+            self, mj_model, publish_interval: int = 10, max_queue: int = 100,
+            realtime: bool = True) -> None:
+        """Initializes the server.
+
+        Args:
+            mj_model: Compiled excavator model.
+            publish_interval: Number of simulation steps between two published states.
+            max_queue: Maximum number of states waiting to be sent to a client.
+            realtime: Whether the simulation is slowed down to real time.
+        """
+        if mj_model.nu != 4:
+            raise Exception("The model should contain the four excavator actuators.")
+
+        self.mj_model = mj_model
+        self.mj_data = mujoco.MjData(mj_model)
+        self.publish_interval = publish_interval
+        self.max_queue = max_queue
+        self.realtime = realtime
+        self.n_step = 0
+        self.record_size = 2 + mj_model.nq + mj_model.nv + mj_model.nu
+
+        self._clients = set()
+        self._running = False
+        self._record = np.zeros(self.record_size)
+        self._info = struct.pack(_HEADER_FORMAT, MSG_INFO, 1, struct.calcsize(
+            _INFO_FORMAT)) + struct.pack(
+            _INFO_FORMAT, mj_model.nq, mj_model.nv, mj_model.nu, mj_model.nhfielddata,
+            mj_model.opt.timestep)
+        mujoco.mj_forward(mj_model, self.mj_data)
+
+    @classmethod
+    def from_excavator_model(
+            cls, excavator_model: dict, geometry: ExcavatorGeometry = DEFAULT_GEOMETRY,
+            **kwargs) -> "SimServer":
+        """Creates a server from an excavator model.
+
+        Note that the soil plugin library has to be loaded beforehand, for instance
+        with mujoco.mj_loadAllPluginLibraries.
+
+        Args:
+            excavator_model: Dictionary gathering all information about the excavator
+                             model. See _process_excavator_model for its content.
+            geometry: Geometry of the excavator. Default value to the geometry of the
+                      excavator model.
+            **kwargs: Other arguments of SimServer.
+
+        Returns:
+            The server.
+        """
+        return cls(generate_excavator_mjmodel(excavator_model, geometry), **kwargs)
+
+    async def serve(self, address) -> None:
+        """Listens on the address and runs the simulation until stop is called.
+
+        Args:
+            address: Path of the Unix socket, or (host, port) tuple of the TCP socket.
+        """
+        if isinstance(address, str):
+            server = await asyncio.start_unix_server(self._handle_client, address)
+        else:
+            server = await asyncio.start_server(self._handle_client, *address)
+
+        self._running = True
+        try:
+            await self._run_simulation()
+        finally:
+            server.close()
+            for client in list(self._clients):
+                client.writer.close()
+            await server.wait_closed()
+
+    def stop(self) -> None:
+        """Stops the simulation and the server."""
+        self._running = False
+
+    async def _run_simulation(self) -> None:
+        """Steps the simulation and publishes its state."""
+        loop = asyncio.get_running_loop()
+        period = self.publish_interval * self.mj_model.opt.timestep
+        next_time = loop.time()
+        while self._running:
+            mujoco.mj_step(self.mj_model, self.mj_data, self.publish_interval)
+            self.n_step += self.publish_interval
+            self._publish()
+
+            if self.realtime:
+                # Not catching up when the simulation is more than a period late
+                next_time = max(next_time + period, loop.time() - period)
+                await asyncio.sleep(max(next_time - loop.time(), 0.0))
+            else:
+                await asyncio.sleep(0.0)
+
+    def _publish(self) -> None:
+        """Queues the current state of the simulation for all clients."""
+        nq = self.mj_model.nq
+        nv = self.mj_model.nv
+        record = self._record
+        record[0] = self.n_step
+        record[1] = self.mj_data.time
+        record[2:2 + nq] = self.mj_data.qpos
+        record[2 + nq:2 + nq + nv] = self.mj_data.qvel
+        record[2 + nq + nv:] = self.mj_data.ctrl
+        record = record.tobytes()
+
+        for client in self._clients:
+            if len(client.records) == self.max_queue:
+                client.n_dropped += 1
+            client.records.append(record)
+            client.ack = client.ctrl_seq
+            client.event.set()
+
+    async def _handle_client(self, reader, writer) -> None:
+        """Reads the messages of a client until it disconnects.
+
+        The client is disconnected when it sends an invalid message, without reading
+        its payload.
+
+        Args:
+            reader: Stream used to read from the client.
+            writer: Stream used to write to the client.
+        """
+        client = _Client(writer, self.max_queue)
+        writer.write(self._info)
+        self._clients.add(client)
+        write_task = asyncio.create_task(self._write_client(client))
+        try:
+            while True:
+                msg_type, n_record, payload_size = struct.unpack(
+                    _HEADER_FORMAT, await reader.readexactly(_HEADER_SIZE))
+                if (msg_type not in _CLIENT_PAYLOAD_SIZES or
+                        payload_size != _CLIENT_PAYLOAD_SIZES[msg_type](n_record)):
+                    break
+                payload = await reader.readexactly(payload_size)
+
+                if msg_type == MSG_CTRL:
+                    if n_record == 0:
+                        continue
+                    # Only the last command is applied, the others being outdated
+                    seq, *ctrl = struct.unpack_from(
+                        _CTRL_FORMAT, payload, (n_record - 1) * _CTRL_SIZE)
+                    self.mj_data.ctrl[:] = ctrl
+                    client.ctrl_seq = seq
+                elif msg_type == MSG_SUBSCRIBE:
+                    if payload[0]:
+                        # NaN values are always different, so that all cells are sent
+                        client.hfield_sent = np.full(
+                            self.mj_model.nhfielddata, np.nan, dtype=np.float32)
+                    else:
+                        client.hfield_sent = None
+                elif msg_type == MSG_RESET:
+                    mujoco.mj_resetData(self.mj_model, self.mj_data)
+                    mujoco.mj_forward(self.mj_model, self.mj_data)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.discard(client)
+            write_task.cancel()
+            writer.close()
+
+    async def _write_client(self, client: _Client) -> None:
+        """Sends the queued states and the HField changes to a client.
+
+        Args:
+            client: Client to which the frames are sent.
+        """
+        try:
+            while True:
+                await client.event.wait()
+                client.event.clear()
+
+                n_record = len(client.records)
+                payload = b"".join(client.records)
+                client.records.clear()
+                header = struct.pack(
+                    _HEADER_FORMAT, MSG_STATE, n_record, _STATE_SIZE + len(payload))
+                frames = [
+                    header, struct.pack(_STATE_FORMAT, client.ack, client.n_dropped),
+                    payload]
+                client.n_dropped = 0
+
+                if client.hfield_sent is not None:
+                    changed = np.flatnonzero(
+                        client.hfield_sent != self.mj_model.hfield_data)
+                    if changed.size:
+                        delta = np.empty(changed.size, dtype=_TERRAIN_DTYPE)
+                        delta["index"] = changed
+                        delta["value"] = self.mj_model.hfield_data[changed]
+                        client.hfield_sent[changed] = delta["value"]
+                        header = struct.pack(
+                            _HEADER_FORMAT, MSG_TERRAIN, changed.size, delta.nbytes)
+                        frames += [header, delta.tobytes()]
+
+                client.writer.writelines(frames)
+                await client.writer.drain()
+        except ConnectionError:
+            pass
+
+
+# ==================================================================================== #
+#                                                                                      #
+#                  Starting implementation of the simulation client                    #
+#                                                                                      #
+# ==================================================================================== #
+class SimClient:
+    """Connects to a SimServer.
+
+    Attributes:
+        nq: Number of position coordinates of the model.
+        nv: Number of degrees of freedom of the model.
+        nu: Number of actuators of the model.
+        nhfielddata: Number of HField cells of the model.
+        timestep: Time step of the simulation. [s]
+        record_size: Number of float64 in a state record.
+    """
+
+    def __init__(self, reader, writer, info: tuple) -> None:
+        self._reader = reader
+        self._writer = writer
+        self.nq, self.nv, self.nu, self.nhfielddata, self.timestep = info
+        self.record_size = 2 + self.nq + self.nv + self.nu
+        self._seq = 0
+
+    @classmethod
+    async def connect(cls, address) -> "SimClient":
+        """Connects to a server and reads its information message.
+
+        Args:
+            address: Path of the Unix socket, or (host, port) tuple of the TCP socket.
+
+        Returns:
+            The connected client.
+        """
+        if isinstance(address, str):
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            reader, writer = await asyncio.open_connection(*address)
+        msg_type, _, payload_size = struct.unpack(
+            _HEADER_FORMAT, await reader.readexactly(_HEADER_SIZE))
+        if msg_type != MSG_INFO:
+            raise Exception("Unexpected message type " + str(msg_type))
+        info = struct.unpack(_INFO_FORMAT, await reader.readexactly(payload_size))
+        return cls(reader, writer, info)
+
+    async def send_ctrl(self, ctrl) -> int:
+        """Sends the commands of the Rotation, Boom, Arm and Bucket actuators.
+
+        Args:
+            ctrl: Commands of the four actuators, or of shape (n_record, 4) to send
+                  several commands in a single frame, only the last one being applied.
+
+        Returns:
+            The sequence number of the last command sent.
+        """
+        ctrl = np.atleast_2d(ctrl)
+        records = []
+        for record in ctrl:
+            self._seq += 1
+            records.append(struct.pack(_CTRL_FORMAT, self._seq, *record))
+        self._writer.write(struct.pack(
+            _HEADER_FORMAT, MSG_CTRL, len(records), len(records) * _CTRL_SIZE))
+        self._writer.writelines(records)
+        await self._writer.drain()
+        return self._seq
+
+    async def subscribe(self, hfield: bool = True) -> None:
+        """Subscribes to the HField changes, or unsubscribes.
+
+        Args:
+            hfield: Whether the HField changes should be sent.
+        """
+        self._writer.write(struct.pack(_HEADER_FORMAT, MSG_SUBSCRIBE, 1, 1))
+        self._writer.write(bytes([hfield]))
+        await self._writer.drain()
+
+    async def reset(self) -> None:
+        """Resets the simulation."""
+        self._writer.write(struct.pack(_HEADER_FORMAT, MSG_RESET, 0, 0))
+        await self._writer.drain()
+
+    async def receive(self) -> tuple:
+        """Receives the next frame sent by the server.
+
+        Returns:
+            A tuple containing the message type and a dictionary with its content.
+            The content of MSG_STATE is the ack, the number of dropped records
+            (n_dropped) and the records as an array of shape (n_record, record_size),
+            whose columns are step, time, qpos, qvel and ctrl. The content of
+            MSG_TERRAIN is the index and value of the changed HField cells.
+        """
+        msg_type, n_record, payload_size = struct.unpack(
+            _HEADER_FORMAT, await self._reader.readexactly(_HEADER_SIZE))
+        payload = await self._reader.readexactly(payload_size)
+
+        if msg_type == MSG_STATE:
+            ack, n_dropped = struct.unpack_from(_STATE_FORMAT, payload)
+            records = np.frombuffer(payload, np.float64, offset=_STATE_SIZE).reshape(
+                n_record, self.record_size)
+            return msg_type, {"ack": ack, "n_dropped": n_dropped, "records": records}
+        elif msg_type == MSG_TERRAIN:
+            delta = np.frombuffer(payload, _TERRAIN_DTYPE)
+            return msg_type, {"index": delta["index"], "value": delta["value"]}
+        raise Exception("Unexpected message type " + str(msg_type))
+
+    async def close(self) -> None:
+        """Closes the connection."""
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+# ==================================================================================== #
+#                                                                                      #
+#                Starting implementation of the load test of the server                #
+#                                                                                      #
+# ==================================================================================== #
+async def run_load_test(
+        address, n_client: int = 4, duration: float = 5.0,
+        hfield: bool = False) -> dict:
+    """Measures the command round-trip latency and the message rate of a server.
+
+    Each client sends a command and waits for the first state in which it has been
+    applied, before sending the next command. The round-trip latency therefore
+    includes the time until the next published state.
+
+    Args:
+        address: Address of the server.
+        n_client: Number of clients connected at the same time.
+        duration: Duration of the test. [s]
+        hfield: Whether the clients subscribe to the HField changes.
+
+    Returns:
+        A dictionary containing the percentiles of the round-trip latency, and the
+        number of commands, frames, state records and bytes received per second,
+        summed over all clients. [s]
+    """
+    async def run_client(client_id: int) -> dict:
+        client = await SimClient.connect(address)
+        if hfield:
+            await client.subscribe()
+        rng = np.random.default_rng(client_id)
+        counts = {"n_ctrl": 0, "n_frame": 0, "n_record": 0, "n_byte": 0}
+        latencies = []
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            seq = await client.send_ctrl(rng.uniform(-0.5, 0.5, 4))
+            counts["n_ctrl"] += 1
+            ack = -1
+            while ack < seq:
+                msg_type, message = await client.receive()
+                counts["n_frame"] += 1
+                if msg_type == MSG_STATE:
+                    ack = message["ack"]
+                    counts["n_record"] += message["records"].shape[0]
+                    counts["n_byte"] += message["records"].nbytes
+                else:
+                    counts["n_byte"] += message["index"].nbytes * 2
+            latencies.append(time.perf_counter() - start)
+        await client.close()
+        counts["latencies"] = latencies
+        return counts
+
+    results = await asyncio.gather(*[run_client(ii) for ii in range(n_client)])
+    latencies = np.concatenate([result["latencies"] for result in results])
+    report = {
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p95": float(np.percentile(latencies, 95)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+    }
+    for name in ["n_ctrl", "n_frame", "n_record", "n_byte"]:
+        report[name[2:] + "_per_s"] = sum(result[name] for result in results) / duration
+    return report
+
+
+def _serve_process(
+        excavator_model: dict, plugin: str, address, server_kwargs: dict) -> None:
+    """Runs a server in a separate process.
+
+    Args:
+        excavator_model: Dictionary gathering all information about the excavator
+                         model.
+        plugin: Folder containing the soil plugin library, or None.
+        address: Address of the server.
+        server_kwargs: Other arguments of SimServer.
+    """
+    if plugin is not None:
+        mujoco.mj_loadAllPluginLibraries(plugin)
+    server = SimServer.from_excavator_model(excavator_model, **server_kwargs)
+    asyncio.run(server.serve(address))
+
+
+async def _wait_for_server(address, timeout: float = 30.0) -> None:
+    """Waits until a server accepts connections.
+
+    Args:
+        address: Address of the server.
+        timeout: Maximum waiting time. [s]
+    """
+    end = time.perf_counter() + timeout
+    while True:
+        try:
+            client = await SimClient.connect(address)
+            await client.close()
+            return
+        except (ConnectionError, FileNotFoundError):
+            if time.perf_counter() > end:
+                raise Exception("The server did not start.") from None
+            await asyncio.sleep(0.1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serves an excavator simulation through a local socket.")
+    parser.add_argument(
+        "--address", default=None,
+        help="Path of the Unix socket, or port of the TCP socket on localhost. "
+             "Default value to a Unix socket in the temporary folder.")
+    parser.add_argument(
+        "--plugin", default=None, help="Folder containing the soil plugin library.")
+    parser.add_argument(
+        "--publish_interval", type=int, default=10,
+        help="Number of simulation steps between two published states.")
+    parser.add_argument(
+        "--max_queue", type=int, default=100,
+        help="Maximum number of states waiting to be sent to a client.")
+    parser.add_argument(
+        "--no_realtime", action="store_true",
+        help="Run the simulation as fast as possible.")
+    parser.add_argument(
+        "--load_test", action="store_true",
+        help="Run a load test against a server started in a separate process.")
+    parser.add_argument(
+        "--n_client", type=int, default=4, help="Number of clients of the load test.")
+    parser.add_argument(
+        "--duration", type=float, default=5.0, help="Duration of the load test.")
+    parser.add_argument(
+        "--hfield", action="store_true",
+        help="Subscribe the clients of the load test to the HField changes.")
+    args = parser.parse_args()
+
+    if args.address is None:
+        address = os.path.join(tempfile.gettempdir(), "excavator_sim.sock")
+    elif args.address.isdigit():
+        address = ("127.0.0.1", int(args.address))
+    else:
+        address = args.address
+    server_kwargs = {
+        "publish_interval": args.publish_interval, "max_queue": args.max_queue,
+        "realtime": not args.no_realtime}
+
+    if not args.load_test:
+        _serve_process({"soil": {}, "pose": {}}, args.plugin, address, server_kwargs)
+    else:
+        process = multiprocessing.Process(
+            target=_serve_process,
+            args=({"soil": {}, "pose": {}}, args.plugin, address, server_kwargs))
+        process.start()
+        try:
+            asyncio.run(_wait_for_server(address))
+            report = asyncio.run(
+                run_load_test(address, args.n_client, args.duration, args.hfield))
+        finally:
+            process.terminate()
+            process.join()
+        print("Round-trip latency: p50 %.2f ms, p95 %.2f ms, p99 %.2f ms" % (
+            1e3 * report["latency_p50"], 1e3 * report["latency_p95"],
+            1e3 * report["latency_p99"]))
+        print("Commands: %.0f/s, frames: %.0f/s, states: %.0f/s, %.2f MB/s" % (
+            report["ctrl_per_s"], report["frame_per_s"], report["record_per_s"],
+            1e-6 * report["byte_per_s"]))
@@ -0,0 +1,147 @@
+"""Sets and saves the soil state of an excavator simulation.
+
+The purpose of the functions in this file is to initialize the terrain from a given
+height map instead of the random terrain generated by the soil plugin, and to reset a
+simulation to a saved soil state without compiling the model again, for instance
+between digging episodes.
+
+The soil state is stored in the HFields of the model: the terrain HField and the two
+bucket soil HFields. When the data is reset, the soil plugin reads the terrain from
+the terrain HField and empties the bucket. A terrain can therefore be set by writing
+the terrain HField and resetting the data, which is done by load_terrain.
+
+The SoilSnapshot class saves the HFields together with the simulation state in a
+single preallocated buffer, so that a snapshot can be saved and restored repeatedly
+without any allocation.
+
+Typical usage example:
+
+    load_terrain(mj_model, "terrain.npy", mj_data)
+    snapshot = SoilSnapshot(mj_model).save(mj_data)
+    ...
+    snapshot.restore(mj_data)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import mujoco
+import numpy as np
+
+
+# State saved with the HFields, the plugin state being set by the soil plugin on reset
+SNAPSHOT_STATE = (
+    int(mujoco.mjtState.mjSTATE_INTEGRATION) & ~int(mujoco.mjtState.mjSTATE_PLUGIN))
+
+
+# ==================================================================================== #
+#                                                                                      #
+#            Starting implementation of functions used to set the soil state           #
+#                                                                                      #
+# ==================================================================================== #
+def load_terrain(mj_model, terrain, mj_data=None) -> None:
+    """Sets the terrain of an excavator model.
+
+    The terrain is given as a height map following the convention of the soil
+    simulator, that is terrain[ii, jj] is the height of the cell located at the
+    ii-th position in the X direction and the jj-th position in the Y direction. Its
+    shape must be the number of cells of the terrain HField in the X and Y direction.
+
+    A memory-mapped file is read only once while writing the HField.
+
+    Args:
+        mj_model: Compiled excavator model.
+        terrain: Height map of the terrain, or path of a .npy file containing it, which
+                 is then memory-mapped. [m]
+        mj_data: MuJoCo data reset after setting the terrain, so that the soil plugin
+                 reads the new terrain. Note that this resets the whole simulation.
+    """
+    if isinstance(terrain, str):
+        terrain = np.load(terrain, mmap_mode="r")
+
+    hfield = mj_model.hfield("terrain")
+    shape = (hfield.ncol[0], hfield.nrow[0])
+    if terrain.shape != shape:
+        raise Exception(
+            "Terrain shape " + str(terrain.shape) + " inconsistent with the terrain "
+            "HField shape " + str(shape))
+
+    # Writing the terrain HField, whose rows follow the Y direction
+    hfield_data = mj_model.hfield_data[
+        hfield.adr[0]:hfield.adr[0] + terrain.size].reshape(shape[1], shape[0])
+    np.divide(terrain.T, hfield.size[2], out=hfield_data)
+
+    if mj_data is not None:
+        mujoco.mj_resetData(mj_model, mj_data)
+        mujoco.mj_forward(mj_model, mj_data)
+
+
+def read_terrain(mj_model) -> tuple:
+    """Reads the terrain of an excavator model.
+
+    The terrain is returned following the convention of load_terrain. Note that the
+    returned height map is a copy, so that it is not modified by the soil plugin.
+
+    Args:
+        mj_model: Compiled excavator model.
+
+    Returns:
+        A tuple containing the height map of the terrain, and the half-length of the
+        terrain in the X and Y direction. [m]
+    """
+    hfield = mj_model.hfield("terrain")
+    hfield_data = mj_model.hfield_data[
+        hfield.adr[0]:hfield.adr[0] + hfield.nrow[0] * hfield.ncol[0]].reshape(
+        hfield.nrow[0], hfield.ncol[0])
+    terrain = hfield.size[2] * hfield_data.T
+    return terrain, (float(hfield.size[0]), float(hfield.size[1]))
+
+
+class SoilSnapshot:
+    """Stores the soil state and the simulation state of an excavator simulation.
+
+    The snapshot is a single contiguous buffer containing the data of all HFields
+    followed by the simulation state, including qpos, qvel, the controls, and the
+    position of the mocap bodies. Saving or restoring the snapshot copies each of these
+    blocks once, without any allocation.
+
+    When restoring, the data is reset between the copy of the HFields and the copy of
+    the simulation state, so that the soil plugin reads the restored terrain. As the
+    soil plugin empties the bucket on reset, the soil carried by the bucket is not
+    restored.
+
+    Attributes:
+        mj_model: Compiled excavator model.
+        buffer: Buffer containing the snapshot.
+        hfield_data: View of the buffer containing the data of all HFields.
+        state: View of the buffer containing the simulation state.
+    """
+
+    def __init__(self, mj_model) -> None:
+        self.mj_model = mj_model
+        state_size = mujoco.mj_stateSize(mj_model, SNAPSHOT_STATE)
+        self.buffer = np.zeros(mj_model.nhfielddata + state_size)
+        self.hfield_data = self.buffer[:mj_model.nhfielddata]
+        self.state = self.buffer[mj_model.nhfielddata:]
+
+    def save(self, mj_data) -> "SoilSnapshot":
+        """Saves the current soil state and simulation state.
+
+        Args:
+            mj_data: MuJoCo data of the simulation.
+
+        Returns:
+            The snapshot itself.
+        """
+        np.copyto(self.hfield_data, self.mj_model.hfield_data)
+        mujoco.mj_getState(self.mj_model, mj_data, self.state, SNAPSHOT_STATE)
+        return self
+
+    def restore(self, mj_data) -> None:
+        """Restores the saved soil state and simulation state.
+
+        Args:
+            mj_data: MuJoCo data of the simulation.
+        """
+        np.copyto(self.mj_model.hfield_data, self.hfield_data)
+        mujoco.mj_resetData(self.mj_model, mj_data)
+        mujoco.mj_setState(self.mj_model, mj_data, self.state, SNAPSHOT_STATE)
+        mujoco.mj_forward(self.mj_model, mj_data)
@@ -0,0 +1,154 @@
+"""Accounts for the soil volume moved during an excavator simulation.
+
+The purpose of this file is to measure the productivity of a digging run, that is the
+soil volume moved, while the simulation is running instead of comparing the terrain
+before and after the run. The SoilVolumeTracker class is called after every step and
+keeps running totals of:
+- the volume excavated, that is the soil removed from the terrain,
+- the volume dumped, that is the soil returned to the terrain,
+- the volume carried, that is the soil currently in the bucket.
+
+The volumes are calculated from the changes of the terrain HField. When the soil is
+relaxed or pushed by the bucket, it only moves from one terrain cell to another, so
+that the net volume change of the terrain during a step is the volume of soil entering
+the bucket, when negative, or leaving the bucket, when positive. As the soil is
+conserved, the volume carried is the difference between the volume excavated and the
+volume dumped. Note that the bucket soil HFields cannot be used instead, as they only
+store the top of the soil in the bucket.
+
+The soil plugin stores the area of the terrain changed during the last step in its
+state, so that only this area is compared with the previous terrain and the cost of
+a step is proportional to the number of changed cells. Without the soil plugin, for
+instance when the terrain is modified by the caller, the whole terrain is compared.
+
+Typical usage example:
+
+    tracker = SoilVolumeTracker(mj_model)
+    for _ in range(n_step):
+        mujoco.mj_step(mj_model, mj_data)
+        tracker.update(mj_data)
+    print(tracker.volume_excavated, tracker.volume_carried, tracker.volume_dumped)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import numpy as np
+
+
+# ==================================================================================== #
+#                                                                                      #
+#              Starting implementation of the soil volume tracker                      #
+#                                                                                      #
+# ==================================================================================== #
+class SoilVolumeTracker:
+    """Tracks the soil volume moved in an excavator simulation.
+
+    The tracker keeps a copy of the terrain HField, which is compared with the
+    terrain HField after each step. The tracker must therefore be updated after
+    every step, as the changed area stored by the soil plugin only covers the last
+    step. When the simulation time decreases, the data is assumed to have been reset
+    and the copy of the terrain is taken again without changing the totals.
+
+    Attributes:
+        mj_model: Compiled excavator model.
+        cell_size_xy: Length of the grid cells in the horizontal direction. [m]
+        cell_size_z: Height of the grid cells, to which the height changes are
+                     rounded, or None when the height changes are not rounded. [m]
+        volume_excavated: Total soil volume removed from the terrain. [m^3]
+        volume_dumped: Total soil volume returned to the terrain. [m^3]
+        n_changed_cell: Number of terrain cells changed during the last step.
+    """
+
+    def __init__(self, mj_model, cell_size_z: float = None) -> None:
+        """Initializes the tracker with the current terrain.
+
+        Args:
+            mj_model: Compiled excavator model.
+            cell_size_z: Height of the grid cells. Default value to the cell_size_z
+                         parameter of the soil plugin, or to no rounding when the
+                         model does not have the soil plugin. [m]
+        """
+        self.mj_model = mj_model
+        hfield = mj_model.hfield("terrain")
+        self._height_scale = float(hfield.size[2])
+
+        # Following the convention of the soil plugin
+        self.cell_size_xy = 2.0 * float(hfield.size[0]) / hfield.nrow[0]
+
+        # View of the terrain HField, whose rows follow the Y direction
+        self._hfield_data = mj_model.hfield_data[
+            hfield.adr[0]:hfield.adr[0] + hfield.nrow[0] * hfield.ncol[0]].reshape(
+            hfield.nrow[0], hfield.ncol[0])
+        self._terrain = self._hfield_data.copy()
+
+        # The soil plugin stores its changed area from its third state
+        self._changed_area_adr = None
+        if mj_model.nplugin and mj_model.plugin_statenum[0] >= 6:
+            self._changed_area_adr = mj_model.plugin_stateadr[0] + 2
+        if cell_size_z is None and mj_model.nplugin:
+            # The cell_size_z parameter is the first attribute of the soil plugin
+            attr = bytes(mj_model.plugin_attr[mj_model.plugin_attradr[0]:])
+            cell_size_z = float(attr.split(b"\0", 1)[0])
+        self.cell_size_z = cell_size_z
+
+        self.volume_excavated = 0.0
+        self.volume_dumped = 0.0
+        self.n_changed_cell = 0
+        self._time = -np.inf
+
+    @property
+    def volume_carried(self) -> float:
+        """Soil volume currently in the bucket. [m^3]"""
+        return self.volume_excavated - self.volume_dumped
+
+    def update(self, mj_data) -> None:
+        """Accounts for the terrain changes of the last step.
+
+        Args:
+            mj_data: MuJoCo data of the simulation.
+        """
+        if mj_data.time < self._time:
+            np.copyto(self._terrain, self._hfield_data)
+        self._time = mj_data.time
+
+        # Selecting the area that may have changed
+        if self._changed_area_adr is not None:
+            ii_min, ii_max, jj_min, jj_max = mj_data.plugin_state[
+                self._changed_area_adr:self._changed_area_adr + 4].astype(int)
+            if ii_max < 0:
+                self.n_changed_cell = 0
+                return
+            area = (slice(jj_min, jj_max + 1), slice(ii_min, ii_max + 1))
+            hfield_data = self._hfield_data[area]
+            terrain = self._terrain[area]
+        else:
+            hfield_data = self._hfield_data
+            terrain = self._terrain
+
+        # Calculating the height change of the changed cells
+        changed = hfield_data != terrain
+        new_height = hfield_data[changed]
+        delta_height = self._height_scale * (
+            new_height.astype(np.float64) - terrain[changed])
+        terrain[changed] = new_height
+        if self.cell_size_z is not None:
+            delta_height = self.cell_size_z * np.rint(delta_height / self.cell_size_z)
+        self.n_changed_cell = new_height.size
+
+        # Attributing the net volume change of the terrain to the bucket
+        volume = self.cell_size_xy * self.cell_size_xy * float(np.sum(delta_height))
+        if volume < 0.0:
+            self.volume_excavated -= volume
+        else:
+            self.volume_dumped += volume
+
+    def reset(self) -> None:
+        """Sets the totals to zero and takes a copy of the current terrain.
+
+        This should be called when the terrain is set by the caller, for instance with
+        load_terrain.
+        """
+        np.copyto(self._terrain, self._hfield_data)
+        self.volume_excavated = 0.0
+        self.volume_dumped = 0.0
+        self.n_changed_cell = 0
+        self._time = -np.inf
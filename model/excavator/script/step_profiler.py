@@ -0,0 +1,258 @@
+"""Profiles the simulation steps of an excavator model.
+
+The purpose of this file is to find where the time goes when a simulation slows down:
+in the MuJoCo pipeline, such as the contact solving, in the soil plugin, or in the
+update of the HFields by the caller. The StepProfiler class steps a simulation and
+collects for each sampled step:
+- the duration of the MuJoCo pipeline stages, read from mjData.timer,
+- the compute time of the soil plugin, stored by the plugin in its second state,
+- the physics time, that is the step duration without the soil plugin,
+- the duration of additional stages measured by the caller, such as the upload of
+  the HFields to the GPU.
+
+The samples are kept in a rolling window, from which histograms and statistics are
+calculated, and can be exported as CSV or as a Chrome trace JSON, which can be opened
+with chrome://tracing or Perfetto. Only one step every sample_interval steps is
+profiled, so that the overhead of reading the timers can be made negligible.
+
+Note that the MuJoCo timers are only measured with MuJoCo versions providing an
+internal clock, or when a timer callback is set with mujoco.set_mjcb_time.
+
+Typical usage example:
+
+    profiler = StepProfiler(mj_model, sample_interval=10, extra_stages=["upload"])
+    for _ in range(n_step):
+        profiler.step(mj_data)
+        with profiler.stage("upload"):
+            upload_hfields()
+    profiler.write_chrome_trace("trace.json")
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import contextlib
+import csv
+import json
+import mujoco
+import numpy as np
+import time
+
+
+# MuJoCo timers reported by the profiler
+TIMER_STAGES = {
+    "step": mujoco.mjtTimer.mjTIMER_STEP,
+    "forward": mujoco.mjtTimer.mjTIMER_FORWARD,
+    "position": mujoco.mjtTimer.mjTIMER_POSITION,
+    "collision": mujoco.mjtTimer.mjTIMER_POS_COLLISION,
+    "velocity": mujoco.mjtTimer.mjTIMER_VELOCITY,
+    "actuation": mujoco.mjtTimer.mjTIMER_ACTUATION,
+    "constraint": mujoco.mjtTimer.mjTIMER_CONSTRAINT,
+    "advance": mujoco.mjtTimer.mjTIMER_ADVANCE,
+}
+
+# Stages calculated from the soil plugin state
+PLUGIN_STAGES = ["plugin", "physics"]
+
+# Parent of each stage in the Chrome trace, stages without parent being top-level
+_TRACE_PARENTS = {
+    "forward": "step", "position": "forward", "collision": "position",
+    "velocity": "forward", "plugin": "velocity", "actuation": "forward",
+    "constraint": "forward", "advance": "step"}
+
+
+# ==================================================================================== #
+#                                                                                      #
+#                    Starting implementation of the step profiler                      #
+#                                                                                      #
+# ==================================================================================== #
+class StepProfiler:
+    """Steps a simulation and profiles its stages.
+
+    Each sample is a row of the samples array containing the index of the step, the
+    time at which the step started, and the duration of each stage. The samples are
+    stored in a rolling window, the oldest samples being overwritten.
+
+    Attributes:
+        mj_model: Compiled excavator model.
+        sample_interval: Number of steps between two profiled steps.
+        window: Maximum number of samples kept.
+        stages: Names of the profiled stages.
+        n_step: Number of steps performed.
+        n_sample: Number of steps profiled.
+    """
+
+    def __init__(
+            self, mj_model, sample_interval: int = 1, window: int = 10000,
+            extra_stages: list = ()) -> None:
+        """Initializes the profiler.
+
+        Args:
+            mj_model: Compiled excavator model.
+            sample_interval: Number of steps between two profiled steps.
+            window: Maximum number of samples kept.
+            extra_stages: Names of the stages measured by the caller with stage.
+        """
+        self.mj_model = mj_model
+        self.sample_interval = sample_interval
+        self.window = window
+        self.stages = list(TIMER_STAGES) + PLUGIN_STAGES + list(extra_stages)
+        self.n_step = 0
+        self.n_sample = 0
+
+        self._timer_ids = list(TIMER_STAGES.values())
+        self._timer_before = np.zeros(len(self._timer_ids))
+        self._samples = np.zeros((window, 2 + len(self.stages)))
+        self._sampled = False
+
+        # The soil plugin stores its compute time in its second state
+        self._plugin_time_adr = None
+        if mj_model.nplugin and mj_model.plugin_statenum[0] >= 2:
+            self._plugin_time_adr = mj_model.plugin_stateadr[0] + 1
+
+    def step(self, mj_data) -> None:
+        """Performs a simulation step, which is profiled if it is sampled.
+
+        Args:
+            mj_data: MuJoCo data of the simulation.
+        """
+        self._sampled = self.n_step % self.sample_interval == 0
+        self.n_step += 1
+        if not self._sampled:
+            mujoco.mj_step(self.mj_model, mj_data)
+            return
+
+        timer = mj_data.timer
+        for ii, timer_id in enumerate(self._timer_ids):
+            self._timer_before[ii] = timer[timer_id].duration
+        start = time.perf_counter()
+        mujoco.mj_step(self.mj_model, mj_data)
+
+        sample = self._samples[self.n_sample % self.window]
+        sample[:] = 0.0
+        sample[0] = self.n_step - 1
+        sample[1] = start
+        for ii, timer_id in enumerate(self._timer_ids):
+            sample[2 + ii] = timer[timer_id].duration - self._timer_before[ii]
+        plugin_time = 0.0
+        if self._plugin_time_adr is not None:
+            plugin_time = mj_data.plugin_state[self._plugin_time_adr]
+        sample[2 + len(self._timer_ids)] = plugin_time
+        sample[3 + len(self._timer_ids)] = sample[2] - plugin_time
+        self.n_sample += 1
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Measures the duration of an additional stage of the last step.
+
+        The duration is only stored when the last step has been sampled.
+
+        Args:
+            name: Name of the stage, which must be given in extra_stages.
+        """
+        start = time.perf_counter()
+        yield
+        if self._sampled:
+            sample = self._samples[(self.n_sample - 1) % self.window]
+            sample[2 + self.stages.index(name)] += time.perf_counter() - start
+
+    @property
+    def samples(self) -> np.ndarray:
+        """Samples of the rolling window, ordered from the oldest to the latest."""
+        if self.n_sample <= self.window:
+            return self._samples[:self.n_sample]
+        return np.roll(self._samples, -(self.n_sample % self.window), axis=0)
+
+    def summary(self) -> dict:
+        """Calculates the statistics of each stage over the rolling window.
+
+        Returns:
+            A dictionary mapping each stage to its mean, median, 95th percentile and
+            maximum duration. [s]
+        """
+        samples = self.samples
+        summary = {}
+        for ii, name in enumerate(self.stages):
+            durations = samples[:, 2 + ii]
+            summary[name] = {
+                "mean": float(np.mean(durations)),
+                "median": float(np.median(durations)),
+                "p95": float(np.percentile(durations, 95)),
+                "max": float(np.max(durations)),
+            }
+        return summary
+
+    def histograms(self, n_bin: int = 50) -> dict:
+        """Calculates the histogram of each stage over the rolling window.
+
+        The bins are logarithmically spaced, as the durations span several orders of
+        magnitude.
+
+        Args:
+            n_bin: Number of bins.
+
+        Returns:
+            A dictionary mapping each stage to the count of each bin and the edges of
+            the bins. [s]
+        """
+        samples = self.samples
+        histograms = {}
+        for ii, name in enumerate(self.stages):
+            durations = samples[:, 2 + ii]
+            durations = durations[durations > 0.0]
+            if durations.size == 0:
+                histograms[name] = (np.zeros(n_bin, dtype=int), np.zeros(n_bin + 1))
+                continue
+            edges = np.geomspace(
+                durations.min(), durations.max() * (1.0 + 1e-9), n_bin + 1)
+            histograms[name] = np.histogram(durations, edges)
+        return histograms
+
+    def write_csv(self, filename: str) -> None:
+        """Writes the samples of the rolling window as CSV.
+
+        The first column is the index of the step, named step_index so that it is not
+        confused with the duration of the step stage.
+
+        Args:
+            filename: Path of the CSV file.
+        """
+        with open(filename, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["step_index", "start"] + self.stages)
+            for sample in self.samples:
+                writer.writerow([int(sample[0])] + sample[1:].tolist())
+
+    def write_chrome_trace(self, filename: str) -> None:
+        """Writes the samples of the rolling window as a Chrome trace JSON.
+
+        Only the duration of the stages is measured, so that each stage is placed
+        after the previous stage with the same parent, in the order of the MuJoCo
+        pipeline. The additional stages are placed after the step, while the physics
+        stage, which is calculated from the step and plugin stages, is not written.
+
+        Args:
+            filename: Path of the JSON file.
+        """
+        events = []
+        for sample in self.samples:
+            step_start = 1e6 * sample[1]
+            durations = dict(zip(self.stages, 1e6 * sample[2:]))
+            starts = {"step": step_start}
+            next_start = {"step": step_start}
+            for name in self.stages:
+                if name == "physics":
+                    continue
+                elif name in _TRACE_PARENTS:
+                    parent = _TRACE_PARENTS[name]
+                    starts[name] = next_start.get(parent, starts[parent])
+                    next_start[parent] = starts[name] + durations[name]
+                elif name != "step":
+                    starts[name] = next_start.get(None, step_start + durations["step"])
+                    next_start[None] = starts[name] + durations[name]
+                if durations[name] > 0.0:
+                    events.append({
+                        "name": name, "ph": "X", "ts": starts[name],
+                        "dur": durations[name], "pid": 0, "tid": 0,
+                        "args": {"step": int(sample[0])}})
+
+        with open(filename, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
@@ -0,0 +1,102 @@
+"""Tests the calculation of the excavator pose.
+
+The purpose of the tests in this file is to check that the batched pose calculation
+gives the same result as the scalar pose calculation, and that both agree with
+reference values. The reference values were obtained with the original scalar
+implementation, which calculated each pose one at a time with Python floats.
+
+Typical usage example:
+
+    python -m pytest test_pose_calculation.py
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import numpy as np
+import pytest
+from excavator_geometry import DEFAULT_GEOMETRY
+from inverse_kinematics import _calc_excavator_angles
+from pose_calculation import _calc_excavator_pose, _calc_excavator_pose_batch
+
+
+# Reference poses given as (angle_boom, angle_arm, angle_bucket) [rad], and properties
+# in the order returned by _calc_excavator_pose
+REFERENCE_POSES = [
+    (
+        (0.5, 0.0, 0.2),
+        [
+            -1.23941614152933, 32.75417303231433, 24.016752019006695,
+            37.81845610885692, 0.4101122681018079, 23.43243355724313,
+            0.0876209208911039, 84.57511210511748, 2.6869256342102257, 199.6, 0.0,
+            37.14452330018305, 7.5295676371328195, -2.593644143339825]),
+    (
+        (np.deg2rad(30.0), np.deg2rad(-60.0), np.deg2rad(-30.0)),
+        [
+            -1.2619435942086275, 33.99189718837806, 44.760119731680234,
+            -1.8898893104225398, 0.2118881717061915, 72.1350160831117,
+            0.03335331611952341, 79.02683290390897, 2.505203751598027,
+            99.80000000000003, -172.85867059537395, 32.822362803430224,
+            -18.949999999999996, -3.3634093871809108]),
+    (
+        (np.deg2rad(10.0), np.deg2rad(-90.0), np.deg2rad(20.0)),
+        [
+            -0.9104429211287006, 15.591019754487434, 37.81845610885693,
+            -24.016752019006695, 0.21873584466752957, 81.98367686538306,
+            -0.11143370133003017, 34.70501033738374, 1.514264492096505,
+            1.2221975055490584e-14, -199.6, 35.61435032778593, 12.962563432042844,
+            -2.4354641150601823]),
+    (
+        (np.deg2rad(45.0), np.deg2rad(-20.0), np.deg2rad(60.0)),
+        [
+            -1.5021895833403447, 47.30757501991593, 35.50303842621242,
+            27.323511167250896, 0.23748852155857847, 47.86760825285499,
+            -0.09127091776470297, 53.24310068784018, 1.9094861460087027,
+            187.5626471088673, -68.26722060780347, 18.950000000000003,
+            32.822362803430224, -1.7950645913665613]),
+]
+
+
+# ==================================================================================== #
+#                                                                                      #
+#             Starting implementation of the tests of the pose calculation             #
+#                                                                                      #
+# ==================================================================================== #
+@pytest.mark.parametrize("angles, reference", REFERENCE_POSES)
+def test_scalar_pose_matches_reference(angles, reference) -> None:
+    pose = _calc_excavator_pose(*angles)
+    np.testing.assert_allclose(pose, reference, rtol=0.0, atol=1e-9)
+
+
+def test_batch_pose_matches_reference() -> None:
+    angles = np.array([angles for angles, _ in REFERENCE_POSES]).T
+    pose = _calc_excavator_pose_batch(angles[0], angles[1], angles[2])
+    reference = np.array([reference for _, reference in REFERENCE_POSES]).T
+    np.testing.assert_allclose(pose.to_list(), reference, rtol=0.0, atol=1e-9)
+
+
+def test_batch_pose_matches_scalar_pose() -> None:
+    # Drawing poses within the piston ranges, converted from m to cm, and keeping the
+    # poses for which the linkage can be assembled
+    rng = np.random.default_rng(0)
+    ext = [
+        100.0 * rng.uniform(*piston_range, 100) for piston_range in (
+            DEFAULT_GEOMETRY.cb_piston_range, DEFAULT_GEOMETRY.ba_piston_range,
+            DEFAULT_GEOMETRY.ah_piston_range)]
+    with np.errstate(invalid="ignore"):
+        angles = np.stack(_calc_excavator_angles(*ext))
+    angles = angles[:, ~np.any(np.isnan(angles), axis=0)][:, :20]
+    angle_boom, angle_arm, angle_bucket = angles.reshape(3, 4, 5)
+
+    pose = _calc_excavator_pose_batch(angle_boom, angle_arm, angle_bucket)
+    batch = np.stack(pose.to_list(), axis=-1)
+    assert batch.shape == (4, 5, 14)
+    assert not np.any(np.isnan(batch))
+    for index in np.ndindex(angle_boom.shape):
+        scalar = _calc_excavator_pose(
+            angle_boom[index], angle_arm[index], angle_bucket[index])
+        np.testing.assert_allclose(batch[index], scalar, rtol=0.0, atol=1e-9)
+
+
+def test_batch_pose_broadcasts_inputs() -> None:
+    pose = _calc_excavator_pose_batch(
+        np.array([0.5, 0.6]), np.array([[0.0], [-0.2], [-0.4]]), 0.2)
+    assert all(value.shape == (3, 2) for value in pose.to_list())
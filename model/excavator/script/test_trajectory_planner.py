@@ -0,0 +1,109 @@
+"""Tests the consistency of the trajectory planner with the reachability map.
+
+The purpose of the tests in this file is to check that the poses drawn from the
+reachability map can be planned, that is that the planner and the reachability map
+agree on the validity of the poses, and that the planned commands stay within the
+control range and reach the goal poses in the planned number of time steps.
+
+Typical usage example:
+
+    python -m pytest test_trajectory_planner.py
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import numpy as np
+import pytest
+from inverse_kinematics import _wrap_angle
+from pose_calculation import _calc_excavator_pose_batch
+from reachability_map import (
+    VALID, ReachabilityMap, _calc_pose_validity_from_angles)
+from trajectory_planner import plan_piston_trajectory
+
+
+# ==================================================================================== #
+#                                                                                      #
+#            Starting implementation of the tests of the trajectory planner            #
+#                                                                                      #
+# ==================================================================================== #
+@pytest.fixture(scope="module")
+def reachability_map() -> ReachabilityMap:
+    # A coarse map is enough to cover the whole reachable region
+    return ReachabilityMap.build(resolution=2.0)
+
+
+def test_planner_code_matches_reachability_map(reachability_map) -> None:
+    rng = np.random.default_rng(0)
+    start = np.column_stack(reachability_map.sample(1000, rng))
+    goal = np.column_stack(reachability_map.sample(1000, rng))
+    plan = plan_piston_trajectory(
+        np.column_stack((np.deg2rad(start), np.zeros(1000))),
+        np.column_stack((np.deg2rad(goal), np.ones(1000))))
+
+    reference = (
+        _calc_pose_validity_from_angles(*start.T) |
+        _calc_pose_validity_from_angles(*goal.T))
+    np.testing.assert_array_equal(plan["code"], reference)
+    np.testing.assert_array_equal(plan["valid"], reference == VALID)
+
+    # Only the poses drawn near the border of the valid region may be invalid
+    assert np.mean(plan["valid"]) > 0.95
+
+
+@pytest.fixture(scope="module")
+def valid_pairs(reachability_map) -> tuple:
+    # Taking the center of the valid cells, which are valid by construction, with
+    # chassis angles covering more than a turn
+    rng = np.random.default_rng(0)
+    index = np.flatnonzero(np.asarray(reachability_map.codes) == VALID)
+    index = rng.choice(index, 2000, replace=False)
+    angles = reachability_map.angle_min + reachability_map.resolution * np.column_stack(
+        np.unravel_index(index, reachability_map.codes.shape))
+    poses = np.column_stack((np.deg2rad(angles), rng.uniform(-4.0, 4.0, index.size)))
+    return poses[:1000], poses[1000:]
+
+
+def test_valid_cells_can_be_planned(valid_pairs) -> None:
+    plan = plan_piston_trajectory(*valid_pairs)
+    assert np.all(plan["valid"])
+
+
+@pytest.mark.parametrize("ctrl_range", [(-0.5, 0.5), (-0.2, 0.4)])
+def test_ctrl_within_ctrl_range(valid_pairs, ctrl_range) -> None:
+    plan = plan_piston_trajectory(*valid_pairs, ctrl_range=ctrl_range)
+    assert np.all(plan["ctrl"] >= ctrl_range[0])
+    assert np.all(plan["ctrl"] <= ctrl_range[1])
+
+
+@pytest.mark.parametrize("ctrl_range", [(-0.5, 0.5), (-0.2, 0.4)])
+def test_duration_not_shorter_than_slowest_actuator(valid_pairs, ctrl_range) -> None:
+    timestep = 0.002
+    plan = plan_piston_trajectory(
+        *valid_pairs, timestep=timestep, ctrl_range=ctrl_range)
+
+    # Minimum time of each actuator moving at its maximum velocity
+    start, goal = valid_pairs
+    displacement = np.column_stack((
+        _wrap_angle(goal[:, 3] - start[:, 3]), plan["ext_goal"] - plan["ext_start"]))
+    max_velocity = np.where(displacement > 0.0, ctrl_range[1], -ctrl_range[0])
+    min_duration = np.max(np.abs(displacement) / max_velocity, axis=1)
+    assert np.all(plan["duration"] >= min_duration - 1e-12)
+    assert np.all(plan["duration"] < min_duration + timestep)
+    np.testing.assert_allclose(plan["duration"], plan["n_step"] * timestep)
+
+
+def test_goal_reached_after_n_step(valid_pairs) -> None:
+    timestep = 0.002
+    start, goal = valid_pairs
+    plan = plan_piston_trajectory(start, goal, timestep=timestep)
+
+    # The piston extensions of the goal poses are the ones of the pose calculation
+    pose = _calc_excavator_pose_batch(goal[:, 0], goal[:, 1], goal[:, 2])
+    np.testing.assert_allclose(plan["ext_goal"], np.column_stack((
+        pose.ext_cb_piston, pose.ext_ba_piston, pose.ext_ah_piston)) / 100.0)
+
+    # Holding the commands during n_step time steps
+    motion = plan["ctrl"] * (plan["n_step"] * timestep)[:, None]
+    np.testing.assert_allclose(
+        plan["ext_start"] + motion[:, 1:], plan["ext_goal"], rtol=0.0, atol=1e-12)
+    np.testing.assert_allclose(
+        _wrap_angle(start[:, 3] + motion[:, 0] - goal[:, 3]), 0.0, atol=1e-12)
@@ -0,0 +1,184 @@
+"""Plans the time-optimal motion of the excavator between two poses.
+
+The purpose of the functions in this file is to move the excavator between two poses,
+for instance between a dig pose and a dump pose, for whole batches of start and goal
+poses at once, so that the planner can be called inside a scheduling loop.
+
+The excavator is actuated through velocity actuators on the chassis joint and on the
+three piston rods, whose commands are bounded by the control range. Assuming that
+the actuators follow their command, the minimum duration of a motion is given by the
+actuator with the largest displacement moving at the maximum velocity. The planner
+moves all actuators at a constant velocity during this duration, so that they start
+and stop together, and the piston extensions move along a straight line between
+their start and goal values. As the piston ranges form a box, the piston extensions
+stay within their range during the whole motion when the start and goal poses are
+valid. On the linkage branch of the excavator model, described in
+inverse_kinematics.py, each piston extension is moreover a monotone function of the
+corresponding relative angle, so that the linkage can be assembled along the whole
+motion. Poses within the piston ranges but on another branch, such as an arm folded
+above the boom, cannot be reached this way and are considered invalid.
+
+The duration is rounded up to a whole number of time steps, the velocity being
+reduced accordingly, so that the goal is reached exactly at the end of a time step.
+
+Some information about this file:
+- The poses are given as (angle_boom, angle_arm, angle_bucket, angle_chassis), the
+  first three angles following the convention of the pose calculation. [rad]
+- The piston extensions are given in m, following the convention of the MuJoCo
+  model.
+- The commands follow the order of the actuators: Rotation, Boom, Arm and Bucket.
+- The chassis joint is not limited, so that the chassis rotates along the shortest
+  direction.
+
+Typical usage example:
+
+    plan = plan_piston_trajectory(dig_poses, dump_poses)
+    ctrl = calc_ctrl_sequence(plan)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import argparse
+import numpy as np
+import time
+from excavator_geometry import DEFAULT_GEOMETRY, ExcavatorGeometry
+from inverse_kinematics import _wrap_angle
+from pose_calculation import _calc_excavator_pose_batch
+from reachability_map import VALID, _calc_pose_validity_from_pose
+
+
+# ==================================================================================== #
+#                                                                                      #
+#           Starting implementation of functions used to plan the trajectories         #
+#                                                                                      #
+# ==================================================================================== #
+def plan_piston_trajectory(
+        start: np.ndarray, goal: np.ndarray, timestep: float = 0.002,
+        ctrl_range: tuple = (-0.5, 0.5),
+        geometry: ExcavatorGeometry = DEFAULT_GEOMETRY) -> dict:
+    """Plans the time-optimal motion between a batch of start and goal poses.
+
+    Pairs whose start or goal pose is invalid are given a zero command and duration.
+    The validity of the poses is the one of the reachability map, so that the poses
+    drawn from the reachability map can be planned.
+
+    Args:
+        start: Start poses, of shape (n_pair, 4) or (4,). [rad]
+        goal: Goal poses, of shape (n_pair, 4) or (4,). [rad]
+        timestep: Time step of the simulation. Default value to the time step of the
+                  excavator model. [s]
+        ctrl_range: Lower and upper bound of the actuator commands. It must contain
+                    zero. Default value to the control range of the excavator model.
+        geometry: Geometry of the excavator. Default value to the geometry of the
+                  excavator model.
+
+    Returns:
+        A dictionary containing, for each pair:
+        - valid: whether the start and goal poses are within the piston ranges and
+          on the linkage branch of the excavator model,
+        - code: combined uint8 reason code of the start and goal poses, following
+          reachability_map.py,
+        - ext_start, ext_goal: extension of the chassis/boom, boom/arm and arm/bucket
+          pistons at the start and goal pose, of shape (n_pair, 3), [m]
+        - duration: duration of the motion, [s]
+        - n_step: number of time steps of the motion,
+        - ctrl: command of each actuator during the motion, of shape (n_pair, 4).
+    """
+    start, goal = np.broadcast_arrays(
+        np.atleast_2d(np.asarray(start, dtype=np.float64)),
+        np.atleast_2d(np.asarray(goal, dtype=np.float64)))
+
+    # Calculating the piston extensions of both poses at once, converted from cm to m
+    angles = np.stack((start[:, :3], goal[:, :3]))
+    with np.errstate(invalid="ignore"):
+        pose = _calc_excavator_pose_batch(
+            angles[..., 0], angles[..., 1], angles[..., 2], geometry)
+    ext = np.stack(
+        (pose.ext_cb_piston, pose.ext_ba_piston, pose.ext_ah_piston), axis=-1) / 100.0
+    code = _calc_pose_validity_from_pose(
+        angles[..., 0], angles[..., 1], angles[..., 2], pose, geometry)
+    code = code[0] | code[1]
+    valid = code == VALID
+
+    # Calculating the displacement of each actuator
+    displacement = np.empty(start.shape)
+    displacement[:, 0] = _wrap_angle(goal[:, 3] - start[:, 3])
+    displacement[:, 1:] = ext[1] - ext[0]
+    displacement[~valid] = 0.0
+
+    # Duration of the slowest actuator moving at its maximum velocity
+    max_velocity = np.where(displacement > 0.0, ctrl_range[1], -ctrl_range[0])
+    min_duration = np.max(np.abs(displacement) / max_velocity, axis=1)
+    n_step = np.ceil(min_duration / timestep - 1e-9).astype(np.int64)
+    duration = n_step * timestep
+    ctrl = displacement / np.maximum(duration, timestep)[:, None]
+
+    return {
+        "valid": valid, "code": code, "ext_start": ext[0], "ext_goal": ext[1],
+        "duration": duration, "n_step": n_step, "ctrl": ctrl}
+
+
+def calc_ctrl_sequence(plan: dict, n_step: int = None) -> np.ndarray:
+    """Calculates the command of each time step of a batch of planned motions.
+
+    The command of each motion is held during its number of time steps, and set to
+    zero afterwards, so that the excavator stops at the goal pose.
+
+    Args:
+        plan: Plan returned by plan_piston_trajectory.
+        n_step: Number of time steps of the sequence. Default value to the largest
+                number of time steps of the motions.
+
+    Returns:
+        The command of each actuator at each time step, of shape
+        (n_pair, n_step, 4).
+    """
+    if n_step is None:
+        n_step = int(np.max(plan["n_step"], initial=0))
+    active = np.arange(n_step)[None, :] < plan["n_step"][:, None]
+    return np.where(active[..., None], plan["ctrl"][:, None, :], 0.0)
+
+
+if __name__ == "__main__":
+    from kinematic_preview import KinematicPreview
+    from reachability_map import ReachabilityMap
+
+    parser = argparse.ArgumentParser(
+        description="Measures the time taken by the trajectory planner.")
+    parser.add_argument(
+        "--n_pair", type=int, default=10000, help="Number of start/goal pairs.")
+    args = parser.parse_args()
+
+    # Drawing valid dig and dump poses
+    rng = np.random.default_rng(0)
+    reachability_map = ReachabilityMap.build()
+    dig_poses = np.column_stack((
+        np.deg2rad(reachability_map.sample(args.n_pair, rng)).T,
+        rng.uniform(-0.5, 0.5, args.n_pair)))
+    dump_poses = np.column_stack((
+        np.deg2rad(reachability_map.sample(args.n_pair, rng)).T,
+        rng.uniform(1.5, 3.0, args.n_pair)))
+
+    # Planning a full cycle, from the dig pose to the dump pose and back
+    start = time.perf_counter()
+    plan_dump = plan_piston_trajectory(dig_poses, dump_poses)
+    plan_dig = plan_piston_trajectory(dump_poses, dig_poses)
+    elapsed = time.perf_counter() - start
+    print("%d cycles: %.3f s, %.2e s per cycle" % (
+        args.n_pair, elapsed, elapsed / args.n_pair))
+    print("Valid cycles: %d" % np.sum(plan_dump["valid"] & plan_dig["valid"]))
+    print("Mean cycle duration: %.2f s" % np.mean(
+        plan_dump["duration"] + plan_dig["duration"]))
+
+    # Checking that the kinematic preview reaches the dump poses
+    n_check = min(args.n_pair, 100)
+    check = np.flatnonzero(plan_dump["valid"])[:n_check]
+    preview = KinematicPreview(exact=True)
+    trajectories = preview.rollout(
+        calc_ctrl_sequence({
+            name: value[check] for name, value in plan_dump.items()}),
+        plan_dump["ext_start"][check], dig_poses[check, 3])
+    angles = np.concatenate((
+        trajectories["angles"][:, -1], trajectories["angle_chassis"][:, -1, None]),
+        axis=-1)
+    error = _wrap_angle(angles - dump_poses[check])
+    print("Maximum angle error at the dump pose: %.2e rad" % np.max(np.abs(error)))
@@ -0,0 +1,270 @@
+"""Records the trajectory of an excavator simulation.
+
+The purpose of this file is to log a simulation for offline analysis with a small
+footprint. The TrajectoryRecorder class is called after every step of a running
+simulation and streams the time, qpos, ctrl, actuator forces and the changes of the
+HFields into a single file, while the TrajectoryReader class reads any step of the
+file.
+
+As only the cells close to the bucket change during a step, the HFields are not stored
+at every step. The steps are gathered into chunks, each chunk starting with a keyframe
+containing the data of all HFields, followed by the cells that changed at each step,
+stored as sparse (index, value) pairs. Each chunk is compressed and appended to the
+file as soon as it is full, so that a long run does not grow in memory.
+
+The file is organized as follows:
+- the FILE_MAGIC bytes,
+- the compressed chunks, each chunk being a NumPy .npz archive,
+- the index of the chunks and the properties of the model, written as JSON,
+- the offset and size of the index as two little-endian int64, and FILE_MAGIC.
+
+The reader memory-maps the file and only decompresses the chunk containing the
+requested step, whose HFields are obtained by replaying the changes from the keyframe.
+
+Typical usage example:
+
+    with TrajectoryRecorder(mj_model, "run.traj") as recorder:
+        for _ in range(n_step):
+            mujoco.mj_step(mj_model, mj_data)
+            recorder.record(mj_data)
+
+    step = TrajectoryReader("run.traj").read(1234)
+
+Copyright, 2023,  Vilella Kenny.
+"""
+import io
+import json
+import numpy as np
+import struct
+
+
+# Bytes written at the beginning and at the end of a trajectory file
+FILE_MAGIC = b"EXCTRAJ1"
+
+# Format of the file footer: offset and size of the index, followed by FILE_MAGIC
+_FOOTER_FORMAT = "<qq8s"
+
+
+# ==================================================================================== #
+#                                                                                      #
+#              Starting implementation of the trajectory recorder and reader           #
+#                                                                                      #
+# ==================================================================================== #
+class TrajectoryRecorder:
+    """Streams the trajectory of a simulation into a file.
+
+    The arrays of a chunk are allocated once, so that recording a step only copies the
+    state of the simulation and compares the HFields with their previous value.
+
+    Attributes:
+        mj_model: Compiled excavator model. Its HFields are updated by the soil plugin.
+        filename: Path of the trajectory file.
+        chunk_size: Number of steps in each chunk, that is the number of steps between
+                    two keyframes.
+        n_step: Number of steps recorded.
+    """
+
+    def __init__(self, mj_model, filename: str, chunk_size: int = 1000) -> None:
+        self.mj_model = mj_model
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.n_step = 0
+
+        self._file = open(filename, "wb")
+        self._file.write(FILE_MAGIC)
+        self._chunks = []
+
+        # Arrays of the current chunk
+        self._time = np.zeros(chunk_size)
+        self._qpos = np.zeros((chunk_size, mj_model.nq))
+        self._ctrl = np.zeros((chunk_size, mj_model.nu))
+        self._actuator_force = np.zeros((chunk_size, mj_model.nu))
+        self._keyframe = np.array(mj_model.hfield_data)
+        self._hfield_data = np.array(mj_model.hfield_data)
+        self._delta_index = []
+        self._delta_value = []
+        self._delta_count = np.zeros(chunk_size, dtype=np.int64)
+        self._n_chunk_step = 0
+
+    def record(self, mj_data) -> None:
+        """Records the current step of the simulation.
+
+        Args:
+            mj_data: MuJoCo data of the simulation.
+        """
+        ii = self._n_chunk_step
+        if ii == 0:
+            # Starting a new chunk with a keyframe
+            np.copyto(self._keyframe, self.mj_model.hfield_data)
+            np.copyto(self._hfield_data, self.mj_model.hfield_data)
+        else:
+            # Storing the changes of the HFields since the previous step
+            changed = np.flatnonzero(self._hfield_data != self.mj_model.hfield_data)
+            if changed.size:
+                value = self.mj_model.hfield_data[changed]
+                self._hfield_data[changed] = value
+                self._delta_index.append(changed.astype(np.int32))
+                self._delta_value.append(value)
+            self._delta_count[ii] = changed.size
+
+        self._time[ii] = mj_data.time
+        self._qpos[ii] = mj_data.qpos
+        self._ctrl[ii] = mj_data.ctrl
+        self._actuator_force[ii] = mj_data.actuator_force
+        self._n_chunk_step += 1
+        self.n_step += 1
+
+        if self._n_chunk_step == self.chunk_size:
+            self._write_chunk()
+
+    def close(self) -> None:
+        """Writes the last chunk and the index, and closes the file."""
+        if self._file.closed:
+            return
+        if self._n_chunk_step:
+            self._write_chunk()
+
+        index = json.dumps({
+            "nq": self.mj_model.nq,
+            "nu": self.mj_model.nu,
+            "nhfielddata": self.mj_model.nhfielddata,
+            "n_step": self.n_step,
+            "chunk_size": self.chunk_size,
+            "chunks": self._chunks,
+        }).encode()
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(
+            struct.pack(_FOOTER_FORMAT, index_offset, len(index), FILE_MAGIC))
+        self._file.close()
+
+    def __enter__(self) -> "TrajectoryRecorder":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _write_chunk(self) -> None:
+        """Compresses the current chunk and appends it to the file."""
+        n = self._n_chunk_step
+        if self._delta_index:
+            delta_index = np.concatenate(self._delta_index)
+            delta_value = np.concatenate(self._delta_value)
+        else:
+            delta_index = np.zeros(0, dtype=np.int32)
+            delta_value = np.zeros(0, dtype=self._keyframe.dtype)
+
+        chunk = io.BytesIO()
+        np.savez_compressed(
+            chunk, time=self._time[:n], qpos=self._qpos[:n], ctrl=self._ctrl[:n],
+            actuator_force=self._actuator_force[:n], keyframe=self._keyframe,
+            delta_count=self._delta_count[:n], delta_index=delta_index,
+            delta_value=delta_value)
+        chunk = chunk.getbuffer()
+
+        self._chunks.append({
+            "offset": self._file.tell(), "size": len(chunk),
+            "first_step": self.n_step - n, "n_step": n})
+        self._file.write(chunk)
+        self._file.flush()
+
+        self._delta_index = []
+        self._delta_value = []
+        self._n_chunk_step = 0
+
+
+class TrajectoryReader:
+    """Reads a trajectory file written by TrajectoryRecorder.
+
+    The file is memory-mapped and the chunks are decompressed on demand. The last
+    decompressed chunk is kept, as well as the HFields of the last step read, so that
+    reading the steps in increasing order only replays the changes of each new step.
+
+    Attributes:
+        filename: Path of the trajectory file.
+        n_step: Number of steps in the file.
+        nq: Number of position coordinates of the model.
+        nu: Number of actuators of the model.
+        nhfielddata: Number of HField cells of the model.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self._file = np.memmap(filename, dtype=np.uint8, mode="r")
+
+        # Reading the index
+        footer_size = struct.calcsize(_FOOTER_FORMAT)
+        index_offset, index_size, magic = struct.unpack(
+            _FOOTER_FORMAT, self._file[-footer_size:].tobytes())
+        if magic != FILE_MAGIC or self._file[:len(FILE_MAGIC)].tobytes() != FILE_MAGIC:
+            raise Exception("Invalid trajectory file: " + filename)
+        index = json.loads(
+            self._file[index_offset:index_offset + index_size].tobytes().decode())
+        self.n_step = index["n_step"]
+        self.nq = index["nq"]
+        self.nu = index["nu"]
+        self.nhfielddata = index["nhfielddata"]
+        self._chunks = index["chunks"]
+        self._first_steps = np.array([chunk["first_step"] for chunk in self._chunks])
+
+        self._chunk_id = -1
+        self._chunk = None
+        self._delta_start = None
+        self._hfield_data = None
+        self._replayed_step = -1
+
+    def read(self, step: int) -> dict:
+        """Reads a step of the trajectory.
+
+        Args:
+            step: Index of the step. Negative values are counted from the end.
+
+        Returns:
+            A dictionary containing the time, qpos, ctrl, actuator_force and hfield_data
+            of the step. The hfield_data array is overwritten by the next call.
+        """
+        if step < 0:
+            step += self.n_step
+        if not 0 <= step < self.n_step:
+            raise IndexError("Step " + str(step) + " out of range")
+
+        chunk_id = int(np.searchsorted(self._first_steps, step, side="right")) - 1
+        if chunk_id != self._chunk_id:
+            self._load_chunk(chunk_id)
+        ii = step - self._chunks[chunk_id]["first_step"]
+
+        # Replaying the changes from the keyframe, or from the last step read
+        if ii < self._replayed_step:
+            np.copyto(self._hfield_data, self._chunk["keyframe"])
+            self._replayed_step = 0
+        start = self._delta_start[self._replayed_step + 1]
+        end = self._delta_start[ii + 1]
+        self._hfield_data[self._chunk["delta_index"][start:end]] = (
+            self._chunk["delta_value"][start:end])
+        self._replayed_step = ii
+
+        return {
+            "time": self._chunk["time"][ii],
+            "qpos": self._chunk["qpos"][ii],
+            "ctrl": self._chunk["ctrl"][ii],
+            "actuator_force": self._chunk["actuator_force"][ii],
+            "hfield_data": self._hfield_data,
+        }
+
+    def _load_chunk(self, chunk_id: int) -> None:
+        """Decompresses a chunk of the file.
+
+        Args:
+            chunk_id: Index of the chunk.
+        """
+        offset = self._chunks[chunk_id]["offset"]
+        size = self._chunks[chunk_id]["size"]
+        with np.load(io.BytesIO(self._file[offset:offset + size])) as chunk:
+            self._chunk = {name: chunk[name] for name in chunk.files}
+
+        # Position of the changes of each step, the changes of step ii being between
+        # delta_start[ii] and delta_start[ii + 1]
+        self._delta_start = np.concatenate(([0], np.cumsum(self._chunk["delta_count"])))
+        self._hfield_data = self._chunk["keyframe"].copy()
+        self._replayed_step = 0
+        self._chunk_id = chunk_id
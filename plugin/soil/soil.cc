@@ -11,6 +11,8 @@ Copyright, 2023, Vilella Kenny.
 #include <mujoco/mujoco.h>
 #include <algorithm>
 #include <cctype>
+#include <chrono>
+#include <cmath>
 #include <cstdint>
 #include <cstdlib>
 #include <sstream>
@@ -74,30 +76,56 @@ Soil* Soil::Create(const mjModel* m, mjData* d, int instance) {
         mju_error("Soil plugin: No ``bucket soil 2`` HField has been detected");
 
     // Checking consistency of HFields
-    if (m->hfield_nrow[terrain_id] != m->hfield_nrow[bucket_soil_1_id])
-        mju_error("Soil plugin: Inconsistent number of rows between "
-            "``terrain`` and ``bucket soil 1`` HFields");
-    if (m->hfield_nrow[terrain_id] != m->hfield_nrow[bucket_soil_2_id])
-        mju_error("Soil plugin: Inconsistent number of rows between "
-            "``terrain`` and ``bucket soil 2`` HFields");
-    if (m->hfield_ncol[terrain_id] != m->hfield_ncol[bucket_soil_1_id])
-        mju_error("Soil plugin: Inconsistent number of columns between "
-            "``terrain`` and ``bucket soil 1`` HFields");
-    if (m->hfield_ncol[terrain_id] != m->hfield_ncol[bucket_soil_2_id])
-        mju_error("Soil plugin: Inconsistent number of columns between "
-            "``terrain`` and ``bucket soil 2`` HFields");
-    if (m->hfield_size[4*terrain_id] != m->hfield_size[4*bucket_soil_1_id])
-        mju_error("Soil plugin: Inconsistent size in the X direction between "
-            "``terrain`` and ``bucket soil 1`` HFields");
-    if (m->hfield_size[4*terrain_id] != m->hfield_size[4*bucket_soil_2_id])
-        mju_error("Soil plugin: Inconsistent size in the X direction between "
-            "``terrain`` and ``bucket soil 2`` HFields");
-    if (m->hfield_size[4*terrain_id+1] != m->hfield_size[4*bucket_soil_1_id+1])
-        mju_error("Soil plugin: Inconsistent size in the Y direction between "
-            "``terrain`` and ``bucket soil 1`` HFields");
-    if (m->hfield_size[4*terrain_id+1] != m->hfield_size[4*bucket_soil_2_id+1])
-        mju_error("Soil plugin: Inconsistent size in the Y direction between "
-            "``terrain`` and ``bucket soil 2`` HFields");
+    // The bucket soil HFields either cover the whole terrain or are a square
+    // window following the bucket
+    const int* nrow = m->hfield_nrow;
+    const int* ncol = m->hfield_ncol;
+    const mjtNum* size = m->hfield_size;
+    bool bucket_window = (
+        (nrow[terrain_id] != nrow[bucket_soil_1_id]) ||
+        (ncol[terrain_id] != ncol[bucket_soil_1_id]));
+    if (!bucket_window) {
+        if (nrow[terrain_id] != nrow[bucket_soil_2_id])
+            mju_error("Soil plugin: Inconsistent number of rows between "
+                "``terrain`` and ``bucket soil 2`` HFields");
+        if (ncol[terrain_id] != ncol[bucket_soil_2_id])
+            mju_error("Soil plugin: Inconsistent number of columns between "
+                "``terrain`` and ``bucket soil 2`` HFields");
+        if (size[4*terrain_id] != size[4*bucket_soil_1_id])
+            mju_error("Soil plugin: Inconsistent size in the X direction "
+                "between ``terrain`` and ``bucket soil 1`` HFields");
+        if (size[4*terrain_id] != size[4*bucket_soil_2_id])
+            mju_error("Soil plugin: Inconsistent size in the X direction "
+                "between ``terrain`` and ``bucket soil 2`` HFields");
+        if (size[4*terrain_id+1] != size[4*bucket_soil_1_id+1])
+            mju_error("Soil plugin: Inconsistent size in the Y direction "
+                "between ``terrain`` and ``bucket soil 1`` HFields");
+        if (size[4*terrain_id+1] != size[4*bucket_soil_2_id+1])
+            mju_error("Soil plugin: Inconsistent size in the Y direction "
+                "between ``terrain`` and ``bucket soil 2`` HFields");
+    } else {
+        int soil_1_id = mj_name2id(m, mjOBJ_BODY, "soil 1");
+        int soil_2_id = mj_name2id(m, mjOBJ_BODY, "soil 2");
+        if (nrow[bucket_soil_1_id] != ncol[bucket_soil_1_id])
+            mju_error("Soil plugin: The ``bucket soil 1`` HField window "
+                "should be square");
+        if (nrow[bucket_soil_1_id] != nrow[bucket_soil_2_id])
+            mju_error("Soil plugin: Inconsistent number of rows between "
+                "``bucket soil 1`` and ``bucket soil 2`` HFields");
+        if (ncol[bucket_soil_1_id] != ncol[bucket_soil_2_id])
+            mju_error("Soil plugin: Inconsistent number of columns between "
+                "``bucket soil 1`` and ``bucket soil 2`` HFields");
+        if ((nrow[bucket_soil_1_id] > nrow[terrain_id]) ||
+            (ncol[bucket_soil_1_id] > ncol[terrain_id]))
+            mju_error("Soil plugin: The bucket soil HField window is larger "
+                "than the ``terrain`` HField");
+        if ((soil_1_id == -1) || (m->body_mocapid[soil_1_id] == -1))
+            mju_error("Soil plugin: A mocap ``soil 1`` body is required when "
+                "using a bucket soil HField window");
+        if ((soil_2_id == -1) || (m->body_mocapid[soil_2_id] == -1))
+            mju_error("Soil plugin: A mocap ``soil 2`` body is required when "
+                "using a bucket soil HField window");
+    }
     if (m->hfield_size[4*terrain_id+2] != m->hfield_size[4*bucket_soil_1_id+2])
         mju_error("Soil plugin: Inconsistent size in the Z direction between "
             "``terrain`` and ``bucket soil 1`` HFields");
@@ -132,6 +160,19 @@ Soil::Soil(const mjModel* m, mjData* d, int instance) {
     bucket_soil_1_id = mj_name2id(m, mjOBJ_HFIELD, "bucket soil 1");
     bucket_soil_2_id = mj_name2id(m, mjOBJ_HFIELD, "bucket soil 2");
 
+    // Determining whether the bucket soil HFields are a window
+    bucket_window = (
+        (m->hfield_nrow[terrain_id] != m->hfield_nrow[bucket_soil_1_id]) ||
+        (m->hfield_ncol[terrain_id] != m->hfield_ncol[bucket_soil_1_id]));
+    soil_1_mocap_id = -1;
+    soil_2_mocap_id = -1;
+    if (bucket_window) {
+        int soil_1_id = mj_name2id(m, mjOBJ_BODY, "soil 1");
+        int soil_2_id = mj_name2id(m, mjOBJ_BODY, "soil 2");
+        soil_1_mocap_id = m->body_mocapid[soil_1_id];
+        soil_2_mocap_id = m->body_mocapid[soil_2_id];
+    }
+
     // Calculating geometry of the grid
     int* length_x = m->hfield_nrow;
     mjtNum grid_size_x = m->hfield_size[0];
@@ -164,6 +205,8 @@ Soil::Soil(const mjModel* m, mjData* d, int instance) {
     int size = mj_stateSize(m, spec);
     std::vector<mjtNum> soil_state(size);
     soil_state[0] = -1.0;
+    soil_state[3] = -1.0;
+    soil_state[5] = -1.0;
     mj_setState(m, d, soil_state.data(), spec);
 
     // Setting initial terrain
@@ -186,6 +229,9 @@ Soil::Soil(const mjModel* m, mjData* d, int instance) {
 
 // Plugin compute
 void Soil::Compute(const mjModel* m, mjData* d, int instance) {
+    // Starting the measure of the compute time
+    auto start_time = std::chrono::steady_clock::now();
+
     // Getting bucket position and orientation
     std::vector<float> pos = {
         static_cast<float>(d->xpos[3*bucket_id]),
@@ -201,6 +247,12 @@ void Soil::Compute(const mjModel* m, mjData* d, int instance) {
     bool soil_update = sim.Step(
         sim_out, pos, ori, grid, bucket, sim_param, 1e-5);
 
+    // Area of the terrain changed during this step, empty by default
+    int ii_changed_min = 0;
+    int ii_changed_max = -1;
+    int jj_changed_min = 0;
+    int jj_changed_max = -1;
+
     if (soil_update) {
         // Allowing the visual update of the terrain
         int spec = mjSTATE_PLUGIN;
@@ -220,8 +272,26 @@ void Soil::Compute(const mjModel* m, mjData* d, int instance) {
                 int new_index = m->hfield_nrow[terrain_id] * jj + ii;
 
                 // Updating the terrain hfield
-                m->hfield_data[new_index] = (
+                float terrain_height = (
                     sim_out->terrain_[ii][jj] / m->hfield_size[2]);
+                if (m->hfield_data[new_index] != terrain_height) {
+                    // Extending the changed area
+                    if (ii_changed_max == -1) {
+                        ii_changed_min = ii;
+                        ii_changed_max = ii;
+                        jj_changed_min = jj;
+                        jj_changed_max = jj;
+                    } else {
+                        ii_changed_min = std::min(ii_changed_min, ii);
+                        ii_changed_max = std::max(ii_changed_max, ii);
+                        jj_changed_max = jj;
+                    }
+                    m->hfield_data[new_index] = terrain_height;
+                }
+
+                // The bucket soil hfields window is updated separately
+                if (bucket_window)
+                    continue;
 
                 // Updating the bucket soil 1 hfield if necessary
                 if (
@@ -248,7 +318,123 @@ void Soil::Compute(const mjModel* m, mjData* d, int instance) {
                 }
             }
         }
+
+        // Updating the bucket soil hfields window
+        if (bucket_window)
+            UpdateBucketSoilWindow(m, d);
     }
+
+    // Storing the area of the terrain changed during this step
+    mjtNum* plugin_state = d->plugin_state + m->plugin_stateadr[instance];
+    plugin_state[2] = ii_changed_min;
+    plugin_state[3] = ii_changed_max;
+    plugin_state[4] = jj_changed_min;
+    plugin_state[5] = jj_changed_max;
+
+    // Storing the compute time in the second plugin state
+    plugin_state[1] = (
+        std::chrono::duration<mjtNum>(
+            std::chrono::steady_clock::now() - start_time).count());
+}
+
+// Updates the bucket soil HFields when they are a window following the bucket
+void Soil::UpdateBucketSoilWindow(const mjModel* m, mjData* d) {
+    // Calculating geometry of the grid, following the constructor convention
+    int n_cell_x = m->hfield_ncol[terrain_id];
+    int n_cell_y = m->hfield_nrow[terrain_id];
+    mjtNum grid_size_x = m->hfield_size[4*terrain_id];
+    mjtNum grid_size_y = m->hfield_size[4*terrain_id+1];
+    mjtNum cell_size_xy = 2.0 * grid_size_x / m->hfield_nrow[terrain_id];
+    int n_window = m->hfield_ncol[bucket_soil_1_id];
+    int half_window = n_window / 2;
+
+    // Determining the first cell of the window, centered on the bucket
+    int ii_min = static_cast<int>(std::round(
+        (d->xpos[3*bucket_id] + grid_size_x) / cell_size_xy)) - half_window;
+    int jj_min = static_cast<int>(std::round(
+        (d->xpos[3*bucket_id+1] + grid_size_y) / cell_size_xy)) - half_window;
+    ii_min = std::clamp(ii_min, 0, n_cell_x - n_window);
+    jj_min = std::clamp(jj_min, 0, n_cell_y - n_window);
+
+    // Moving the bucket soil bodies to the center of the window
+    // The window is aligned with the vertices of the terrain HField
+    mjtNum x_window = -grid_size_x + (
+        2.0 * grid_size_x * (ii_min + half_window) / (n_cell_x - 1));
+    mjtNum y_window = -grid_size_y + (
+        2.0 * grid_size_y * (jj_min + half_window) / (n_cell_y - 1));
+    d->mocap_pos[3*soil_1_mocap_id] = x_window;
+    d->mocap_pos[3*soil_1_mocap_id+1] = y_window;
+    d->mocap_pos[3*soil_2_mocap_id] = x_window;
+    d->mocap_pos[3*soil_2_mocap_id+1] = y_window;
+
+    // Updating the bucket soil hfields
+    int bucket_soil_1_adr = m->hfield_adr[bucket_soil_1_id];
+    int bucket_soil_2_adr = m->hfield_adr[bucket_soil_2_id];
+    for (auto jj = 0; jj < n_window; jj++) {
+        for (auto ii = 0; ii < n_window; ii++) {
+            // Calculating index for the bucket soil hfields and the grid
+            int new_index = n_window * jj + ii;
+            int ii_grid = ii_min + ii;
+            int jj_grid = jj_min + jj;
+
+            // Updating the bucket soil 1 hfield
+            if (
+                (sim_out->body_soil_[0][ii_grid][jj_grid] != 0.0) ||
+                (sim_out->body_soil_[1][ii_grid][jj_grid] != 0.0)) {
+                m->hfield_data[bucket_soil_1_adr + new_index] = (
+                    sim_out->body_soil_[1][ii_grid][jj_grid] /
+                    m->hfield_size[2]);
+            } else {
+                m->hfield_data[bucket_soil_1_adr + new_index] = mjMAXVAL;
+            }
+
+            // Updating the bucket soil 2 hfield
+            if (
+                (sim_out->body_soil_[2][ii_grid][jj_grid] != 0.0) ||
+                (sim_out->body_soil_[3][ii_grid][jj_grid] != 0.0)) {
+                m->hfield_data[bucket_soil_2_adr + new_index] = (
+                    sim_out->body_soil_[3][ii_grid][jj_grid] /
+                    m->hfield_size[2]);
+            } else {
+                m->hfield_data[bucket_soil_2_adr + new_index] = mjMAXVAL;
+            }
+        }
+    }
+}
+
+// Plugin reset
+// The terrain is read from the terrain HField so that it can be set beforehand
+void Soil::Reset(const mjModel* m, mjtNum* plugin_state) {
+    for (auto jj = 0; jj < m->hfield_nrow[terrain_id]; jj++) {
+        for (auto ii = 0; ii < m->hfield_ncol[terrain_id]; ii++) {
+            // Calculating index for the terrain hfield
+            int new_index = m->hfield_nrow[terrain_id] * jj + ii;
+
+            // Updating the terrain
+            sim_out->terrain_[ii][jj] = (
+                m->hfield_data[new_index] * m->hfield_size[2]);
+
+            // Emptying the bucket
+            for (auto& body_soil_layer : sim_out->body_soil_)
+                body_soil_layer[ii][jj] = 0.0;
+        }
+    }
+
+    // Emptying the bucket soil hfields
+    for (int hfield_id : {bucket_soil_1_id, bucket_soil_2_id}) {
+        int n_hfield = m->hfield_nrow[hfield_id] * m->hfield_ncol[hfield_id];
+        std::fill_n(
+            m->hfield_data + m->hfield_adr[hfield_id], n_hfield, mjMAXVAL);
+    }
+
+    // Allowing the visual update of the terrain
+    plugin_state[0] = 1.0;
+
+    // The terrain HField is not changed by the reset
+    plugin_state[2] = 0.0;
+    plugin_state[3] = -1.0;
+    plugin_state[4] = 0.0;
+    plugin_state[5] = -1.0;
 }
 
 // Plugin registration
@@ -266,8 +452,8 @@ void Soil::RegisterPlugin() {
     plugin.nattribute = sizeof(attributes) / sizeof(attributes[0]);
     plugin.attributes = attributes;
 
-    // One state
-    plugin.nstate = +[](const mjModel* m, int instance) { return 1; };
+    // Six states: visual update flag, compute time and changed terrain area
+    plugin.nstate = +[](const mjModel* m, int instance) { return 6; };
 
     // Initialization callback
     plugin.init = +[](const mjModel* m, mjData* d, int instance) {
@@ -285,6 +471,16 @@ void Soil::RegisterPlugin() {
         d->plugin_data[instance] = 0;
     };
 
+    // Reset callback
+    plugin.reset = +[](
+        const mjModel* m, mjtNum* plugin_state, void* plugin_data,
+        int instance) {
+            auto* Soil = reinterpret_cast<class Soil*>(plugin_data);
+            if (Soil) {
+                Soil->Reset(m, plugin_state);
+            }
+        };
+
     // Compute callback
     plugin.compute =
         +[](const mjModel* m, mjData* d, int instance, int capability_bit) {
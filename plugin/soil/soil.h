@@ -23,12 +23,19 @@ class Soil {
 
      void Compute(const mjModel* m, mjData* d, int instance);
 
+     void UpdateBucketSoilWindow(const mjModel* m, mjData* d);
+
+     void Reset(const mjModel* m, mjtNum* plugin_state);
+
      static void RegisterPlugin();
 
      int bucket_id;
      int terrain_id;
      int bucket_soil_1_id;
      int bucket_soil_2_id;
+     bool bucket_window;
+     int soil_1_mocap_id;
+     int soil_2_mocap_id;
  private:
      Soil(const mjModel* m, mjData* d, int instance);
      soil_simulator::SoilDynamics sim;